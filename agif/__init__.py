@@ -0,0 +1,24 @@
+import importlib
+from .container import AgifReader, AgifWriter, read_agif, write_agif
+
+# Imported on first use: the encoder needs Pillow and pydub, the asyncio API
+# imports the encoder, and reading containers needs neither
+LAZY_NAMES = {
+    'create_agif': 'encoder',
+    'AgifJobPool': 'aio',
+    'AsyncAgifReader': 'aio',
+    'create_agif_async': 'aio',
+    'read_agif_async': 'aio',
+}
+
+
+def __getattr__(name):
+    if name not in LAZY_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{LAZY_NAMES[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_NAMES))
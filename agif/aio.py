@@ -0,0 +1,163 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from .container import AgifReader
+from .frames import FrameDecoder
+
+# Bytes of frame data copied by a single executor call
+CHUNK_SIZE = 1024 * 1024
+
+
+# Wait for an executor job without cancelling it, e.g. before closing the
+# reader it is using
+async def _settle(future):
+    await asyncio.wait([future])
+    if not future.cancelled():
+        future.exception()
+
+
+# Asyncio counterpart of AgifReader: the file is opened and the frames are
+# copied and decoded on an executor, so the event loop never blocks on disk
+# reads or PNG decoding.
+#
+#     async with await AsyncAgifReader.open(path) as reader:
+#         async for frame in reader:
+#             ...
+#
+# Header attributes (num_frames, width, gif_duration...) and the index methods
+# (entry, frame_at) are those of the underlying AgifReader.
+class AsyncAgifReader:
+    def __init__(self, reader, executor=None):
+        self.reader = reader
+        self.executor = executor
+        self.pending = set()  # executor jobs of the iterators, awaited on close
+
+    @classmethod
+    async def open(cls, file_path, executor=None):
+        loop = asyncio.get_running_loop()
+        reader = await loop.run_in_executor(executor, AgifReader, file_path)
+        return cls(reader, executor)
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __aiter__(self):
+        return self.frames()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    # Yield the items returned by load(start), a list of the items from start
+    # on. The next list is loaded while the current one is consumed, and no
+    # further: a slow consumer holds back the executor (backpressure).
+    async def _pipeline(self, load):
+        loop = asyncio.get_running_loop()
+
+        def submit(start):
+            future = loop.run_in_executor(self.executor, load, start)
+            self.pending.add(future)
+            future.add_done_callback(self.pending.discard)
+            return future
+
+        start = 0
+        future = submit(start) if len(self.reader) else None
+        try:
+            while future is not None:
+                items = await future
+                start += len(items)
+                future = submit(start) if start < len(self.reader) else None
+                for item in items:
+                    yield item
+        finally:
+            if future is not None:
+                await _settle(future)
+
+    def _copy_frames(self, start):
+        frames = []
+        size = 0
+        for index in range(start, len(self.reader)):
+            if frames and size + self.reader.entry(index).size > CHUNK_SIZE:
+                break
+            frames.append(bytes(self.reader.frame(index)))
+            size += len(frames[-1])
+        return frames
+
+    # Encoded frames as bytes, copied in chunks of about CHUNK_SIZE bytes
+    def frames(self):
+        return self._pipeline(self._copy_frames)
+
+    # Decoded frames as PIL images, decoded `batch` frames at a time
+    def images(self, batch=4):
+        decoder = FrameDecoder(self.reader)
+
+        def decode(start):
+            return [decoder.decode(index) for index in range(start, min(start + batch, len(self.reader)))]
+        return self._pipeline(decode)
+
+    async def frame(self, index):
+        return await self._run(lambda: bytes(self.reader.frame(index)))
+
+    async def audio(self):
+        return await self._run(lambda: bytes(self.reader.audio()))
+
+    # Iterators left before their end may still be loading from the reader
+    async def close(self):
+        for future in list(self.pending):
+            await _settle(future)
+        await self._run(self.reader.close)
+
+
+# Asyncio counterpart of read_agif
+async def read_agif_async(file_path, executor=None):
+    async with await AsyncAgifReader.open(file_path, executor) as reader:
+        frames = [frame async for frame in reader]
+        mp3_data = await reader.audio()
+    return frames, mp3_data
+
+
+# Asyncio counterpart of create_agif, run on an executor (the default one of
+# the event loop when None). Takes the same options as create_agif.
+async def create_agif_async(gif_path, mp3_path, output_path, executor=None, **options):
+    from .encoder import create_agif
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, partial(create_agif, gif_path, mp3_path, output_path, **options))
+
+
+# Pool for running many conversions from asyncio: jobs run on `workers`
+# threads, or processes with processes=True (PNG compression and MP3 decoding
+# mostly hold the GIL), and at most `queue_size` jobs (2 per worker by default)
+# are submitted at once. Further callers wait in create() until a job ends, so
+# hundreds of concurrent requests never pile up in the executor queue.
+class AgifJobPool:
+    def __init__(self, workers=None, processes=False, queue_size=None):
+        workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(workers) if processes else ThreadPoolExecutor(workers)
+        self.slots = asyncio.Semaphore(queue_size or 2 * workers)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def run(self, func, *args, **kwargs):
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def create(self, gif_path, mp3_path, output_path, **options):
+        from .encoder import create_agif
+        await self.run(create_agif, gif_path, mp3_path, output_path, **options)
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
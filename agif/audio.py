@@ -0,0 +1,167 @@
+import hashlib
+import io
+import os
+import time
+
+# Without the banner pygame prints on import
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import pygame
+from .mp3 import mp3_info
+
+# Total size of the PCM cache on disk, the least recently used files are
+# removed above it
+DEFAULT_CACHE_BUDGET = 512 * 1024 * 1024
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'agif', 'pcm')
+
+
+# Duration of the audio of a reader in ms: from the header, or from the MP3
+# frame headers for files written without it. Nothing is decoded.
+def audio_duration(reader):
+    if reader.audio_duration:
+        return reader.audio_duration
+    audio = bytes(reader.audio())
+    return mp3_info(audio).duration if audio else 0
+
+
+# Decoded PCM of MP3 data in the format of the mixer, which must be
+# initialized. With a cache_dir, decoded audio is stored there keyed by the
+# hash of the MP3 data and the mixer format, so opening the same audio again
+# skips decoding.
+def load_pcm(mp3_data, cache_dir=None, cache_budget=DEFAULT_CACHE_BUDGET):
+    cache_path = None
+    if cache_dir is not None:
+        frequency, size, channels = pygame.mixer.get_init()
+        key = hashlib.sha256(mp3_data).hexdigest()
+        cache_path = os.path.join(cache_dir, f"{key}-{frequency}-{size}-{channels}.pcm")
+        try:
+            with open(cache_path, 'rb') as f:
+                pcm = f.read()
+            os.utime(cache_path)
+            return pcm
+        except OSError:
+            pass
+
+    pcm = pygame.mixer.Sound(file=io.BytesIO(mp3_data)).get_raw()
+
+    if cache_path is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            temporary = cache_path + '.part'
+            with open(temporary, 'wb') as f:
+                f.write(pcm)
+            os.replace(temporary, cache_path)
+            prune_cache(cache_dir, cache_budget)
+        except OSError:
+            # The cache is only an optimization
+            pass
+    return pcm
+
+
+def prune_cache(cache_dir, budget=DEFAULT_CACHE_BUDGET):
+    files = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pcm'):
+            stat = os.stat(os.path.join(cache_dir, name))
+            files.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for mtime, size, name in files)
+    for mtime, size, name in sorted(files):
+        if total <= budget:
+            break
+        os.remove(os.path.join(cache_dir, name))
+        total -= size
+
+
+# Audio backend playing decoded PCM on a mixer channel: starting it is
+# immediate and the position is exact, unlike pygame.mixer.music which decodes
+# the MP3 while playing. position() is the playback position in ms, counted
+# across loops, -1 before play(). length is the exact duration of the decoded
+# audio in ms, the loop period of the sound. Without a channel, the sound plays
+# on any free channel of the mixer.
+class SoundPlayer:
+    def __init__(self, mp3_data, cache_dir=None, channel=None):
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        self.sound = pygame.mixer.Sound(buffer=load_pcm(mp3_data, cache_dir))
+        self.length = int(self.sound.get_length() * 1000)
+        self.channel = channel
+        self.start = None
+
+    def play(self, loops=-1):
+        if self.channel is not None:
+            self.channel.play(self.sound, loops)
+        else:
+            self.channel = self.sound.play(loops)
+        self.start = time.monotonic()
+
+    def position(self):
+        if self.start is None:
+            return -1
+        return int((time.monotonic() - self.start) * 1000)
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.stop()
+        self.start = None
+
+
+# One pygame mixer shared by several players: each SoundPlayer gets a channel
+# of its own, reserved so that sounds played by others never take it, and
+# the channels of released players are reused. The mixer is never closed
+# here, closing one player leaves the others playing.
+class Mixer:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.reserved = 0
+        self.free = []
+        self.numbers = {}  # channel number of each player
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def player(self, mp3_data):
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        if self.free:
+            number = self.free.pop()
+        else:
+            number = self.reserved
+            self.reserved += 1
+            if pygame.mixer.get_num_channels() < self.reserved:
+                pygame.mixer.set_num_channels(self.reserved)
+            pygame.mixer.set_reserved(self.reserved)
+        try:
+            player = SoundPlayer(mp3_data, self.cache_dir, pygame.mixer.Channel(number))
+        except Exception:
+            self.free.append(number)
+            raise
+        self.numbers[player] = number
+        return player
+
+    def release(self, player):
+        player.stop()
+        self.free.append(self.numbers.pop(player))
+
+
+# Audio backend on pygame.mixer.music, which decodes while playing: for audio
+# that is still being received (a file object of AgifStreamReader.audio_file).
+# Its length is not known before the end.
+class MusicPlayer:
+    length = 0
+
+    def __init__(self, source):
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        pygame.mixer.music.load(source if hasattr(source, 'read') else io.BytesIO(source))
+
+    def play(self, loops=-1):
+        pygame.mixer.music.play(loops)
+
+    def position(self):
+        return pygame.mixer.music.get_pos()
+
+    def stop(self):
+        pygame.mixer.music.stop()
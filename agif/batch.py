@@ -0,0 +1,164 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .container import AgifReader
+from .encoder import create_agif
+
+MANIFEST_FIELDS = ('gif', 'mp3', 'output')
+
+
+# Read a manifest of conversions: a CSV file with gif, mp3 and output columns,
+# or a JSON lines file (.jsonl) with the same keys. Relative paths are taken
+# from the directory of the manifest.
+def read_manifest(manifest_path):
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline='') as f:
+        if manifest_path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    jobs = []
+    for number, row in enumerate(rows, 1):
+        missing = [field for field in MANIFEST_FIELDS if not row.get(field)]
+        if missing:
+            raise ValueError(f"Manifest entry {number} has no {', '.join(missing)}")
+        jobs.append({field: os.path.join(base, row[field]) for field in MANIFEST_FIELDS})
+    return jobs
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Signature of the inputs and options of a job: size and mtime of the inputs,
+# or their content hash with use_hash
+def job_signature(job, options, use_hash=False):
+    parts = [json.dumps(options, sort_keys=True)]
+    for field in ('gif', 'mp3'):
+        if use_hash:
+            parts.append(file_hash(job[field]))
+        else:
+            stat = os.stat(job[field])
+            parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+# Signatures of the outputs converted by previous runs
+def load_journal(journal_path):
+    done = {}
+    if os.path.exists(journal_path):
+        with open(journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    done[entry['output']] = entry['signature']
+                except (ValueError, KeyError):
+                    # A line cut by an interrupted run
+                    continue
+    return done
+
+
+# Convert a single job. The file is written under a temporary name and renamed
+# when complete, so an interrupted job never leaves an output behind.
+def run_job(job, options):
+    start = time.perf_counter()
+    temporary = job['output'] + '.part'
+    os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+    try:
+        create_agif(job['gif'], job['mp3'], temporary, **options)
+        os.replace(temporary, job['output'])
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    seconds = time.perf_counter() - start
+
+    with AgifReader(job['output']) as reader:
+        frames = len(reader)
+    return {
+        'output': job['output'],
+        'frames': frames,
+        'seconds': seconds,
+        'input_bytes': os.path.getsize(job['gif']) + os.path.getsize(job['mp3']),
+        'output_bytes': os.path.getsize(job['output']),
+    }
+
+
+def format_result(result):
+    seconds = max(result['seconds'], 1e-9)
+    return (f"ok    {result['output']}  {result['frames']} frames  {result['seconds']:.2f} s  "
+            f"{result['frames'] / seconds:.1f} frames/s  {result['input_bytes'] / seconds / 1e6:.2f} MB/s")
+
+
+# Convert every job of a manifest over a pool of worker processes. Jobs whose
+# output was already written from the same inputs and options (as recorded in
+# the journal) are skipped, so a failed or interrupted run can be resumed by
+# running it again. Returns a summary of the run.
+def convert_manifest(manifest_path, options=None, workers=None, journal_path=None, use_hash=False,
+                     log=print):
+    options = options or {}
+    journal_path = journal_path or manifest_path + '.journal'
+    done = load_journal(journal_path)
+    start = time.perf_counter()
+    summary = {'converted': 0, 'skipped': 0, 'failed': 0, 'frames': 0, 'input_bytes': 0, 'output_bytes': 0}
+
+    pending = []
+    for job in read_manifest(manifest_path):
+        try:
+            signature = job_signature(job, options, use_hash)
+        except OSError as e:
+            summary['failed'] += 1
+            log(f"FAIL  {job['output']}  {e}")
+            continue
+        if done.get(job['output']) == signature and os.path.exists(job['output']):
+            summary['skipped'] += 1
+            log(f"skip  {job['output']}")
+        else:
+            pending.append((job, signature))
+
+    def record(job, signature, result):
+        journal.write(json.dumps({'output': job['output'], 'signature': signature}) + '\n')
+        journal.flush()
+        summary['converted'] += 1
+        for key in ('frames', 'input_bytes', 'output_bytes'):
+            summary[key] += result[key]
+        log(format_result(result))
+
+    def fail(job, error):
+        summary['failed'] += 1
+        log(f"FAIL  {job['output']}  {error}")
+
+    with open(journal_path, 'a') as journal:
+        if workers == 1:
+            for job, signature in pending:
+                try:
+                    result = run_job(job, options)
+                except Exception as e:
+                    fail(job, e)
+                else:
+                    record(job, signature, result)
+        elif pending:
+            with ProcessPoolExecutor(workers) as executor:
+                futures = {executor.submit(run_job, job, options): (job, signature) for job, signature in pending}
+                for future in as_completed(futures):
+                    job, signature = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        fail(job, e)
+                    else:
+                        record(job, signature, result)
+
+    summary['seconds'] = time.perf_counter() - start
+    seconds = max(summary['seconds'], 1e-9)
+    log(f"{summary['converted']} converted, {summary['skipped']} skipped, {summary['failed']} failed "
+        f"in {summary['seconds']:.2f} s  ({summary['converted'] / seconds:.2f} files/s, "
+        f"{summary['frames'] / seconds:.1f} frames/s, {summary['input_bytes'] / seconds / 1e6:.2f} MB/s)")
+    return summary
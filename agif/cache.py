@@ -0,0 +1,177 @@
+import itertools
+import threading
+from collections import OrderedDict
+from . import instrument
+from .frames import FrameDecoder
+
+# Default memory budget of a frame cache, in bytes
+DEFAULT_BUDGET = 64 * 1024 * 1024
+
+
+# Memory used by the pixels of a decoded PIL image
+def image_size(image):
+    return image.width * image.height * len(image.getbands())
+
+
+# Least recently used cache bounded by the total size of its values in bytes.
+# Not thread safe: callers sharing it between threads must lock around it.
+class LruCache:
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, value, size):
+        if key in self.items:
+            self.size -= self.items.pop(key)[1]
+        self.items[key] = (value, size)
+        self.size += size
+        # The newest value is always kept, even when it is over budget alone
+        while self.size > self.budget and len(self.items) > 1:
+            evicted_key, (evicted, evicted_size) = self.items.popitem(last=False)
+            self.size -= evicted_size
+
+    def clear(self):
+        self.items.clear()
+        self.size = 0
+
+
+# LruCache shared by several owners (the players of a PlaybackManager) under a
+# single budget. Each view() is used like an LruCache of its own, with its keys
+# apart from the others; the lock makes it safe from the prefetch threads of
+# all of them.
+class SharedCache:
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.cache = LruCache(budget)
+        self.lock = threading.Lock()
+        self.owners = itertools.count()
+
+    def __len__(self):
+        return len(self.cache)
+
+    @property
+    def size(self):
+        return self.cache.size
+
+    def view(self):
+        return CacheView(self, next(self.owners))
+
+
+class CacheView:
+    def __init__(self, shared, owner):
+        self.shared = shared
+        self.owner = owner
+
+    def __contains__(self, key):
+        with self.shared.lock:
+            return (self.owner, key) in self.shared.cache
+
+    def get(self, key):
+        with self.shared.lock:
+            return self.shared.cache.get((self.owner, key))
+
+    def put(self, key, value, size):
+        with self.shared.lock:
+            self.shared.cache.put((self.owner, key), value, size)
+
+    # Remove the values of this owner only
+    def clear(self):
+        cache = self.shared.cache
+        with self.shared.lock:
+            for key in [key for key in cache.items if key[0] == self.owner]:
+                cache.size -= cache.items.pop(key)[1]
+
+
+# Lazy access to the decoded frames of an AgifReader, usable like a list of
+# PIL images. Frames are decoded on first access and kept in an LRU cache
+# bounded by budget bytes; after each access the next `prefetch` frames
+# (wrapping around, for looped playback) are decoded on a background thread.
+# With a cache (a view of a SharedCache), budget is ignored and the frames are
+# kept in it.
+class FrameProvider:
+    def __init__(self, reader, budget=DEFAULT_BUDGET, prefetch=8, cache=None):
+        self.reader = reader
+        self.decoder = FrameDecoder(reader)
+        self.cache = LruCache(budget) if cache is None else cache
+        self.prefetch = prefetch
+        self.lock = threading.Lock()  # guards the decoder and the cache
+        self.condition = threading.Condition()
+        self.next_index = None
+        self.closed = False
+        self.thread = None
+        if prefetch:
+            self.thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+            self.thread.start()
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self.reader):
+            raise IndexError(f"Frame {index} out of range")
+        image = self._load(index)
+        if self.thread is not None:
+            with self.condition:
+                self.next_index = index + 1
+                self.condition.notify()
+        return image
+
+    def _load(self, index):
+        with self.lock:
+            image = self.cache.get(index)
+            if image is None:
+                instrument.count('cache.miss')
+                image = self.decoder.decode(index)
+                self.cache.put(index, image, image_size(image))
+            else:
+                instrument.count('cache.hit')
+            return image
+
+    def _prefetch_loop(self):
+        while True:
+            with self.condition:
+                while self.next_index is None and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                start, self.next_index = self.next_index, None
+
+            for offset in range(min(self.prefetch, len(self.reader))):
+                index = (start + offset) % len(self.reader)
+                with self.lock:
+                    if self.closed:
+                        return
+                    if index not in self.cache:
+                        try:
+                            image = self.decoder.decode(index)
+                        except Exception:
+                            # The error is raised when the frame is requested
+                            break
+                        self.cache.put(index, image, image_size(image))
+                # A newer request restarts the prefetch from its position
+                if self.next_index is not None:
+                    break
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,226 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .container import (CODEC_GIF, CODEC_LZ4, CODEC_LZMA, CODEC_PNG, CODEC_ZLIB, CODEC_ZSTD, FRAME_DELTA,
+                        OPTION_CHECKSUMS, OPTION_LOOP, AgifReader)
+
+# Default path of the catalog database
+DEFAULT_CATALOG = 'agif-catalog.db'
+
+# Rows written to the database per transaction during a scan
+SCAN_BATCH_SIZE = 500
+
+# Names of the codecs, without importing agif.codecs (and Pillow)
+CODEC_LABELS = {CODEC_PNG: 'png', CODEC_GIF: 'gif', CODEC_ZLIB: 'zlib', CODEC_LZMA: 'lzma', CODEC_ZSTD: 'zstd',
+                CODEC_LZ4: 'lz4'}
+
+# One row per .agif file, keyed by its absolute path. mtime_ns and size tell
+# whether the file changed since it was scanned; error is set (and the
+# metadata NULL) for files that could not be read.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    version INTEGER,
+    frames INTEGER,
+    keyframes INTEGER,
+    width INTEGER,
+    height INTEGER,
+    gif_duration INTEGER,
+    audio_duration INTEGER,
+    audio_size INTEGER,
+    loop INTEGER,
+    checksums INTEGER,
+    codecs TEXT,
+    error TEXT,
+    scanned REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_frames ON files (frames);
+CREATE INDEX IF NOT EXISTS files_gif_duration ON files (gif_duration);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+'''
+
+COLUMNS = ('path', 'mtime_ns', 'size', 'version', 'frames', 'keyframes', 'width', 'height', 'gif_duration',
+           'audio_duration', 'audio_size', 'loop', 'checksums', 'codecs', 'error', 'scanned')
+
+# Groups of the aggregate() statistics, as SQL expressions
+GROUPS = {
+    'version': 'version',
+    'codecs': 'codecs',
+    'dimensions': "width || 'x' || height",
+    'loop': 'loop',
+    'status': "CASE WHEN error IS NULL THEN 'ok' ELSE 'error' END",
+}
+
+
+# Row of the catalog for a file, from its header and index only: frames and
+# audio are never read (version 1 and 3 files have no index, the reader walks
+# their frame lengths or chunk headers instead)
+def read_metadata(file_path, stat):
+    row = {'path': file_path, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'scanned': time.time()}
+    try:
+        with AgifReader(file_path) as reader:
+            codecs = set()
+            keyframes = 0
+            for index in range(len(reader)):
+                entry = reader.entry(index)
+                codecs.add(entry.codec)
+                keyframes += not entry.flags & FRAME_DELTA
+            row.update(
+                version=reader.version,
+                frames=len(reader),
+                keyframes=keyframes,
+                width=reader.width or None,
+                height=reader.height or None,
+                gif_duration=reader.gif_duration,
+                audio_duration=reader.audio_duration or None,
+                audio_size=reader.audio_size,
+                loop=int(bool(reader.options & OPTION_LOOP)),
+                checksums=int(bool(reader.options & OPTION_CHECKSUMS)),
+                codecs=','.join(sorted(CODEC_LABELS.get(codec, str(codec)) for codec in codecs)),
+            )
+    except (OSError, ValueError, IndexError) as e:
+        row['error'] = str(e) or type(e).__name__
+    return tuple(row.get(column) for column in COLUMNS)
+
+
+# (path, stat) of the .agif files under a directory, from os.scandir
+def iter_agif_files(directory):
+    pending = [directory]
+    while pending:
+        try:
+            entries = sorted(os.scandir(pending.pop()), key=lambda entry: entry.name, reverse=True)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+            elif entry.name.lower().endswith('.agif') and entry.is_file():
+                try:
+                    yield entry.path, entry.stat()
+                except OSError:
+                    pass
+
+
+# Metadata of an .agif library in SQLite, for questions about the whole
+# library (sizes, durations, codecs) without opening its files. Scans are
+# incremental: files whose modification time and size did not change are not
+# read again, and files gone from disk are removed.
+class Catalog:
+    def __init__(self, db_path=DEFAULT_CATALOG):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Rows of the catalog under a path (the path itself for a file)
+    def known(self, path):
+        if not os.path.isdir(path):
+            rows = self.connection.execute('SELECT path, mtime_ns, size FROM files WHERE path = ?', (path,))
+        else:
+            prefix = os.path.join(path, '')
+            # Paths between prefix and the next string after it: an indexed range scan
+            rows = self.connection.execute('SELECT path, mtime_ns, size FROM files WHERE path >= ? AND path < ?',
+                                           (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+        return {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+    # Bring the catalog up to date with the .agif files under the given
+    # paths. The headers of new and changed files are read over a pool of
+    # threads (the work is mostly waiting for the disk); the rows are written
+    # in batches from this thread. Returns a summary of the scan.
+    def scan(self, paths, workers=None, log=print):
+        start = time.perf_counter()
+        summary = {'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+        for path in paths:
+            path = os.path.abspath(path)
+            known = self.known(path)
+            if os.path.isdir(path):
+                files = iter_agif_files(path)
+            else:
+                files = [(path, os.stat(path))] if os.path.isfile(path) else []
+
+            changed = []
+            for file_path, stat in files:
+                previous = known.pop(file_path, None)
+                if previous == (stat.st_mtime_ns, stat.st_size):
+                    summary['unchanged'] += 1
+                else:
+                    summary['updated' if previous else 'added'] += 1
+                    changed.append((file_path, stat))
+
+            with ThreadPoolExecutor(workers) as executor:
+                rows = executor.map(lambda job: read_metadata(*job), changed)
+                batch = []
+                for row in rows:
+                    summary['failed'] += row[COLUMNS.index('error')] is not None
+                    batch.append(row)
+                    if len(batch) == SCAN_BATCH_SIZE:
+                        self.write(batch)
+                        batch = []
+                self.write(batch)
+
+            # Files of the catalog that were not found any more
+            with self.connection:
+                self.connection.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in known))
+            summary['removed'] += len(known)
+
+        summary['seconds'] = time.perf_counter() - start
+        log(f"{summary['added']} added, {summary['updated']} updated, {summary['unchanged']} unchanged, "
+            f"{summary['removed']} removed, {summary['failed']} unreadable in {summary['seconds']:.2f} s")
+        return summary
+
+    def write(self, rows):
+        if not rows:
+            return
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+
+    # Rows matching every condition: SQL expressions on the columns, with ?
+    # placeholders for the parameters. Returns dicts of the given columns.
+    def query(self, conditions=(), parameters=(), columns=COLUMNS, order_by='path', descending=False, limit=None):
+        for column in (*columns, order_by):
+            if column not in COLUMNS:
+                raise ValueError(f"Unknown catalog column: {column}")
+        sql = f"SELECT {', '.join(columns)} FROM files"
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(f'({condition})' for condition in conditions)
+        sql += f" ORDER BY {order_by}{' DESC' if descending else ''}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        try:
+            rows = self.connection.execute(sql, tuple(parameters))
+        except sqlite3.Error as e:
+            raise ValueError(f"Invalid catalog query: {e}")
+        return [dict(zip(columns, row)) for row in rows]
+
+    # Totals of the whole catalog, or of each group (see GROUPS), computed by SQLite
+    def aggregate(self, group_by=None, conditions=(), parameters=()):
+        if group_by is not None and group_by not in GROUPS:
+            raise ValueError(f"Unknown catalog group: {group_by}")
+        group = GROUPS[group_by] if group_by else "'all'"
+        sql = (f"SELECT {group} AS name, COUNT(*), SUM(size), SUM(frames), SUM(gif_duration), "
+               f"SUM(audio_duration), AVG(frames), MAX(frames), AVG(gif_duration), MAX(gif_duration), "
+               f"SUM(error IS NOT NULL) FROM files")
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(f'({condition})' for condition in conditions)
+        sql += ' GROUP BY name ORDER BY COUNT(*) DESC'
+        try:
+            rows = self.connection.execute(sql, tuple(parameters)).fetchall()
+        except sqlite3.Error as e:
+            raise ValueError(f"Invalid catalog query: {e}")
+        keys = ('group', 'files', 'bytes', 'frames', 'gif_duration', 'audio_duration', 'mean_frames', 'max_frames',
+                'mean_gif_duration', 'max_gif_duration', 'errors')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,349 @@
+import argparse
+import os
+import sys
+from contextlib import ExitStack
+
+
+# Codec options of the commands that encode frames
+def add_codec_arguments(parser, default='gif'):
+    parser.add_argument('--codec', default=None,
+                        help=f"frame codec (default: {default}): gif stores the original GIF frames, png "
+                             "re-encodes them, zlib, lzma, zstd and lz4 store raw palette pixels (zstd and lz4 "
+                             "need the zstandard and lz4 packages)")
+    parser.add_argument('--compress-level', type=int, default=None,
+                        help="compression level of the codec (default: the codec's own)")
+    parser.add_argument('--preset', choices=('playback', 'archive'),
+                        help="codec and level for fast decoding (playback) or the smallest files (archive)")
+    parser.add_argument('--layout', choices=('index', 'stream'), default='index',
+                        help="frames then audio with an index (index, default) or audio interleaved with "
+                             "the frames for progressive playback (stream)")
+    parser.add_argument('--bitrate', type=int, default=None,
+                        help="re-encode MP3 files above this bitrate in kbps (needs ffmpeg)")
+
+
+# Options of create_agif shared by the commands that encode
+def add_encoder_arguments(parser):
+    add_codec_arguments(parser)
+    parser.add_argument('--optimize', action='store_true', help="optimize the PNG frames (png codec)")
+    parser.add_argument('--keyframe-interval', type=int, default=None,
+                        help="store delta frames with a keyframe every N frames (not with the gif codec)")
+
+
+# Codec and level of the options
+def codec_options(args, default='gif'):
+    codec, level = args.codec or default, args.compress_level
+    if args.preset:
+        from .codecs import PRESETS
+        preset_codec, preset_level = PRESETS[args.preset]
+        codec = args.codec or preset_codec
+        level = preset_level if level is None and codec == preset_codec else level
+    return codec, level
+
+
+def encoder_options(args):
+    codec, level = codec_options(args)
+    return {
+        'codec': codec,
+        'compress_level': level,
+        'optimize': args.optimize,
+        'keyframe_interval': args.keyframe_interval,
+        'bitrate': args.bitrate,
+        'layout': args.layout,
+    }
+
+
+def command_create(args):
+    from .encoder import create_agif
+    output = args.output
+    if output == '-':
+        if args.layout != 'stream':
+            raise SystemExit("Only the stream layout can be written to standard output")
+        output = sys.stdout.buffer
+    create_agif(args.gif, args.mp3, output, workers=args.workers or None, **encoder_options(args))
+    return 0
+
+
+def command_convert(args):
+    from .batch import convert_manifest
+    summary = convert_manifest(args.manifest, encoder_options(args), args.workers, args.journal, args.hash)
+    return 1 if summary['failed'] else 0
+
+
+def parse_size(text):
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height or width)
+
+
+# Rendition of the transcode command: OUTPUT followed by comma separated
+# options, e.g. small.agif,size=320x240,fps=15,colors=64,crop=0:0:640:480
+def parse_rendition(text):
+    from .transcode import Rendition
+    output_path, *options = text.split(',')
+    values = {}
+    for option in options:
+        name, _, value = option.partition('=')
+        if name == 'size':
+            values['width'], values['height'] = parse_size(value)
+        elif name in ('fps', 'colors'):
+            values[name] = int(value)
+        elif name == 'crop':
+            values['crop'] = tuple(int(number) for number in value.split(':'))
+            if len(values['crop']) != 4:
+                raise ValueError(f"Crop box must be X:Y:WIDTH:HEIGHT, not {value}")
+        else:
+            raise ValueError(f"Unknown rendition option: {name}")
+    return Rendition(output_path, **values)
+
+
+def command_transcode(args):
+    from .transcode import transcode_agif
+    renditions = [parse_rendition(text) for text in args.rendition]
+    codec, level = codec_options(args, 'png')
+    transcode_agif(args.gif, args.mp3, renditions, codec, level, args.bitrate, args.layout)
+    return 0
+
+
+# Frame range of the edit command: N or START:STOP (STOP excluded)
+def parse_range(text):
+    start, _, stop = text.partition(':')
+    return int(start), int(stop) if stop else int(start) + 1
+
+
+def command_edit(args):
+    from .container import CODEC_PNG
+    from .edit import AgifEditor, compact
+    with AgifEditor(args.file) as editor:
+        # Dropped from the last range, so that the earlier frame numbers stay valid
+        for start, stop in sorted((parse_range(text) for text in args.drop or ()), reverse=True):
+            editor.drop_frames(start, stop)
+        for text in args.duration or ():
+            index, _, duration = text.partition('=')
+            editor.set_duration(int(index), int(duration))
+        for image_path in args.append or ():
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            if not data.startswith(b'\x89PNG'):
+                raise ValueError(f"Frames can only be appended from PNG files: {image_path}")
+            editor.append_frame(data, args.append_duration, codec=CODEC_PNG)
+        if args.audio:
+            with open(args.audio, 'rb') as f:
+                editor.set_audio(f.read())
+        if args.loop is not None:
+            editor.set_loop(args.loop == 'on')
+        editor.commit()
+        dead_bytes = editor.dead_bytes
+    if args.compact:
+        compact(args.file)
+    elif dead_bytes:
+        print(f"{dead_bytes} bytes of replaced data, reclaimed with --compact", file=sys.stderr)
+    return 0
+
+
+def command_thumbnail(args):
+    from .thumbnails import thumbnail_directory, write_thumbnail
+    size = parse_size(args.size)
+    if os.path.isdir(args.input):
+        summary = thumbnail_directory(args.input, args.output or args.input, size, args.frame, args.time,
+                                      args.sheet, args.workers)
+        return 1 if summary['failed'] else 0
+    output = args.output or os.path.splitext(args.input)[0] + '.png'
+    write_thumbnail(args.input, output, size, args.frame, args.time, args.sheet)
+    return 0
+
+
+def command_export(args):
+    from .export import EXPORT_FORMATS, export_directory, export_file
+    formats = tuple(text.strip() for text in args.format.split(','))
+    for export_format in formats:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {export_format}")
+    if os.path.isdir(args.input):
+        summary = export_directory(args.input, args.output or args.input, formats, args.workers)
+        return 1 if summary['failed'] else 0
+    export_file(args.input, os.path.splitext(args.output or args.input)[0], formats)
+    return 0
+
+
+def command_catalog(args):
+    from .catalog import Catalog
+    conditions, parameters = [], []
+    for option, condition in (('min_frames', 'frames >= ?'), ('max_frames', 'frames <= ?'),
+                              ('min_duration', 'gif_duration >= ?'), ('max_duration', 'gif_duration <= ?')):
+        value = getattr(args, option, None)
+        if value is not None:
+            conditions.append(condition)
+            parameters.append(value)
+    if getattr(args, 'codec', None):
+        conditions.append("',' || codecs || ',' LIKE ?")
+        parameters.append(f"%,{args.codec},%")
+    if getattr(args, 'errors', False):
+        conditions.append('error IS NOT NULL')
+    if getattr(args, 'where', None):
+        conditions.append(args.where)
+
+    with Catalog(args.db) as catalog:
+        if args.action == 'scan':
+            summary = catalog.scan(args.paths, args.workers)
+            return 1 if summary['failed'] else 0
+        if args.action == 'query':
+            columns = ('path', 'frames', 'gif_duration', 'width', 'height', 'size', 'codecs', 'error')
+            for row in catalog.query(conditions, parameters, columns, args.sort, args.desc, args.limit):
+                if row['error']:
+                    print(f"{row['path']}\terror: {row['error']}")
+                else:
+                    print(f"{row['path']}\t{row['frames']} frames\t{row['gif_duration']} ms\t"
+                          f"{row['width'] or '?'}x{row['height'] or '?'}\t{row['size']} bytes\t{row['codecs']}")
+            return 0
+        print(f"{'group':<16} {'files':>9} {'GB':>9} {'frames':>11} {'hours':>8} {'mean frames':>12} "
+              f"{'max frames':>11} {'errors':>7}")
+        for row in catalog.aggregate(args.by, conditions, parameters):
+            print(f"{str(row['group']):<16} {row['files']:>9} {(row['bytes'] or 0) / 1e9:>9.2f} "
+                  f"{row['frames'] or 0:>11} {(row['gif_duration'] or 0) / 3.6e6:>8.2f} "
+                  f"{row['mean_frames'] or 0:>12.1f} {row['max_frames'] or 0:>11} {row['errors']:>7}")
+    return 0
+
+
+def command_verify(args):
+    from .verify import validate_files
+    summary = validate_files(args.paths, not args.quick, args.workers, args.verbose)
+    return 1 if summary['invalid'] else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m agif', description="AGIF command line tools")
+    parser.add_argument('--trace', metavar='FILE', help="append the timed stages and counters to a JSON lines file")
+    parser.add_argument('--stats', action='store_true', help="print a summary of the timed stages at the end")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="profile the command with cProfile, saving the statistics to FILE (- to print "
+                             "the slowest functions)")
+    parser.add_argument('--trace-memory', action='store_true', help="trace the memory allocated with tracemalloc")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    create = commands.add_parser('create', help="create an .agif file from a GIF and an MP3")
+    create.add_argument('gif')
+    create.add_argument('mp3')
+    create.add_argument('output', help="output file, - for standard output (stream layout)")
+    create.add_argument('-j', '--workers', type=int, default=1,
+                        help="threads compressing the frames (0 = one per CPU)")
+    add_encoder_arguments(create)
+    create.set_defaults(func=command_create)
+
+    convert = commands.add_parser('convert', help="convert the GIF/MP3 pairs listed in a manifest")
+    convert.add_argument('manifest', help="CSV file or JSON lines file (.jsonl) with gif, mp3 and output")
+    convert.add_argument('-j', '--workers', type=int, default=None,
+                         help="files converted in parallel (default: one per CPU)")
+    convert.add_argument('--journal', help="file recording the converted outputs (default: MANIFEST.journal)")
+    convert.add_argument('--hash', action='store_true',
+                         help="detect changed inputs by content hash instead of size and mtime")
+    add_encoder_arguments(convert)
+    convert.set_defaults(func=command_convert)
+
+    transcode = commands.add_parser('transcode', help="write smaller renditions of a GIF and an MP3")
+    transcode.add_argument('gif')
+    transcode.add_argument('mp3')
+    transcode.add_argument('-r', '--rendition', action='append', required=True,
+                           help="OUTPUT[,size=WxH][,fps=N][,colors=N][,crop=X:Y:W:H], can be repeated")
+    add_codec_arguments(transcode, 'png')
+    transcode.set_defaults(func=command_transcode)
+
+    edit = commands.add_parser('edit', help="change an .agif file in place, writing only the new data")
+    edit.add_argument('file')
+    edit.add_argument('--audio', metavar='MP3', help="replace the soundtrack")
+    edit.add_argument('--drop', action='append', metavar='N[:STOP]', help="remove frame N, or frames N to STOP - 1")
+    edit.add_argument('--duration', action='append', metavar='N=MS', help="set the duration of frame N")
+    edit.add_argument('--append', action='append', metavar='PNG', help="add a PNG image as the last frame")
+    edit.add_argument('--append-duration', type=int, default=100, help="duration of the appended frames in ms")
+    edit.add_argument('--loop', choices=('on', 'off'), help="loop the animation or not")
+    edit.add_argument('--compact', action='store_true', help="rewrite the file without the replaced data")
+    edit.set_defaults(func=command_edit)
+
+    thumbnail = commands.add_parser('thumbnail', help="extract a poster frame or a contact sheet")
+    thumbnail.add_argument('input', help=".agif file, or a directory to thumbnail every .agif file in it")
+    thumbnail.add_argument('-o', '--output',
+                           help="output image, or directory for a directory (default: next to the input)")
+    position = thumbnail.add_mutually_exclusive_group()
+    position.add_argument('--frame', type=int, help="frame number of the poster (default: first frame)")
+    position.add_argument('--time', type=int, help="time of the poster frame in milliseconds")
+    position.add_argument('--sheet', type=int, metavar='EVERY', help="contact sheet of every N-th frame")
+    thumbnail.add_argument('--size', default='160x160', help="maximum size of a thumbnail, WIDTHxHEIGHT")
+    thumbnail.add_argument('-j', '--workers', type=int, default=None,
+                           help="processes for a directory (default: one per CPU)")
+    thumbnail.set_defaults(func=command_thumbnail)
+
+    export = commands.add_parser('export', help="export .agif files back to GIF, MP3 or MP4")
+    export.add_argument('input', help=".agif file, or a directory to export every .agif file in it")
+    export.add_argument('-o', '--output',
+                        help="output path without extension, or directory for a directory (default: next to "
+                             "the input)")
+    export.add_argument('--format', default='gif,mp3',
+                        help="comma-separated formats: gif, mp3, mp4 (mp4 needs ffmpeg)")
+    export.add_argument('-j', '--workers', type=int, default=None,
+                        help="processes for a directory (default: one per CPU)")
+    export.set_defaults(func=command_export)
+
+    catalog = commands.add_parser('catalog', help="index .agif libraries in SQLite and query them")
+    actions = catalog.add_subparsers(dest='action', required=True)
+    scan = actions.add_parser('scan', help="add new and changed files to the catalog, reading their headers only")
+    scan.add_argument('paths', nargs='+', help=".agif files, or directories to index every .agif file in them")
+    scan.add_argument('-j', '--workers', type=int, default=None, help="threads reading the headers")
+    query = actions.add_parser('query', help="list the files matching the filters")
+    query.add_argument('--sort', default='path', help="column to sort by (e.g. frames, gif_duration, size)")
+    query.add_argument('--desc', action='store_true', help="sort in descending order")
+    query.add_argument('--limit', type=int, help="list at most N files")
+    stats = actions.add_parser('stats', help="totals of the files matching the filters")
+    stats.add_argument('--by', choices=('version', 'codecs', 'dimensions', 'loop', 'status'),
+                       help="one row per group")
+    for action in (scan, query, stats):
+        action.add_argument('--db', default='agif-catalog.db', help="catalog database (default: %(default)s)")
+    for action in (query, stats):
+        action.add_argument('--min-frames', type=int)
+        action.add_argument('--max-frames', type=int)
+        action.add_argument('--min-duration', type=int, metavar='MS')
+        action.add_argument('--max-duration', type=int, metavar='MS')
+        action.add_argument('--codec', help="files with frames of this codec")
+        action.add_argument('--errors', action='store_true', help="unreadable files only")
+        action.add_argument('--where', metavar='SQL', help="extra SQL condition on the columns of the catalog")
+    catalog.set_defaults(func=command_catalog)
+
+    verify = commands.add_parser('verify', help="check the structure and checksums of .agif files")
+    verify.add_argument('paths', nargs='+', help=".agif files, or directories to check every .agif file in them")
+    verify.add_argument('--quick', action='store_true', help="check the structure only, not the checksums")
+    verify.add_argument('-j', '--workers', type=int, default=None,
+                        help="files checked in parallel (default: one per CPU)")
+    verify.add_argument('-v', '--verbose', action='store_true', help="list the valid files too")
+    verify.set_defaults(func=command_verify)
+    return parser
+
+
+# Instrumentation of a command, reported on standard error
+def instrumentation(args):
+    from . import instrument
+
+    def log(line):
+        print(line, file=sys.stderr)
+
+    stack = ExitStack()
+    if args.trace:
+        sink = instrument.JsonLinesSink(args.trace)
+        stack.callback(sink.close)
+        stack.enter_context(instrument.recording(sink))
+    if args.stats:
+        histogram = instrument.HistogramSink()
+        stack.callback(histogram.report, log)
+        stack.enter_context(instrument.recording(histogram))
+    if args.profile:
+        stack.enter_context(instrument.profile(None if args.profile == '-' else args.profile, log=log))
+    if args.trace_memory:
+        stack.enter_context(instrument.trace_memory(log=log))
+    return stack
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        with instrumentation(args):
+            return args.func(args)
+    except ValueError as e:
+        # Invalid input files or options
+        print(f"agif: {e}", file=sys.stderr)
+        return 1
@@ -0,0 +1,107 @@
+import bisect
+import time
+
+# Delay between ticks while waiting for a frame of a stream, in ms
+BUFFERING_DELAY = 20
+
+
+# Master clock for AGIF playback: the frame to show is derived from the
+# playback position (the audio position when there is audio), instead of
+# chaining timers, so timer jitter and decode time never accumulate. Late
+# ticks skip frames and early ticks repeat the current one.
+#
+# Loop points: when the audio is at least as long as the GIF, the GIF loops
+# within the audio and restarts together with it; when the GIF is longer, it
+# always plays to its end and the audio loops on its own.
+#
+# position is a callable returning the playback position in milliseconds;
+# negative values (e.g. pygame.mixer.music.get_pos() before playback starts)
+# fall back to a monotonic clock started with the PlaybackClock.
+#
+# For a stream, frames are added with add_frame as they are received and
+# gif_duration is the total duration given by the header (float('inf') when
+# unknown, until set_gif_duration); until a frame arrives the last one stays
+# on screen.
+class PlaybackClock:
+    def __init__(self, durations, audio_duration=0, position=None, gif_duration=None):
+        self.durations = [max(1, duration) for duration in durations]
+        self.timestamps = []
+        timestamp = 0
+        for duration in self.durations:
+            self.timestamps.append(timestamp)
+            timestamp += duration
+        self.end = timestamp
+        self.audio_duration = int(audio_duration)
+        self.set_gif_duration(gif_duration or timestamp)
+        self.position = position
+        self.start = time.monotonic()
+
+        # Counters
+        self.frames_shown = 0
+        self.dropped_frames = 0
+        self.repeated_frames = 0
+        self.drift = 0  # how late the current frame was shown, in ms
+        self.max_drift = 0
+        self.index = None
+        self.loop_time = 0
+
+    def add_frame(self, duration):
+        self.durations.append(max(1, duration))
+        self.timestamps.append(self.end)
+        self.end += self.durations[-1]
+
+    def set_gif_duration(self, gif_duration):
+        self.gif_duration = max(1, gif_duration)
+        self.period = max(self.gif_duration, self.audio_duration)
+
+    def elapsed(self):
+        return int((time.monotonic() - self.start) * 1000)
+
+    def now(self):
+        position = self.position() if self.position is not None else -1
+        return position if position >= 0 else self.elapsed()
+
+    # Position inside the loop period and inside the GIF
+    def times(self):
+        loop_time = self.now() % self.period
+        return loop_time, loop_time % self.gif_duration
+
+    # Index of the frame to show now, updating the counters
+    def tick(self):
+        loop_time, gif_time = self.times()
+        index = bisect.bisect_right(self.timestamps, gif_time) - 1
+
+        if self.index is not None:
+            # A new loop period restarts the GIF from the first frame
+            expected = (self.index + 1) % len(self.durations) if loop_time >= self.loop_time else 0
+            if index == self.index:
+                self.repeated_frames += 1
+            elif index != expected:
+                self.dropped_frames += (index - expected) % len(self.durations)
+        if index != self.index:
+            # Lateness of a frame change; repeated ticks are within the frame already shown
+            self.drift = max(0, gif_time - self.timestamps[index])
+            self.max_drift = max(self.max_drift, self.drift)
+        self.index = index
+        self.loop_time = loop_time
+        self.frames_shown += 1
+        return index
+
+    # Milliseconds until the frame to show changes
+    def next_delay(self):
+        loop_time, gif_time = self.times()
+        index = bisect.bisect_right(self.timestamps, gif_time) - 1
+        frame_end = self.timestamps[index] + self.durations[index] - gif_time
+        if frame_end <= 0:
+            # Past the last frame received
+            frame_end = BUFFERING_DELAY
+        return max(1, min(frame_end, self.period - loop_time))
+
+    def stats(self):
+        return {
+            'frames_shown': self.frames_shown,
+            'dropped_frames': self.dropped_frames,
+            'repeated_frames': self.repeated_frames,
+            'drift': self.drift,
+            'max_drift': self.max_drift,
+        }
@@ -0,0 +1,137 @@
+import io
+import lzma
+import struct
+import zlib
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+from .container import CODEC_GIF, CODEC_LZ4, CODEC_LZMA, CODEC_PNG, CODEC_ZLIB, CODEC_ZSTD
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# A frame codec: the id stored in the index entry of each frame, the name used
+# by the tools, encode(image, level) -> bytes (None for codecs whose frames are
+# copied from the source, like gif), decode(data) -> PIL image, and the level
+# used when none is given
+FrameCodec = namedtuple('FrameCodec', 'id name encode decode default_level')
+
+CODECS = {}  # by id
+CODEC_NAMES = {}  # by name
+
+# Codecs of optional packages, registered only when the package is installed
+OPTIONAL_CODECS = {'zstd': (CODEC_ZSTD, 'zstandard'), 'lz4': (CODEC_LZ4, 'lz4')}
+
+
+def register_codec(codec_id, name, encode, decode, default_level=None):
+    codec = FrameCodec(codec_id, name, encode, decode, default_level)
+    CODECS[codec_id] = codec
+    CODEC_NAMES[name] = codec
+    return codec
+
+
+# Codec by name or id
+def get_codec(codec):
+    codecs = CODEC_NAMES if isinstance(codec, str) else CODECS
+    if codec in codecs:
+        return codecs[codec]
+    for name, (codec_id, package) in OPTIONAL_CODECS.items():
+        if codec in (name, codec_id):
+            raise ValueError(f"Frame codec {name} needs the {package} package")
+    raise ValueError(f"Unknown frame codec: {codec}")
+
+
+# Encode a frame with a codec given by name or id; empty delta frames have no image
+def encode_frame(image, codec='png', level=None):
+    if image is None:
+        return b''
+    codec = get_codec(codec)
+    return codec.encode(image, codec.default_level if level is None else level)
+
+
+def decode_frame(codec_id, data):
+    return get_codec(codec_id).decode(data)
+
+
+def encode_png(image, level):
+    frame_io = io.BytesIO()
+    image.save(frame_io, format='PNG', compress_level=level)
+    return frame_io.getvalue()
+
+
+def decode_image(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+# Raw frames: a RAW_FRAME header (mode, width, height, number of palette
+# colors) followed by the compressed pixels. Images with up to 256 colors,
+# like every GIF frame, are stored as an RGBA palette and one index per pixel,
+# the others as RGBA pixels. Lossless, and decoding is a single decompression.
+RAW_FRAME = struct.Struct('<BHHH')
+RAW_PALETTE = 0
+RAW_RGBA = 1
+
+
+def raw_pixels(image):
+    image = image.convert('RGBA')
+    colors = image.getcolors(256)
+    if colors is None:
+        return RAW_FRAME.pack(RAW_RGBA, image.width, image.height, 0), image.tobytes()
+
+    pixels = np.asarray(image).view(np.uint32).reshape(-1)
+    palette = np.array([color for count, color in colors], dtype=np.uint8).view(np.uint32).reshape(-1)
+    palette.sort()
+    indices = np.searchsorted(palette, pixels).astype(np.uint8)
+    header = RAW_FRAME.pack(RAW_PALETTE, image.width, image.height, len(palette))
+    return header, palette.tobytes() + indices.tobytes()
+
+
+def raw_image(header, body):
+    mode, width, height, colors = RAW_FRAME.unpack(header)
+    if mode == RAW_RGBA:
+        return Image.frombytes('RGBA', (width, height), body)
+    image = Image.frombytes('P', (width, height), body[colors * 4:])
+    image.putpalette(body[:colors * 4], 'RGBA')
+    return image.convert('RGBA')
+
+
+def raw_codec(compress, decompress):
+    def encode(image, level):
+        header, body = raw_pixels(image)
+        return header + compress(body, level)
+
+    def decode(data):
+        data = bytes(data)
+        return raw_image(data[:RAW_FRAME.size], decompress(data[RAW_FRAME.size:]))
+    return encode, decode
+
+
+register_codec(CODEC_PNG, 'png', encode_png, decode_image, 6)
+# GIF image blocks are copied from the source GIF by the encoder
+register_codec(CODEC_GIF, 'gif', None, decode_image)
+register_codec(CODEC_ZLIB, 'zlib', *raw_codec(zlib.compress, zlib.decompress), 6)
+register_codec(CODEC_LZMA, 'lzma', *raw_codec(lambda data, level: lzma.compress(data, preset=level),
+                                              lzma.decompress), 6)
+if zstandard is not None:
+    register_codec(CODEC_ZSTD, 'zstd', *raw_codec(
+        lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data)), 3)
+if lz4 is not None:
+    register_codec(CODEC_LZ4, 'lz4', *raw_codec(
+        lambda data, level: lz4.frame.compress(data, compression_level=level), lz4.frame.decompress), 0)
+
+# Codec and level for each use: fast decoding for playback, smallest files
+# for archival
+PRESETS = {
+    'playback': ('lz4', 0) if lz4 is not None else ('zlib', 1),
+    'archive': ('lzma', 9),
+}
@@ -0,0 +1,456 @@
+import mmap
+import os
+import struct
+import zlib
+from collections import namedtuple
+from . import instrument
+from .mp3 import split_mp3
+
+SIGNATURE = b'AGIF'
+
+# Version 1: 14-byte header, length-prefixed PNG frames, MP3 data
+HEADER_V1 = struct.Struct('<4sBBII')
+FRAME_SIZE_V1 = struct.Struct('<I')
+
+# Version 2: fixed header, frame data, MP3 data, trailing index table.
+# header_size and entry_size are stored so that fields can be appended later
+# without breaking readers of older files. Fields added later must be zero in
+# files written before them: shorter headers and entries are padded with zeros.
+HEADER_V2 = struct.Struct('<4sBBHIIIQQQQHIIII')
+MIN_HEADER_SIZE = 54  # fields up to the index entry size
+INDEX_ENTRY = struct.Struct('<QIIIBHHBBI')
+# crc is the CRC32 of the frame data in version 2 files with OPTION_CHECKSUMS
+IndexEntry = namedtuple('IndexEntry', 'offset size timestamp duration flags x y codec disposal crc')
+MIN_ENTRY_SIZE = 20  # offset, size, timestamp (ms), duration (ms)
+
+# Version 3 (stream layout): fixed header, then chunks in timestamp order,
+# with the audio split in chunks interleaved with the frames, so that a file
+# can be played while it is still being received. Each chunk is a CHUNK header
+# followed by its payload; a frame payload starts with FRAME_INFO (frame_info_size
+# bytes, padded with zeros like the index entries of version 2). The counts and
+# durations in the header are 0 when they were unknown to the writer (output
+# to a pipe). With OPTION_CHECKSUMS every payload is followed by its CRC32.
+# Readers skip chunks of unknown type.
+HEADER_V3 = struct.Struct('<4sBBHIIIQHII')
+MIN_HEADER_V3_SIZE = 38
+CHUNK = struct.Struct('<BIII')  # type, payload size, timestamp (ms), duration (ms)
+FRAME_INFO = struct.Struct('<BHHBB')  # flags, x, y, codec, disposal
+CHUNK_END = 0
+CHUNK_FRAME = 1
+CHUNK_AUDIO = 2
+
+# Header options
+OPTION_LOOP = 0x01
+# CRC32 checksums: of each frame in the index entries, of the audio and of the
+# index in the header (version 2), after each chunk (version 3)
+OPTION_CHECKSUMS = 0x02
+CRC = struct.Struct('<I')
+
+# Frame flags: a delta frame is drawn at (x, y) over the previous frame, an
+# empty delta repeats the previous frame
+FRAME_DELTA = 0x01
+
+# Frame codecs: PNG images, or GIF image blocks copied from the source GIF and
+# composited like a GIF decoder does, using the GIF disposal methods, or raw
+# palette pixels compressed with zlib, lzma, zstd or lz4 (see codecs.py)
+CODEC_PNG = 0
+CODEC_GIF = 1
+CODEC_ZLIB = 2
+CODEC_LZMA = 3
+CODEC_ZSTD = 4
+CODEC_LZ4 = 5
+
+# GIF disposal methods
+DISPOSE_NONE = 1
+DISPOSE_BACKGROUND = 2
+DISPOSE_PREVIOUS = 3
+
+
+# Reader for .agif files backed by mmap: opening only parses the header and
+# the index, frames and audio are returned as zero-copy memoryview slices.
+# Slices that are still alive when the reader is closed keep the mapping open.
+class AgifReader:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file = open(file_path, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError("File not recognized as .agif format")
+        self.view = memoryview(self.mm)
+        self._entries = None
+        self._audio = None
+
+        try:
+            if len(self.mm) < HEADER_V1.size or self.mm[:4] != SIGNATURE:
+                raise ValueError("File not recognized as .agif format")
+            self.version = self.mm[4]
+            if self.version == 1:
+                self._read_v1()
+            elif self.version == 2:
+                self._read_v2()
+            elif self.version == 3:
+                self._read_v3()
+            else:
+                raise ValueError(f"Unsupported .agif version: {self.version}")
+        except Exception:
+            self.close()
+            raise
+
+    # Version 1 has no index: walk the length prefixes once to build it
+    def _read_v1(self):
+        signature, version, num_frames, mp3_size, options = HEADER_V1.unpack_from(self.mm)
+        self.options = options
+        self.num_frames = num_frames
+
+        frame_duration = 1000 // num_frames if num_frames else 0
+        entries = []
+        position = HEADER_V1.size
+        for index in range(num_frames):
+            if position + FRAME_SIZE_V1.size > len(self.mm):
+                raise ValueError(f"Truncated .agif file at frame {index}")
+            frame_size = FRAME_SIZE_V1.unpack_from(self.mm, position)[0]
+            position += FRAME_SIZE_V1.size
+            entries.append(IndexEntry(position, frame_size, index * frame_duration, frame_duration,
+                                      0, 0, 0, CODEC_PNG, 0, 0))
+            position += frame_size
+        self._entries = entries
+
+        self.gif_duration = frame_duration * num_frames
+        self.audio_duration = 0
+        self.width = 0
+        self.height = 0
+        self.audio_offset = position
+        self.audio_size = min(mp3_size, max(len(self.mm) - position, 0))
+
+    def _read_v2(self):
+        if len(self.mm) < MIN_HEADER_SIZE:
+            raise ValueError("Truncated .agif header")
+        header_size = struct.unpack_from('<H', self.mm, 6)[0]
+        if header_size < MIN_HEADER_SIZE or header_size > len(self.mm):
+            raise ValueError("Corrupted .agif header")
+        header = self.mm[:min(header_size, HEADER_V2.size)]
+        (signature, version, options, header_size, num_frames, gif_duration,
+         audio_duration, gif_offset, audio_offset, audio_size, index_offset,
+         entry_size, width, height, audio_crc, index_crc) = HEADER_V2.unpack(
+            header + bytes(HEADER_V2.size - len(header)))
+        if entry_size < MIN_ENTRY_SIZE:
+            raise ValueError("Corrupted .agif header")
+        if index_offset + num_frames * entry_size > len(self.mm):
+            raise ValueError("Truncated .agif index")
+        if audio_offset + audio_size > len(self.mm):
+            raise ValueError("Truncated .agif audio data")
+
+        self.options = options
+        self.num_frames = num_frames
+        self.gif_duration = gif_duration
+        self.audio_duration = audio_duration
+        self.gif_offset = gif_offset
+        self.audio_offset = audio_offset
+        self.audio_size = audio_size
+        self.index_offset = index_offset
+        self.entry_size = entry_size
+        self.width = width
+        self.height = height
+        self.audio_crc = audio_crc
+        self.index_crc = index_crc
+
+    # Version 3 has no index either: walk the chunks once to build it. The
+    # audio chunks are joined on the first call to audio().
+    def _read_v3(self):
+        header = parse_header_v3(self.mm[:HEADER_V3.size])
+        if header['header_size'] > len(self.mm):
+            raise ValueError("Truncated .agif header")
+        self.options = header['options']
+        self.width = header['width']
+        self.height = header['height']
+        self.audio_duration = header['audio_duration']
+
+        entries = []
+        self._audio_chunks = []
+        self.chunk_offsets = []  # of the chunk headers, for validation
+        crc_size = CRC.size if self.options & OPTION_CHECKSUMS else 0
+        position = header['header_size']
+        while True:
+            self.chunk_offsets.append(position)
+            if position + CHUNK.size > len(self.mm):
+                raise ValueError(f"Truncated .agif file at frame {len(entries)}")
+            chunk_type, size, timestamp, duration = CHUNK.unpack_from(self.mm, position)
+            position += CHUNK.size
+            if position + size + crc_size > len(self.mm):
+                raise ValueError(f"Truncated .agif file at frame {len(entries)}")
+            if chunk_type == CHUNK_END:
+                break
+            if chunk_type == CHUNK_FRAME:
+                info_size = min(header['frame_info_size'], size)
+                entries.append(frame_entry(self.mm[position:position + info_size], position + info_size,
+                                           size - info_size, timestamp, duration))
+            elif chunk_type == CHUNK_AUDIO:
+                self._audio_chunks.append((position, size))
+            position += size + crc_size
+        self._entries = entries
+
+        self.num_frames = len(entries)
+        self.gif_duration = sum(entry.duration for entry in entries)
+        self.audio_size = sum(size for offset, size in self._audio_chunks)
+
+    def __len__(self):
+        return self.num_frames
+
+    def __iter__(self):
+        for index in range(self.num_frames):
+            yield self.frame(index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Index entry of frame N
+    def entry(self, index):
+        if not 0 <= index < self.num_frames:
+            raise IndexError(f"Frame {index} out of range")
+        if self._entries is not None:
+            return self._entries[index]
+        position = self.index_offset + index * self.entry_size
+        if self.entry_size >= INDEX_ENTRY.size:
+            return IndexEntry._make(INDEX_ENTRY.unpack_from(self.mm, position))
+        data = self.mm[position:position + self.entry_size]
+        return IndexEntry._make(INDEX_ENTRY.unpack(data + bytes(INDEX_ENTRY.size - self.entry_size)))
+
+    def frame(self, index):
+        entry = self.entry(index)
+        if entry.offset + entry.size > len(self.mm):
+            raise ValueError(f"Truncated .agif file at frame {index}")
+        return self.view[entry.offset:entry.offset + entry.size]
+
+    def audio(self):
+        if self.version == 3:
+            if self._audio is None:
+                self._audio = b''.join(self.mm[offset:offset + size] for offset, size in self._audio_chunks)
+            return memoryview(self._audio)
+        return self.view[self.audio_offset:self.audio_offset + self.audio_size]
+
+    # Index of the frame shown at time_ms (binary search on the timestamps)
+    def frame_at(self, time_ms):
+        low, high = 0, self.num_frames - 1
+        if high < 0:
+            raise IndexError("The .agif file has no frames")
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.entry(middle).timestamp <= time_ms:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                # Slices still reference the mapping, it is released with them
+                pass
+            self.mm = None
+        self.file.close()
+
+
+# Writer for version 2 files: frames are written as they are added and the
+# header and index are written on close
+class AgifWriter:
+    def __init__(self, file_path, options=0, width=0, height=0):
+        self.file = open(file_path, 'wb')
+        self.options = options | OPTION_CHECKSUMS
+        self.width = width
+        self.height = height
+        self.entries = []
+        self.timestamp = 0
+        self.audio_offset = 0
+        self.audio_size = 0
+        self.audio_duration = 0
+        self.audio_crc = 0
+        self.file.write(bytes(HEADER_V2.size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def add_frame(self, data, duration, flags=0, x=0, y=0, codec=CODEC_PNG, disposal=0):
+        offset = self.file.tell()
+        self.file.write(data)
+        self.entries.append((offset, len(data), self.timestamp, duration, flags, x, y, codec, disposal,
+                             zlib.crc32(data)))
+        self.timestamp += duration
+
+    def set_audio(self, data, duration=0):
+        self.audio_offset = self.file.tell()
+        self.file.write(data)
+        self.audio_size = len(data)
+        self.audio_duration = duration
+        self.audio_crc = zlib.crc32(data)
+
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        index = b''.join(INDEX_ENTRY.pack(*entry) for entry in self.entries)
+        self.file.write(index)
+
+        self.file.seek(0)
+        self.file.write(HEADER_V2.pack(
+            SIGNATURE,
+            2,
+            self.options,
+            HEADER_V2.size,
+            len(self.entries),
+            self.timestamp,
+            self.audio_duration,
+            HEADER_V2.size,
+            self.audio_offset,
+            self.audio_size,
+            index_offset,
+            INDEX_ENTRY.size,
+            self.width,
+            self.height,
+            self.audio_crc,
+            zlib.crc32(index)
+        ))
+        self.file.close()
+
+
+# Header fields of a version 3 file, from at least MIN_HEADER_V3_SIZE bytes
+def parse_header_v3(data):
+    if len(data) < MIN_HEADER_V3_SIZE:
+        raise ValueError("Truncated .agif header")
+    data = bytes(data[:HEADER_V3.size])
+    fields = HEADER_V3.unpack(data + bytes(HEADER_V3.size - len(data)))
+    header = dict(zip(('signature', 'version', 'options', 'header_size', 'num_frames', 'gif_duration',
+                       'audio_duration', 'audio_size', 'frame_info_size', 'width', 'height'), fields))
+    if header['header_size'] < MIN_HEADER_V3_SIZE:
+        raise ValueError("Corrupted .agif header")
+    return header
+
+
+# Index entry of a version 3 frame chunk from its FRAME_INFO bytes
+def frame_entry(info, offset, size, timestamp, duration):
+    info = bytes(info[:FRAME_INFO.size])
+    flags, x, y, codec, disposal = FRAME_INFO.unpack(info + bytes(FRAME_INFO.size - len(info)))
+    return IndexEntry(offset, size, timestamp, duration, flags, x, y, codec, disposal, 0)
+
+
+# Writer for version 3 files (stream layout) to a path or to any writable
+# binary file object, e.g. a pipe. set_audio must be called before the frames:
+# each audio chunk is written ahead of the frames it plays with, so that a
+# reader receiving the file has `audio_lead` ms of audio before each frame.
+# The header is completed on close when the output is seekable.
+class AgifStreamWriter:
+    def __init__(self, output, options=0, width=0, height=0, chunk_ms=500, audio_lead=500):
+        self.owned = isinstance(output, (str, bytes, os.PathLike))
+        self.file = open(output, 'wb') if self.owned else output
+        self.options = options | OPTION_CHECKSUMS
+        self.width = width
+        self.height = height
+        self.chunk_ms = chunk_ms
+        self.audio_lead = audio_lead
+        self.num_frames = 0
+        self.timestamp = 0
+        self.audio_chunks = []
+        self.audio_size = 0
+        self.audio_duration = 0
+        self.closed = False
+        self.write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.owned:
+            self.file.close()
+
+    def write_header(self):
+        self.file.write(HEADER_V3.pack(
+            SIGNATURE,
+            3,
+            self.options,
+            HEADER_V3.size,
+            self.num_frames,
+            self.timestamp,
+            self.audio_duration,
+            self.audio_size,
+            FRAME_INFO.size,
+            self.width,
+            self.height
+        ))
+
+    def set_audio(self, data, duration=0):
+        self.audio_chunks = list(split_mp3(data, self.chunk_ms))
+        self.audio_chunks.reverse()
+        self.audio_size = sum(len(chunk) for timestamp, length, chunk in self.audio_chunks)
+        self.audio_duration = duration
+
+    # Write the audio chunks starting before `until` ms
+    def write_audio(self, until=None):
+        while self.audio_chunks and (until is None or self.audio_chunks[-1][0] <= until):
+            timestamp, duration, data = self.audio_chunks.pop()
+            self.write_chunk(CHUNK_AUDIO, timestamp, duration, data)
+
+    def write_chunk(self, chunk_type, timestamp, duration, *payload):
+        self.file.write(CHUNK.pack(chunk_type, sum(len(part) for part in payload), timestamp, duration))
+        crc = 0
+        for part in payload:
+            self.file.write(part)
+            crc = zlib.crc32(part, crc)
+        self.file.write(CRC.pack(crc))
+
+    def add_frame(self, data, duration, flags=0, x=0, y=0, codec=CODEC_PNG, disposal=0):
+        self.write_audio(self.timestamp + self.audio_lead)
+        self.write_chunk(CHUNK_FRAME, self.timestamp, duration, FRAME_INFO.pack(flags, x, y, codec, disposal), data)
+        self.num_frames += 1
+        self.timestamp += duration
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.write_audio()
+        self.write_chunk(CHUNK_END, 0, 0)
+        if self.file.seekable():
+            end = self.file.tell()
+            self.file.seek(0)
+            self.write_header()
+            self.file.seek(end)
+        self.file.flush()
+        if self.owned:
+            self.file.close()
+
+
+# Read a .agif file of any version, returning the frames and the MP3 data
+def read_agif(file_path):
+    with instrument.span('agif.read'), AgifReader(file_path) as reader:
+        frames = [bytes(frame) for frame in reader]
+        mp3_data = bytes(reader.audio())
+    instrument.count('agif.bytes', sum(map(len, frames)) + len(mp3_data))
+    return frames, mp3_data
+
+
+# Write a version 2 .agif file from already encoded frames and MP3 data.
+# Without durations every frame lasts 1000 // len(frames) ms, like in the players.
+def write_agif(file_path, frames, mp3_data, durations=None, audio_duration=0, options=0):
+    if durations is None:
+        durations = [1000 // len(frames) if frames else 0] * len(frames)
+    with AgifWriter(file_path, options) as writer:
+        for frame, duration in zip(frames, durations):
+            writer.add_frame(frame, duration)
+        writer.set_audio(mp3_data, audio_duration)
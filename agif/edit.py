@@ -0,0 +1,226 @@
+import os
+import struct
+import zlib
+from .container import (CODEC_GIF, CODEC_PNG, DISPOSE_BACKGROUND, DISPOSE_NONE, FRAME_DELTA, HEADER_V2, INDEX_ENTRY, OPTION_LOOP, SIGNATURE, AgifReader,
+                        AgifWriter, IndexEntry)
+from .mp3 import mp3_info
+
+
+# In-place editing of version 2 .agif files. The offsets in the header and in
+# the index let frames and audio live anywhere in the file: new data is
+# appended at its end, followed by a new index, and only then is the header
+# rewritten to point to them. Until that last write the old header and index
+# are untouched, so an interrupted edit leaves the file as it was. Replaced
+# data is left in place as dead space, reclaimed by compact().
+class AgifEditor:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with AgifReader(file_path) as reader:
+            if reader.version != 2:
+                raise ValueError("Only version 2 .agif files (index layout) can be edited in place")
+            self.header_size = struct.unpack_from('<H', reader.mm, 6)[0]
+            self.entries = [reader.entry(index) for index in range(len(reader))]
+            self.options = reader.options
+            self.width = reader.width
+            self.height = reader.height
+            self.gif_offset = reader.gif_offset
+            self.audio_offset = reader.audio_offset
+            self.audio_size = reader.audio_size
+            self.audio_duration = reader.audio_duration
+            self.audio_crc = reader.audio_crc
+        self.file = open(file_path, 'r+b')
+        self.end = self.file.seek(0, os.SEEK_END)
+        # End of the file as its header last described it: discarded edits are cut off there
+        self.committed_end = self.end
+        self.changed = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # The edits are discarded, the file keeps its header, index and size
+            try:
+                self.file.truncate(self.committed_end)
+            finally:
+                self.file.close()
+
+    @property
+    def gif_duration(self):
+        return sum(entry.duration for entry in self.entries)
+
+    # Bytes of the file no longer referenced by the header or the index
+    @property
+    def dead_bytes(self):
+        live = self.header_size + sum(entry.size for entry in self.entries)
+        return self.end - live - self.audio_size - len(self.entries) * INDEX_ENTRY.size
+
+    # The frames being edited, read like an AgifReader (for a FrameDecoder)
+    def entry(self, index):
+        return self.entries[index]
+
+    def frame(self, index):
+        entry = self.entries[index]
+        self.file.seek(entry.offset)
+        return self.file.read(entry.size)
+
+    def append(self, data):
+        offset = self.end
+        self.file.seek(offset)
+        self.file.write(data)
+        self.end += len(data)
+        self.changed = True
+        return offset
+
+    # Replace the soundtrack: only the new MP3 data is written. The duration
+    # is read from the MP3 frame headers when not given.
+    def set_audio(self, data, duration=None):
+        if duration is None:
+            duration = mp3_info(bytes(data)).duration if len(data) else 0
+        self.audio_offset = self.append(data)
+        self.audio_size = len(data)
+        self.audio_duration = duration
+        self.audio_crc = zlib.crc32(data)
+
+    # Add a frame after the last one (see AgifWriter.add_frame)
+    def append_frame(self, data, duration, flags=0, x=0, y=0, codec=CODEC_PNG, disposal=0):
+        if not self.entries and flags & FRAME_DELTA:
+            raise ValueError("The first frame cannot be a delta frame")
+        offset = self.append(data)
+        self.entries.append(IndexEntry(offset, len(data), self.gif_duration, duration, flags, x, y, codec, disposal,
+                                       zlib.crc32(data)))
+
+    # Remove frames start to stop - 1. A delta frame right after them would be
+    # drawn over the wrong picture: it is decoded as it was shown and stored
+    # again as a keyframe, with its own codec (png for gif frames, which are
+    # composited on the screen). The next frame is stored again too while the
+    # disposal of a gif frame changed the screen it is drawn over; a gif frame
+    # drawn over a cleared screen just becomes a keyframe.
+    def drop_frames(self, start, stop=None):
+        stop = start + 1 if stop is None else stop
+        if not 0 <= start < stop <= len(self.entries):
+            raise IndexError(f"Frames {start}-{stop - 1} out of range")
+        if stop < len(self.entries) and self.entries[stop].flags & FRAME_DELTA:
+            self.store_keyframes(stop)
+        del self.entries[start:stop]
+        self.retime()
+
+    # Store the delta frames from start as keyframes, see drop_frames. Every
+    # frame is decoded before the entries change.
+    def store_keyframes(self, start):
+        from .codecs import encode_frame
+        from .frames import FrameDecoder
+
+        decoder = FrameDecoder(self)
+        keyframes = []
+        for index in range(start, len(self.entries)):
+            entry = self.entries[index]
+            if not entry.flags & FRAME_DELTA:
+                break
+            decoder.decode(index - 1)
+            if (entry.codec == CODEC_GIF and decoder.disposal == DISPOSE_BACKGROUND
+                    and decoder.disposal_box == (0, 0, self.width, self.height)):
+                keyframes.append((index, entry.codec, None))
+                break
+            codec = CODEC_PNG if entry.codec == CODEC_GIF else entry.codec
+            keyframes.append((index, codec, encode_frame(decoder.decode(index), codec)))
+            if entry.codec != CODEC_GIF or entry.disposal in (0, DISPOSE_NONE):
+                break
+
+        for index, codec, data in keyframes:
+            entry = self.entries[index]._replace(flags=self.entries[index].flags & ~FRAME_DELTA)
+            if data is not None:
+                entry = entry._replace(offset=self.append(data), size=len(data), x=0, y=0, codec=codec, disposal=0,
+                                       crc=zlib.crc32(data))
+            self.entries[index] = entry
+
+    def set_duration(self, index, duration):
+        if not 0 <= index < len(self.entries):
+            raise IndexError(f"Frame {index} out of range")
+        self.entries[index] = self.entries[index]._replace(duration=max(1, duration))
+        self.retime()
+
+    def set_loop(self, loop):
+        self.options = self.options | OPTION_LOOP if loop else self.options & ~OPTION_LOOP
+        self.changed = True
+
+    # Timestamps from the durations
+    def retime(self):
+        timestamp = 0
+        for index, entry in enumerate(self.entries):
+            self.entries[index] = entry._replace(timestamp=timestamp)
+            timestamp += entry.duration
+        self.changed = True
+
+    # Append the new index, then point the header to it. Headers shorter than
+    # the current one (older files) keep their size: frames follow them.
+    def commit(self):
+        if not self.changed:
+            return
+        index = b''.join(INDEX_ENTRY.pack(*entry) for entry in self.entries)
+        index_offset = self.append(index)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        header = HEADER_V2.pack(
+            SIGNATURE,
+            2,
+            self.options,
+            self.header_size,
+            len(self.entries),
+            self.gif_duration,
+            self.audio_duration,
+            self.gif_offset,
+            self.audio_offset,
+            self.audio_size,
+            index_offset,
+            INDEX_ENTRY.size,
+            self.width,
+            self.height,
+            self.audio_crc,
+            zlib.crc32(index)
+        )
+        self.file.seek(0)
+        self.file.write(header[:self.header_size])
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.committed_end = self.end
+        self.changed = False
+
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            self.commit()
+        finally:
+            self.file.close()
+
+
+# Rewrite a version 2 .agif file without dead space, frames then audio then
+# index, to output_path (the file itself by default, replaced only once the
+# copy is complete). Frame data is copied without decoding. Returns the
+# number of bytes reclaimed.
+def compact(file_path, output_path=None):
+    output_path = output_path or file_path
+    temporary = output_path + '.compact'
+    size = os.path.getsize(file_path)
+    with AgifReader(file_path) as reader:
+        if reader.version != 2:
+            raise ValueError("Only version 2 .agif files (index layout) can be compacted")
+        try:
+            with AgifWriter(temporary, reader.options, reader.width, reader.height) as writer:
+                for index in range(len(reader)):
+                    entry = reader.entry(index)
+                    writer.add_frame(reader.frame(index), entry.duration, entry.flags, entry.x, entry.y,
+                                     entry.codec, entry.disposal)
+                writer.set_audio(reader.audio(), reader.audio_duration)
+        except BaseException:
+            os.remove(temporary)
+            raise
+    os.replace(temporary, output_path)
+    return size - os.path.getsize(output_path)
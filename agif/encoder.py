@@ -0,0 +1,180 @@
+import io
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from PIL import Image
+from .codecs import encode_frame, get_codec
+from .container import AgifStreamWriter, AgifWriter, CODEC_GIF, CODEC_PNG, FRAME_DELTA, OPTION_LOOP
+from . import instrument
+from .frames import iter_delta_frames
+from .gif import DEFAULT_FRAME_DURATION, gif_screen_size, iter_gif_blocks
+from .mp3 import mp3_info
+
+
+# Decode the GIF frames one by one together with their duration in milliseconds
+def iter_gif_frames(gif_path):
+    gif = Image.open(gif_path)
+    try:
+        while True:
+            with instrument.span('gif.decode'):
+                duration = gif.info.get('duration') or DEFAULT_FRAME_DURATION
+                image = gif.copy()
+            yield image, duration
+            gif.seek(gif.tell() + 1)
+    except EOFError:
+        pass
+
+
+# Encode a single frame as PNG data, empty delta frames have no image
+def encode_png(frame, optimize=False, compress_level=6):
+    if frame is None:
+        return b''
+    frame_io = io.BytesIO()
+    frame.save(frame_io, format='PNG', optimize=optimize, compress_level=compress_level)
+    return frame_io.getvalue()
+
+
+# Encode a frame timed as a span; in worker processes the span has no sink
+def encode_timed(encode, codec, image):
+    with instrument.span('frame.encode', codec=codec):
+        return encode(image)
+
+
+# Yield the GIF frames encoded with a frame codec (see codecs.py) with
+# (duration, flags, x, y, codec id), decoding and compressing them one at a
+# time so memory stays bounded. With a keyframe_interval, the frames between
+# keyframes are stored as deltas. level is the compression level of the codec
+# (its default when None), optimize only applies to PNG.
+# With workers != 1 the frames are compressed in a pool (None = one worker per
+# CPU): threads by default, since zlib releases the GIL, or processes. At most
+# two frames per worker are in flight and they are yielded in GIF order, so
+# the output is the same as the serial encoding.
+def iter_encoded_frames(gif_path, codec='png', level=None, optimize=False, workers=1, processes=False,
+                        keyframe_interval=None):
+    codec_id = get_codec(codec).id
+    frames = iter_gif_frames(gif_path)
+    if keyframe_interval:
+        frames = iter_delta_frames(frames, keyframe_interval)
+    else:
+        frames = ((image, duration, 0, 0, 0) for image, duration in frames)
+
+    if codec_id == CODEC_PNG:
+        encode = partial(encode_png, optimize=optimize, compress_level=6 if level is None else level)
+    else:
+        encode = partial(encode_frame, codec=codec_id, level=level)
+    encode = partial(encode_timed, encode, get_codec(codec).name)
+    if workers == 1:
+        for image, *meta in frames:
+            yield (encode(image), *meta, codec_id)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool(workers) as executor:
+        pending = deque()
+        for image, *meta in frames:
+            pending.append((executor.submit(encode, image), meta))
+            if len(pending) >= 2 * workers:
+                future, frame_meta = pending.popleft()
+                yield (future.result(), *frame_meta, codec_id)
+        while pending:
+            future, frame_meta = pending.popleft()
+            yield (future.result(), *frame_meta, codec_id)
+
+
+# Yield the GIF frames as PNG data with (duration, flags, x, y)
+def iter_png_frames(gif_path, optimize=False, compress_level=6, workers=1, processes=False,
+                    keyframe_interval=None):
+    frames = iter_encoded_frames(gif_path, 'png', compress_level, optimize, workers, processes, keyframe_interval)
+    for data, duration, flags, x, y, codec_id in frames:
+        yield data, duration, flags, x, y
+
+
+# Yield the GIF frames as they are stored in the GIF, without decoding them,
+# with (duration, flags, x, y, codec, disposal). Frames that do not cover the
+# whole screen with opaque pixels are drawn over the previous ones.
+def iter_gif_block_frames(gif_path):
+    with open(gif_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        width, height = gif_screen_size(data)
+        for index, frame in enumerate(iter_gif_blocks(data)):
+            covers = (frame.x, frame.y, frame.width, frame.height) == (0, 0, width, height)
+            flags = 0 if index == 0 or (covers and not frame.transparent) else FRAME_DELTA
+            yield frame.data, frame.duration, flags, frame.x, frame.y, CODEC_GIF, frame.disposal
+
+
+# Read all the GIF frames as PNG data together with their duration in milliseconds
+def get_gif_frames(gif_path, optimize=False, compress_level=6, workers=1, processes=False):
+    frames = iter_png_frames(gif_path, optimize, compress_level, workers, processes)
+    return [(frame, duration) for frame, duration, flags, x, y in frames]
+
+
+# Read an MP3 file for the container. The bitstream is copied as it is, after
+# checking its frame headers; it is only re-encoded through pydub when a target
+# bitrate (kbps) is given and the file is above it.
+def get_mp3_data(mp3_path, bitrate=None):
+    with instrument.span('mp3.read'):
+        with open(mp3_path, 'rb') as f:
+            mp3_data = f.read()
+        info = mp3_info(mp3_data)
+    instrument.count('mp3.bytes', len(mp3_data))
+    if bitrate is None or info.bitrate <= bitrate:
+        # MP3 decoders produce 16-bit samples
+        return mp3_data, info.sample_rate, info.channels, 2, info.duration
+
+    # pydub (and its search for ffmpeg) is only needed here
+    from pydub import AudioSegment
+    with instrument.span('mp3.transcode', bitrate=bitrate):
+        audio = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3")
+        mp3_buffer = io.BytesIO()
+        audio.export(mp3_buffer, format="mp3", bitrate=f"{bitrate}k")
+    return mp3_buffer.getvalue(), audio.frame_rate, audio.channels, audio.sample_width, len(audio)
+
+
+# Write an encoded frame, timed as a span
+def write_frame(writer, frame):
+    with instrument.span('file.write'):
+        writer.add_frame(*frame)
+    instrument.count('frames')
+    instrument.count('frame.bytes', len(frame[0]))
+
+
+# Create a version 2 .agif file from a GIF and an MP3. Frames are written as
+# soon as they are encoded, the header and index are written at the end.
+# With codec='gif' the palette frames of the GIF are copied as they are, with
+# their disposal methods. Any other codec of the registry (png, zlib, lzma, and
+# zstd or lz4 when installed) re-encodes the frames at compress_level (the
+# default of the codec when None); keyframe_interval enables delta frames with
+# a keyframe every N frames (GIF blocks cannot be turned into deltas, so it is
+# refused with codec='gif').
+# With layout='stream' a version 3 file is written instead, with the audio
+# interleaved with the frames for progressive playback; output_path can then
+# also be a writable binary file object (e.g. sys.stdout.buffer).
+def create_agif(gif_path, mp3_path, output_path, optimize=False, compress_level=None, bitrate=None,
+                workers=1, processes=False, keyframe_interval=None, codec='png', layout='index'):
+    if keyframe_interval and get_codec(codec).id == CODEC_GIF:
+        raise ValueError("Delta frames (keyframe_interval) cannot be used with the gif codec")
+    mp3_data, sample_rate, channels, sample_width, mp3_duration = get_mp3_data(mp3_path, bitrate)
+    with Image.open(gif_path) as gif:
+        width, height = gif.size
+
+    if get_codec(codec).id == CODEC_GIF:
+        frames = iter_gif_block_frames(gif_path)
+    else:
+        frames = iter_encoded_frames(gif_path, codec, compress_level, optimize, workers, processes,
+                                     keyframe_interval)
+
+    if layout == 'stream':
+        with AgifStreamWriter(output_path, OPTION_LOOP, width, height) as writer:
+            writer.set_audio(mp3_data, mp3_duration)
+            for frame in frames:
+                write_frame(writer, frame)
+    elif layout == 'index':
+        with AgifWriter(output_path, OPTION_LOOP, width, height) as writer:
+            for frame in frames:
+                write_frame(writer, frame)
+            with instrument.span('file.write'):
+                writer.set_audio(mp3_data, mp3_duration)
+    else:
+        raise ValueError(f"Unknown layout: {layout}")
@@ -0,0 +1,258 @@
+import io
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from . import instrument
+from .container import CODEC_GIF, DISPOSE_BACKGROUND, DISPOSE_NONE, OPTION_LOOP, AgifReader
+from .gif import gif_frame_block, gif_header
+
+# Bytes copied at a time when os.sendfile is not available
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Highest frame rate of an MP4 export, in frames per second
+MAX_VIDEO_FPS = 50
+
+EXPORT_FORMATS = ('gif', 'mp3', 'mp4')
+
+
+# Copy size bytes of the reader's file from offset to a binary file, in the
+# kernel with os.sendfile where possible, else from the mapping
+def copy_range(reader, output, offset, size):
+    if hasattr(os, 'sendfile'):
+        output.flush()
+        try:
+            while size:
+                sent = os.sendfile(output.fileno(), reader.file.fileno(), offset, size)
+                if not sent:
+                    break
+                offset += sent
+                size -= sent
+        except OSError:
+            # Not supported between these files: the rest is copied below
+            pass
+    for start in range(offset, offset + size, COPY_CHUNK_SIZE):
+        output.write(reader.view[start:min(start + COPY_CHUNK_SIZE, offset + size)])
+
+
+# Write the MP3 bitstream of an open reader to a binary file as it is stored
+def write_audio(reader, output):
+    if not reader.audio_size:
+        raise ValueError("The .agif file has no audio")
+    with instrument.span('export.mp3', bytes=reader.audio_size):
+        if reader.version == 3:
+            for offset, size in reader._audio_chunks:
+                copy_range(reader, output, offset, size)
+        else:
+            copy_range(reader, output, reader.audio_offset, reader.audio_size)
+
+
+def export_mp3(file_path, output_path):
+    with AgifReader(file_path) as reader, open(output_path, 'wb') as output:
+        write_audio(reader, output)
+
+
+# Blocks of the frames of a reader whose frames are all GIF image blocks,
+# copied without decoding with the timing and positions of the index
+def iter_stored_gif_frames(reader):
+    for index in range(len(reader)):
+        entry = reader.entry(index)
+        yield gif_frame_block(reader.frame(index), entry.x, entry.y, entry.duration, entry.disposal)
+
+
+# Blocks of the frames of any reader: every frame is decoded, quantized to its
+# own palette of up to 255 colors plus a transparent one, and encoded as a
+# full-screen GIF frame, one frame at a time
+def iter_encoded_gif_frames(reader):
+    import numpy as np
+    from PIL import Image
+    from .frames import FrameDecoder
+
+    decoder = FrameDecoder(reader)
+    for index in range(len(reader)):
+        image = decoder.decode(index).convert('RGBA')
+        with instrument.span('export.quantize'):
+            transparent = np.asarray(image)[..., 3] < 128
+            quantized = image.convert('RGB').quantize(255)
+            pixels = np.array(quantized)
+            pixels[transparent] = 255
+            frame = Image.fromarray(pixels, 'P')
+            # Frames with fewer colors get a shorter palette: padded so that
+            # index 255 is the transparent color
+            palette = quantized.getpalette()[:765]
+            frame.putpalette(palette + [0] * (765 - len(palette)) + [0, 0, 0])
+            data = io.BytesIO()
+            frame.save(data, 'GIF', transparency=255)
+        # Frames with transparent pixels must not show the previous frame through them
+        disposal = DISPOSE_BACKGROUND if transparent.any() else DISPOSE_NONE
+        yield gif_frame_block(data.getvalue(), 0, 0, reader.entry(index).duration, disposal)
+
+
+# Rebuild a GIF from an .agif file, writing one frame at a time. Files with
+# the gif codec get back their original image blocks, palettes and LZW data
+# (only the header around them is new); frames of other codecs are decoded
+# and quantized.
+def export_gif(file_path, output_path):
+    with AgifReader(file_path) as reader, open(output_path, 'wb') as output:
+        if not len(reader):
+            raise ValueError("The .agif file has no frames")
+        stored = all(reader.entry(index).codec == CODEC_GIF for index in range(len(reader)))
+        frames = iter_stored_gif_frames(reader) if stored else iter_encoded_gif_frames(reader)
+        width, height = reader.width, reader.height
+        if not width or not height:
+            # Version 1 files do not store the screen size
+            from .frames import FrameDecoder
+            width, height = FrameDecoder(reader).decode(0).size
+        output.write(gif_header(width, height, bool(reader.options & OPTION_LOOP)))
+        for block in frames:
+            output.write(block)
+        output.write(b'\x3B')
+
+
+# Frame rate showing every frame duration exactly (their greatest common
+# divisor), up to MAX_VIDEO_FPS
+def video_fps(durations):
+    step = reduce(math.gcd, (max(1, duration) for duration in durations))
+    return min(MAX_VIDEO_FPS, max(1, round(1000 / step)))
+
+
+# Mux an .agif file into an MP4 with a local ffmpeg: the frames are decoded
+# one at a time and piped as raw video, the MP3 is copied into the MP4
+# without re-encoding. The GIF loops for as long as the audio plays.
+def export_mp4(file_path, output_path, ffmpeg=None, fps=None):
+    ffmpeg = ffmpeg or shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise ValueError("MP4 export needs ffmpeg")
+    from PIL import Image
+    from .frames import FrameDecoder
+
+    with AgifReader(file_path) as reader, tempfile.TemporaryDirectory() as directory:
+        if not len(reader):
+            raise ValueError("The .agif file has no frames")
+        decoder = FrameDecoder(reader)
+        first = decoder.decode(0)
+        durations = [reader.entry(index).duration for index in range(len(reader))]
+        fps = fps or video_fps(durations)
+        gif_duration = max(1, sum(durations))
+        total = max(gif_duration, reader.audio_duration if reader.audio_size else 0)
+
+        command = [ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', f"{first.width}x{first.height}", '-r', str(fps), '-i', '-']
+        if reader.audio_size:
+            audio_path = os.path.join(directory, 'audio.mp3')
+            with open(audio_path, 'wb') as output:
+                write_audio(reader, output)
+            command += ['-i', audio_path, '-c:a', 'copy']
+        # H.264 in yuv420p needs even dimensions
+        command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+                    '-movflags', '+faststart', output_path]
+
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        shown = pixels = None
+        try:
+            for number in range(max(1, math.ceil(total * fps / 1000))):
+                index = reader.frame_at(number * 1000 // fps % gif_duration)
+                if index != shown:
+                    image = decoder.decode(index).convert('RGBA')
+                    # Transparent pixels are shown over black
+                    background = Image.new('RGB', image.size)
+                    background.paste(image, mask=image.getchannel('A'))
+                    pixels = background.tobytes()
+                    shown = index
+                process.stdin.write(pixels)
+        except BrokenPipeError:
+            # ffmpeg stopped, its exit status tells why
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            status = process.wait()
+        if status:
+            raise ValueError(f"ffmpeg failed with exit status {status}")
+
+
+EXPORTERS = {'gif': export_gif, 'mp3': export_mp3, 'mp4': export_mp4}
+
+
+# Formats an .agif file is exported to: files with no audio have no mp3
+def export_formats(file_path, formats):
+    for export_format in formats:
+        if export_format not in EXPORTERS:
+            raise ValueError(f"Unknown export format: {export_format}")
+    if 'mp3' in formats:
+        with AgifReader(file_path) as reader:
+            if not reader.audio_size:
+                return tuple(export_format for export_format in formats if export_format != 'mp3')
+    return tuple(formats)
+
+
+# Export an .agif file to each format, next to output_base (a path without
+# extension)
+def export_file(file_path, output_base, formats=('gif', 'mp3')):
+    written = []
+    for export_format in export_formats(file_path, formats):
+        output_path = f"{output_base}.{export_format}"
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        try:
+            EXPORTERS[export_format](file_path, output_path)
+        except BaseException:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+        written.append(output_path)
+    return written
+
+
+# export_file for the pool, returning the error message instead of raising
+def export_job(job):
+    try:
+        export_file(*job)
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return None
+
+
+# Export every .agif file under a directory into output_dir (same relative
+# paths) over a pool of worker processes. Files whose exports are all newer
+# than them are skipped. Returns a summary of the run.
+def export_directory(directory, output_dir, formats=('gif', 'mp3'), workers=None, log=print):
+    start = time.perf_counter()
+    summary = {'exported': 0, 'skipped': 0, 'failed': 0}
+    jobs = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith('.agif'):
+                continue
+            file_path = os.path.join(root, name)
+            output_base = os.path.join(output_dir, os.path.splitext(os.path.relpath(file_path, directory))[0])
+            mtime = os.path.getmtime(file_path)
+            try:
+                outputs = [f"{output_base}.{export_format}" for export_format in export_formats(file_path, formats)]
+            except (OSError, ValueError):
+                # Unreadable files are left to the job, which reports the error
+                outputs = [None]
+            if all(path and os.path.exists(path) and os.path.getmtime(path) >= mtime for path in outputs):
+                summary['skipped'] += 1
+            else:
+                jobs.append((file_path, output_base, formats))
+
+    # Each job streams its frames: memory stays bounded by one frame per worker
+    with ProcessPoolExecutor(workers) as executor:
+        for job, error in zip(jobs, executor.map(export_job, jobs)):
+            if error is None:
+                summary['exported'] += 1
+            else:
+                summary['failed'] += 1
+                log(f"FAIL  {job[0]}  {error}")
+
+    summary['seconds'] = time.perf_counter() - start
+    log(f"{summary['exported']} exported, {summary['skipped']} skipped, {summary['failed']} failed "
+        f"in {summary['seconds']:.2f} s")
+    return summary
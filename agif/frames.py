@@ -0,0 +1,98 @@
+import numpy as np
+from PIL import Image
+from . import instrument
+from .codecs import decode_frame
+from .container import CODEC_GIF, DISPOSE_BACKGROUND, DISPOSE_PREVIOUS, FRAME_DELTA
+
+
+# Turn the frames between keyframes into deltas: the crop of the region that
+# changed since the previous frame, with its position. Yields
+# (image, duration, flags, x, y); image is None for a frame equal to the previous one.
+def iter_delta_frames(frames, keyframe_interval):
+    previous = None
+    for index, (image, duration) in enumerate(frames):
+        pixels = np.asarray(image.convert('RGBA'))
+        if previous is None or index % keyframe_interval == 0 or pixels.shape != previous.shape:
+            yield image, duration, 0, 0, 0
+            previous = pixels
+            continue
+
+        changed = np.any(pixels != previous, axis=2)
+        previous = pixels
+        rows = np.flatnonzero(changed.any(axis=1))
+        if rows.size == 0:
+            yield None, duration, FRAME_DELTA, 0, 0
+            continue
+        columns = np.flatnonzero(changed.any(axis=0))
+        top, bottom = int(rows[0]), int(rows[-1]) + 1
+        left, right = int(columns[0]), int(columns[-1]) + 1
+        if bottom - top == changed.shape[0] and right - left == changed.shape[1]:
+            # The whole frame changed, a keyframe costs the same
+            yield image, duration, 0, 0, 0
+        else:
+            yield image.crop((left, top, right, bottom)), duration, FRAME_DELTA, left, top
+
+
+# Decode frames of an AgifReader into PIL images, rebuilding delta frames from
+# the previous keyframe and compositing GIF frames on the logical screen. The
+# last decoded frame is kept, so sequential access decodes each frame once.
+class FrameDecoder:
+    def __init__(self, reader):
+        self.reader = reader
+        self.index = None
+        self.image = None
+        # Disposal method and box of the last GIF frame drawn, and the screen
+        # to go back to for DISPOSE_PREVIOUS
+        self.disposal = 0
+        self.disposal_box = None
+        self.restore = None
+
+    def keyframe(self, index):
+        while index > 0 and self.reader.entry(index).flags & FRAME_DELTA:
+            index -= 1
+        return index
+
+    def decode(self, index):
+        start = self.keyframe(index)
+        if self.index is not None and start <= self.index <= index:
+            start = self.index + 1
+        else:
+            self.image = self.restore = None
+            self.disposal = 0
+        for position in range(start, index + 1):
+            entry = self.reader.entry(position)
+            data = self.reader.frame(position)
+            with instrument.span('frame.decode', codec=entry.codec):
+                if entry.codec == CODEC_GIF:
+                    self.image = self.draw_gif_frame(entry, data)
+                elif not entry.flags & FRAME_DELTA:
+                    self.image = decode_frame(entry.codec, data)
+                    # GIF frames drawn over it start from this screen
+                    self.disposal = 0
+                    self.restore = None
+                elif entry.size:
+                    crop = decode_frame(entry.codec, data).convert('RGBA')
+                    image = self.image.convert('RGBA')
+                    image.paste(crop, (entry.x, entry.y))
+                    self.image = image
+            instrument.count('frame.bytes_read', entry.size)
+            self.index = position
+        return self.image
+
+    def draw_gif_frame(self, entry, data):
+        frame = decode_frame(CODEC_GIF, data).convert('RGBA')
+        if self.image is None or not entry.flags & FRAME_DELTA:
+            screen = Image.new('RGBA', (self.reader.width, self.reader.height))
+        else:
+            screen = self.image.convert('RGBA')
+            if self.disposal == DISPOSE_BACKGROUND:
+                screen.paste((0, 0, 0, 0), self.disposal_box)
+            elif self.disposal == DISPOSE_PREVIOUS and self.restore is not None:
+                screen = self.restore.copy()
+
+        if entry.disposal == DISPOSE_PREVIOUS:
+            self.restore = screen.copy()
+        screen.alpha_composite(frame, (entry.x, entry.y))
+        self.disposal = entry.disposal
+        self.disposal_box = (entry.x, entry.y, entry.x + frame.width, entry.y + frame.height)
+        return screen
@@ -0,0 +1,149 @@
+import struct
+from collections import namedtuple
+
+# Frames without a delay are shown for 100 ms, like browsers do
+DEFAULT_FRAME_DURATION = 100
+
+SCREEN_DESCRIPTOR = struct.Struct('<HHBBB')  # width, height, flags, background, aspect
+IMAGE_DESCRIPTOR = struct.Struct('<HHHHB')  # left, top, width, height, flags
+
+# A single GIF frame as a standalone GIF file (data) with its position on the
+# logical screen, delay, disposal method and transparency
+GifFrame = namedtuple('GifFrame', 'data x y width height duration disposal transparent')
+
+
+# Size of the color table announced by the flags of a descriptor
+def color_table_size(flags):
+    return 3 * (2 << (flags & 0x07)) if flags & 0x80 else 0
+
+
+# Offset after the data sub-blocks starting at offset
+def skip_sub_blocks(data, offset):
+    while True:
+        if offset >= len(data):
+            raise ValueError("Truncated GIF data")
+        size = data[offset]
+        offset += 1
+        if size == 0:
+            return offset
+        offset += size
+
+
+# Width and height of the logical screen of a GIF
+def gif_screen_size(data):
+    if data[:6] not in (b'GIF87a', b'GIF89a'):
+        raise ValueError("File not recognized as GIF image")
+    width, height, flags, background, aspect = SCREEN_DESCRIPTOR.unpack_from(data, 6)
+    return width, height
+
+
+# Split a GIF into its frames without decoding them: every image block is
+# copied with its color table and graphic control extension into a standalone
+# GIF whose screen is the size of the frame
+def iter_gif_blocks(data):
+    width, height = gif_screen_size(data)
+    screen_flags = data[10]
+    offset = 13
+    global_table = bytes(data[offset:offset + color_table_size(screen_flags)])
+    offset += len(global_table)
+
+    control = b''
+    while offset < len(data):
+        block = data[offset]
+        if block == 0x3B:  # trailer
+            break
+        if block == 0x21:  # extension
+            label = data[offset + 1]
+            end = skip_sub_blocks(data, offset + 2)
+            if label == 0xF9:
+                control = bytes(data[offset:end])
+            offset = end
+        elif block == 0x2C:  # image
+            left, top, frame_width, frame_height, flags = IMAGE_DESCRIPTOR.unpack_from(data, offset + 1)
+            start = offset + 1 + IMAGE_DESCRIPTOR.size
+            end = skip_sub_blocks(data, start + color_table_size(flags) + 1)
+
+            delay = disposal = transparent = 0
+            if control:
+                packed, delay = struct.unpack_from('<BH', control, 3)
+                disposal = (packed >> 2) & 0x07
+                transparent = packed & 0x01
+
+            # The local color table, when present, replaces the global one
+            table_flags = screen_flags if not flags & 0x80 else screen_flags & 0x70
+            frame = b''.join((
+                b'GIF89a',
+                SCREEN_DESCRIPTOR.pack(frame_width, frame_height, table_flags, 0, 0),
+                global_table if not flags & 0x80 else b'',
+                control,
+                b'\x2C',
+                IMAGE_DESCRIPTOR.pack(0, 0, frame_width, frame_height, flags),
+                data[start:end],
+                b'\x3B',
+            ))
+            yield GifFrame(frame, left, top, frame_width, frame_height,
+                           delay * 10 or DEFAULT_FRAME_DURATION, disposal, transparent)
+            control = b''
+            offset = end
+        else:
+            raise ValueError(f"Unknown GIF block 0x{block:02x} at offset {offset}")
+
+
+# Color table of each frame of a GIF, read without decoding the frames:
+# (RGB bytes, index of the transparent color or None)
+def iter_color_tables(data):
+    for frame in iter_gif_blocks(data):
+        frame_data = frame.data
+        offset = 13 + color_table_size(frame_data[10])
+        table = frame_data[13:offset]
+        transparent = None
+        while frame_data[offset] == 0x21:
+            end = skip_sub_blocks(frame_data, offset + 2)
+            if frame_data[offset + 1] == 0xF9:
+                packed, delay, index = struct.unpack_from('<BHB', frame_data, offset + 3)
+                if packed & 0x01:
+                    transparent = index
+            offset = end
+        flags = IMAGE_DESCRIPTOR.unpack_from(frame_data, offset + 1)[4]
+        if flags & 0x80:
+            start = offset + 1 + IMAGE_DESCRIPTOR.size
+            table = frame_data[start:start + color_table_size(flags)]
+        yield table, transparent
+
+
+# Start of a GIF with a logical screen of width x height and no global color
+# table, looping forever when loop is set (NETSCAPE2.0 extension)
+def gif_header(width, height, loop=True):
+    header = b'GIF89a' + SCREEN_DESCRIPTOR.pack(width, height, 0, 0, 0)
+    if loop:
+        header += b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', 0) + b'\x00'
+    return header
+
+
+# Turn a single-frame GIF, like the frames of iter_gif_blocks, back into the
+# blocks of a frame of another GIF: graphic control extension with the given
+# delay and disposal, image descriptor at (x, y) and the LZW data copied as
+# it is. A global color table becomes the local table of the frame, so the
+# colors never need to be quantized again.
+def gif_frame_block(data, x, y, duration, disposal):
+    screen_flags = data[10]
+    global_table = bytes(data[13:13 + color_table_size(screen_flags)])
+    offset = 13 + len(global_table)
+
+    packed, transparent_index = 0, 0
+    while data[offset] == 0x21:
+        end = skip_sub_blocks(data, offset + 2)
+        if data[offset + 1] == 0xF9:
+            packed, delay, transparent_index = struct.unpack_from('<BHB', data, offset + 3)
+        offset = end
+    if data[offset] != 0x2C:
+        raise ValueError("GIF frame has no image block")
+    left, top, width, height, flags = IMAGE_DESCRIPTOR.unpack_from(data, offset + 1)
+    image = bytes(data[offset + 1 + IMAGE_DESCRIPTOR.size:len(data) - 1])  # without the trailer
+
+    packed = (packed & ~0x1C) | (disposal & 0x07) << 2
+    control = b'\x21\xF9\x04' + struct.pack('<BHB', packed, round(duration / 10), transparent_index) + b'\x00'
+    if not flags & 0x80 and global_table:
+        flags |= 0x80 | (screen_flags & 0x07)
+        image = global_table + image
+    return control + b'\x2C' + IMAGE_DESCRIPTOR.pack(x, y, width, height, flags) + image
@@ -0,0 +1,231 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Instrumentation of the hot paths: timed spans around the stages of
+# encoding, decoding and playback, and counters (bytes, frames, cache hits),
+# sent to the sinks added with add_sink. With no sink (the default) span()
+# returns a shared context manager that does nothing and count() returns at
+# once, so the instrumented code costs one function call per stage. The
+# modules needed by the sinks are only imported when one is created.
+#
+# A sink has span(name, seconds, attributes) and count(name, value,
+# attributes) methods, called from any thread.
+sinks = []
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        for sink in sinks:
+            sink.span(self.name, seconds, self.attributes)
+        return False
+
+
+def enabled():
+    return bool(sinks)
+
+
+# Time the block as a span named name, e.g. with span('frame.decode', index=3)
+def span(name, **attributes):
+    if not sinks:
+        return NULL_SPAN
+    return Span(name, attributes)
+
+
+def count(name, value=1, **attributes):
+    if not sinks:
+        return
+    for sink in sinks:
+        sink.count(name, value, attributes)
+
+
+def add_sink(sink):
+    sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    if sink in sinks:
+        sinks.remove(sink)
+
+
+# Send the spans and counters of the block to the given sinks
+@contextmanager
+def recording(*added):
+    for sink in added:
+        add_sink(sink)
+    try:
+        yield added[0] if len(added) == 1 else added
+    finally:
+        for sink in added:
+            remove_sink(sink)
+
+
+# One JSON object per span or counter, written to a file path or a text file
+# object: {"type": "span", "name": ..., "ms": ..., "time": ..., attributes}
+class JsonLinesSink:
+    def __init__(self, output):
+        import json
+        self.dumps = json.dumps
+        self.owned = isinstance(output, (str, bytes, os.PathLike))
+        self.file = open(output, 'a') if self.owned else output
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = self.dumps(record, default=str) + '\n'
+        with self.lock:
+            self.file.write(line)
+
+    def span(self, name, seconds, attributes):
+        self.write({'type': 'span', 'name': name, 'ms': round(seconds * 1000, 3), 'time': time.time(),
+                    **attributes})
+
+    def count(self, name, value, attributes):
+        self.write({'type': 'count', 'name': name, 'value': value, 'time': time.time(), **attributes})
+
+    def close(self):
+        with self.lock:
+            if self.owned:
+                self.file.close()
+            else:
+                self.file.flush()
+
+
+# Durations of the spans and totals of the counters kept in memory, by name
+class HistogramSink:
+    def __init__(self):
+        self.spans = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def span(self, name, seconds, attributes):
+        with self.lock:
+            self.spans.setdefault(name, []).append(seconds)
+
+    def count(self, name, value, attributes):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # Count, total and percentiles of each span in ms
+    def summary(self):
+        import statistics
+        with self.lock:
+            spans = {name: sorted(durations) for name, durations in self.spans.items()}
+            counters = dict(self.counters)
+        result = {}
+        for name, durations in spans.items():
+            result[name] = {
+                'count': len(durations),
+                'total_ms': sum(durations) * 1000,
+                'mean_ms': statistics.fmean(durations) * 1000,
+                'p50_ms': durations[len(durations) // 2] * 1000,
+                'p95_ms': durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+                'max_ms': durations[-1] * 1000,
+            }
+        return {'spans': result, 'counters': counters}
+
+    # Table of the spans, slowest stage first, and of the counters
+    def report(self, log=print):
+        summary = self.summary()
+        spans = sorted(summary['spans'].items(), key=lambda item: item[1]['total_ms'], reverse=True)
+        if spans:
+            log(f"{'span':<20} {'count':>7} {'total ms':>10} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+        for name, stats in spans:
+            log(f"{name:<20} {stats['count']:>7} {stats['total_ms']:>10.1f} {stats['mean_ms']:>8.2f} "
+                f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['max_ms']:>8.2f}")
+        for name, value in sorted(summary['counters'].items()):
+            log(f"{name:<20} {value:>7}")
+
+
+# Profile the block with cProfile, writing the statistics to output_path (for
+# pstats or snakeviz) or logging the slowest functions
+@contextmanager
+def profile(output_path=None, limit=25, log=print):
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output_path:
+            profiler.dump_stats(output_path)
+        else:
+            stream = LogStream(log)
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+            stream.flush()
+
+
+# Trace the memory allocated by the block with tracemalloc, logging its peak
+# and the lines that allocated the most memory still in use at the end
+@contextmanager
+def trace_memory(limit=10, log=print):
+    import tracemalloc
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started:
+            tracemalloc.stop()
+        log(f"memory: {current / 1e6:.1f} MB in use, {peak / 1e6:.1f} MB peak")
+        for statistic in snapshot.statistics('lineno')[:limit]:
+            log(f"  {statistic}")
+
+
+class LogStream:
+    def __init__(self, log):
+        self.log = log
+        self.buffer = ''
+
+    def write(self, text):
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split('\n')
+        for line in lines:
+            self.log(line)
+
+    def flush(self):
+        if self.buffer:
+            self.log(self.buffer)
+            self.buffer = ''
+
+
+# Instrumentation of the GUI players, which have no command line options: the
+# AGIF_TRACE environment variable names a JSON lines file receiving the spans
+# and counters, AGIF_STATS=1 prints their summary at exit
+def configure_from_environment():
+    import atexit
+    if os.environ.get('AGIF_TRACE'):
+        atexit.register(add_sink(JsonLinesSink(os.environ['AGIF_TRACE'])).close)
+    if os.environ.get('AGIF_STATS'):
+        atexit.register(add_sink(HistogramSink()).report, lambda line: print(line, file=sys.stderr))
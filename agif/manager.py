@@ -0,0 +1,152 @@
+import math
+import time
+import traceback
+from . import instrument
+from .audio import Mixer, audio_duration, default_cache_dir
+from .cache import DEFAULT_BUDGET, FrameProvider, SharedCache
+from .clock import PlaybackClock
+from .container import AgifReader
+
+# Memory budgets shared by all the players of a manager, in bytes: decoded
+# frames, and the display images (e.g. PhotoImages) built from them
+DEFAULT_FRAME_BUDGET = 4 * DEFAULT_BUDGET
+DEFAULT_PHOTO_BUDGET = DEFAULT_BUDGET
+
+
+# An .agif file played by a PlaybackManager. frames is its FrameProvider and
+# photos a cache for the display images of its frames, both views of the
+# caches of the manager; due is the time of its next frame change, in
+# monotonic ms, and index the frame on screen.
+class Playback:
+    def __init__(self, reader, frames, photos, audio, clock, show):
+        self.reader = reader
+        self.frames = frames
+        self.photos = photos
+        self.audio = audio
+        self.clock = clock
+        self.show = show
+        self.due = 0
+        self.index = None
+
+
+# Plays many .agif files at once in a Tk application. One Mixer serves all
+# the players, each on its own channel, so opening or closing a file never
+# touches the audio of the others; a single timer of root (any object with
+# the after/after_cancel methods of Tk widgets) drives all the players; and the
+# decoded frames of all of them share one memory budget, as do their display
+# images.
+#
+# show(playback, index) is called on the Tk thread each time the frame of a
+# playback changes; it builds the display image of the frame, keeping it in
+# playback.photos. Only files can be played, the audio of streams still being
+# received needs pygame.mixer.music, of which there is a single one.
+class PlaybackManager:
+    def __init__(self, root, budget=DEFAULT_FRAME_BUDGET, photo_budget=DEFAULT_PHOTO_BUDGET, prefetch=4,
+                 cache_dir=None):
+        self.root = root
+        self.frames = SharedCache(budget)
+        self.photos = SharedCache(photo_budget)
+        self.prefetch = prefetch
+        self.mixer = Mixer(default_cache_dir() if cache_dir is None else cache_dir)
+        self.playbacks = []
+        self.after_id = None
+
+    def __len__(self):
+        return len(self.playbacks)
+
+    def open(self, file_path, show):
+        reader = AgifReader(file_path)
+        try:
+            return self.add(reader, show)
+        except Exception:
+            reader.close()
+            raise
+
+    # Start playing an open reader, which is closed with the playback
+    def add(self, reader, show):
+        if not len(reader):
+            raise ValueError("The .agif file has no frames")
+        frames = FrameProvider(reader, prefetch=self.prefetch, cache=self.frames.view())
+        audio = None
+        try:
+            # The first frame is decoded now, to report errors before playing
+            frames[0]
+            if reader.audio_size:
+                audio = self.mixer.player(bytes(reader.audio()))
+        except Exception:
+            frames.close()
+            frames.cache.clear()
+            raise
+
+        durations = [reader.entry(index).duration for index in range(len(reader))]
+        if audio is not None:
+            clock = PlaybackClock(durations, audio.length or audio_duration(reader), audio.position)
+        else:
+            clock = PlaybackClock(durations)
+        playback = Playback(reader, frames, self.photos.view(), audio, clock, show)
+        if audio is not None:
+            audio.play()
+        playback.due = self.now()
+        self.playbacks.append(playback)
+        self.schedule()
+        return playback
+
+    def close(self, playback):
+        if playback not in self.playbacks:
+            return
+        self.playbacks.remove(playback)
+        if playback.audio is not None:
+            self.mixer.release(playback.audio)
+        playback.frames.close()
+        playback.frames.cache.clear()
+        playback.photos.clear()
+        playback.reader.close()
+        self.schedule()
+
+    def close_all(self):
+        for playback in list(self.playbacks):
+            self.close(playback)
+
+    def now(self):
+        return time.monotonic() * 1000
+
+    # Update every player whose frame changes now, then wait for the next one
+    def tick(self):
+        self.after_id = None
+        now = self.now()
+        for playback in list(self.playbacks):
+            if playback.due > now:
+                continue
+            try:
+                index = playback.clock.tick()
+                # An early tick (e.g. the audio position not advanced yet) keeps the frame on screen
+                if index != playback.index:
+                    with instrument.span('player.show'):
+                        playback.show(playback, index)
+                    playback.index = index
+            except Exception:
+                # A failing player is closed, the others keep playing
+                traceback.print_exc()
+                self.close(playback)
+                continue
+            # The delay is computed after drawing, so drawing time does not accumulate
+            playback.due = self.now() + playback.clock.next_delay()
+        self.schedule()
+
+    def schedule(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        if self.playbacks:
+            delay = min(playback.due for playback in self.playbacks) - self.now()
+            # Rounded up: a tick before the frame change would only show the same frame again
+            self.after_id = self.root.after(max(1, math.ceil(delay)), self.tick)
+
+    def stats(self):
+        return {
+            'players': len(self.playbacks),
+            'frame_cache_bytes': self.frames.size,
+            'photo_cache_bytes': self.photos.size,
+            'dropped_frames': sum(playback.clock.dropped_frames for playback in self.playbacks),
+            'max_drift': max((playback.clock.max_drift for playback in self.playbacks), default=0),
+        }
@@ -0,0 +1,139 @@
+from collections import namedtuple
+
+# Bitrates in kbps by (MPEG-1, layer) and bitrate index, 0 means free format
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# Sample rates by version bits (0 = MPEG-2.5, 2 = MPEG-2, 3 = MPEG-1)
+SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+
+FrameHeader = namedtuple('FrameHeader', 'length samples sample_rate channels bitrate mpeg1')
+Mp3Info = namedtuple('Mp3Info', 'duration sample_rate channels bitrate num_frames')
+
+
+# Parse the 4-byte MPEG audio frame header at offset, None if it is not valid
+def parse_frame_header(data, offset):
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset:offset + 4]
+    if b0 != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = BITRATES[mpeg1, layer][bitrate_index]
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    channels = 1 if b3 >> 6 == 3 else 2
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples = 1152 if mpeg1 or layer == 2 else 576
+        length = samples // 8 * bitrate * 1000 // sample_rate + padding
+    return FrameHeader(length, samples, sample_rate, channels, bitrate, mpeg1)
+
+
+# Offset of the first audio frame, after an optional ID3v2 tag
+def find_first_frame(data):
+    start = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        start = 10 + size + (10 if data[5] & 0x10 else 0)
+
+    # A frame is only accepted when another valid frame follows it
+    offset = data.find(b'\xff', start)
+    while offset != -1:
+        header = parse_frame_header(data, offset)
+        if header is not None:
+            following = offset + header.length
+            if following == len(data) or parse_frame_header(data, following) is not None:
+                return offset
+        offset = data.find(b'\xff', offset + 1)
+    raise ValueError("File not recognized as MP3 audio")
+
+
+# Number of frames stored in a Xing/Info or VBRI tag, None without a tag
+def tag_frame_count(data, offset, header):
+    if header.mpeg1:
+        side_info = 17 if header.channels == 1 else 32
+    else:
+        side_info = 9 if header.channels == 1 else 17
+    xing = offset + 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = int.from_bytes(data[xing + 4:xing + 8], 'big')
+        if flags & 0x01:
+            return int.from_bytes(data[xing + 8:xing + 12], 'big')
+    vbri = offset + 4 + 32
+    if data[vbri:vbri + 4] == b'VBRI':
+        return int.from_bytes(data[vbri + 14:vbri + 18], 'big')
+    return None
+
+
+# Read duration (ms), sample rate, channels, average bitrate (kbps) and number of
+# frames of MP3 data from the frame headers, without decoding any audio
+def mp3_info(data):
+    offset = find_first_frame(data)
+    first = parse_frame_header(data, offset)
+
+    num_frames = tag_frame_count(data, offset, first)
+    if num_frames is not None:
+        audio_size = len(data) - offset - first.length
+    else:
+        num_frames = 0
+        audio_size = 0
+        header = first
+        while header is not None:
+            num_frames += 1
+            audio_size += header.length
+            offset += header.length
+            header = parse_frame_header(data, offset)
+
+    duration = num_frames * first.samples * 1000 // first.sample_rate
+    bitrate = audio_size * 8 // duration if duration else first.bitrate
+    return Mp3Info(duration, first.sample_rate, first.channels, bitrate, num_frames)
+
+
+# Split MP3 data at frame boundaries into chunks of about chunk_ms milliseconds,
+# yielding (timestamp, duration, data) in ms. Each chunk can be decoded on its
+# own. Data before the first frame (ID3v2 tag) goes with the first chunk, data
+# after the last frame (ID3v1/APE tags, or anything after an invalid frame) is
+# a last chunk of 0 ms, so joining the chunks gives back the data unchanged.
+def split_mp3(data, chunk_ms):
+    offset = find_first_frame(data)
+    start = 0
+    samples = 0
+    chunk_samples = 0
+    header = parse_frame_header(data, offset)
+    while header is not None:
+        samples += header.samples
+        offset += header.length
+        if (samples - chunk_samples) * 1000 >= chunk_ms * header.sample_rate:
+            timestamp = chunk_samples * 1000 // header.sample_rate
+            yield timestamp, samples * 1000 // header.sample_rate - timestamp, data[start:offset]
+            start = offset
+            chunk_samples = samples
+        sample_rate = header.sample_rate
+        header = parse_frame_header(data, offset)
+    if samples > chunk_samples:
+        timestamp = chunk_samples * 1000 // sample_rate
+        yield timestamp, samples * 1000 // sample_rate - timestamp, data[start:min(offset, len(data))]
+        start = offset
+    if start < len(data):
+        yield samples * 1000 // sample_rate, 0, data[start:]
@@ -0,0 +1,360 @@
+import hashlib
+import mmap
+import multiprocessing
+import os
+import secrets
+import struct
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from . import instrument
+from .container import AgifReader
+from .frames import FrameDecoder
+
+# Default memory budget of a pool, in bytes of decoded RGBA pixels
+DEFAULT_SHARED_BUDGET = 256 * 1024 * 1024
+
+# Default number of frames a pool can hold at once
+DEFAULT_SLOTS = 4096
+
+# Seconds between two checks of a frame being decoded by another process
+WAIT_INTERVAL = 0.001
+
+SLOT_FREE = 0
+SLOT_DECODING = 1
+SLOT_READY = 2
+
+# One slot of the table shared by the processes of a pool: the frame key
+# (file hash and frame index), its state, the processes using it, the process
+# decoding it, a generation number naming its segment, its size and the time
+# it was last used
+SLOT = np.dtype([
+    ('key', 'S20'),
+    ('state', 'u1'),
+    ('refs', '<i4'),
+    ('pid', '<i4'),
+    ('generation', '<u4'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('used', '<f8'),
+])
+
+
+# Segments are registered with the resource tracker of the process that
+# created the pool, which its worker processes share: whatever a crashed pool
+# leaves behind is unlinked when they have all exited
+def open_segment(name, size=0):
+    return shared_memory.SharedMemory(name, create=bool(size), size=size)
+
+
+def unlink_segment(name):
+    try:
+        segment = open_segment(name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
+
+
+# Hash of the contents of an .agif file, the same in every process. Hashes are
+# kept by path, size and modification time, so each file is read once.
+file_keys = {}
+
+
+def file_key(file_path):
+    stat = os.stat(file_path)
+    cache_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if cache_key not in file_keys:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as f:
+            if stat.st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    digest.update(mm)
+        file_keys[cache_key] = digest.digest()
+    return file_keys[cache_key]
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# A decoded frame used by this process: array is a read-only (height, width, 4)
+# RGBA view on the shared memory, valid until release(). Frames that could not
+# be shared (a full table) are private copies with the same interface.
+class SharedFrame:
+    def __init__(self, pool, slot, segment, array):
+        self.pool = pool
+        self.slot = slot
+        self.segment = segment
+        self.array = array
+
+    def __enter__(self):
+        return self.array
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    # PIL image on the same memory, without copying the pixels
+    def image(self):
+        from PIL import Image
+        height, width = self.array.shape[:2]
+        return Image.frombuffer('RGBA', (width, height), self.array, 'raw', 'RGBA', 0, 1)
+
+    def release(self):
+        if self.array is None:
+            return
+        self.array = None
+        if self.segment is not None:
+            try:
+                self.segment.close()
+            except BufferError:
+                # Views of the frame are still alive: the mapping is closed
+                # when they are garbage collected
+                pass
+            self.pool.release(self.slot)
+            self.segment = None
+
+
+# Decoded frames shared by several processes. The process creating the pool
+# passes it to its workers (as an argument of the Process, or in the initargs
+# of a ProcessPoolExecutor); the first process asking for a frame decodes it
+# into a shared memory segment, the others map the same memory without
+# decoding or copying it.
+#
+# A table of slots in shared memory, behind a multiprocessing lock, records
+# the frames held, how many processes use each of them and when they were
+# last used. Frames nobody uses are evicted, least recently used first, once
+# the pool holds more than budget bytes; frames in use are never evicted. A
+# process waiting for a frame decoded by a process that died decodes it again.
+class SharedFramePool:
+    def __init__(self, budget=DEFAULT_SHARED_BUDGET, slots=DEFAULT_SLOTS, name=None, context=None):
+        self.name = name or f"agif_{os.getpid()}_{secrets.token_hex(4)}"
+        self.budget = budget
+        # The lock must come from the multiprocessing context starting the workers
+        self.lock = (context or multiprocessing).Lock()
+        self.table_segment = open_segment(self.name, slots * SLOT.itemsize)
+        self.table = np.ndarray(slots, SLOT, buffer=self.table_segment.buf)
+        self.table[:] = np.zeros(slots, SLOT)
+        self.owner = True
+
+    # Sent to the worker processes: they attach to the same table and lock
+    def __getstate__(self):
+        return {'name': self.name, 'budget': self.budget, 'lock': self.lock, 'slots': len(self.table)}
+
+    def __setstate__(self, state):
+        self.name = state['name']
+        self.budget = state['budget']
+        self.lock = state['lock']
+        self.table_segment = open_segment(self.name)
+        self.table = np.ndarray(state['slots'], SLOT, buffer=self.table_segment.buf)
+        self.owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.owner:
+            self.unlink()
+        else:
+            self.close()
+
+    def segment_name(self, slot):
+        return f"{self.name}_{slot}_{self.table[slot]['generation']}"
+
+    # Frames of an .agif file, decoded through the pool
+    def open(self, file_path):
+        return SharedFrameFile(self, file_path)
+
+    # The frame of key (20 bytes), decoded by decode() into an RGBA array if
+    # no process of the pool has it yet
+    def acquire(self, key, decode):
+        while True:
+            with self.lock:
+                slot = self.find(key)
+                if slot is not None and self.table[slot]['state'] == SLOT_READY:
+                    self.table[slot]['refs'] += 1
+                    self.table[slot]['used'] = time.monotonic()
+                    name = self.segment_name(slot)
+                    shape = (int(self.table[slot]['height']), int(self.table[slot]['width']), 4)
+                elif slot is not None and not process_alive(int(self.table[slot]['pid'])):
+                    # Its decoder died: decode it here
+                    self.table[slot]['pid'] = os.getpid()
+                    break
+                elif slot is None:
+                    slot = self.claim(key)
+                    break
+                else:
+                    name = None
+            if name is None:
+                time.sleep(WAIT_INTERVAL)
+                continue
+            try:
+                segment = open_segment(name)
+            except FileNotFoundError:
+                # Removed by a crashed or non-POSIX owner: decoded again
+                self.release(slot, drop=True)
+                continue
+            instrument.count('shared.hit')
+            array = np.ndarray(shape, np.uint8, buffer=segment.buf)
+            array.flags.writeable = False
+            return SharedFrame(self, slot, segment, array)
+
+        instrument.count('shared.miss')
+        try:
+            pixels = np.ascontiguousarray(decode(), dtype=np.uint8)
+        except BaseException:
+            if slot is not None:
+                self.release(slot, drop=True)
+            raise
+        if slot is None:
+            # The table is full of frames in use: this one is not shared
+            pixels.flags.writeable = False
+            return SharedFrame(self, None, None, pixels)
+        return self.publish(slot, pixels)
+
+    # Copy a decoded frame into a new segment and mark its slot ready
+    def publish(self, slot, pixels):
+        height, width = pixels.shape[:2]
+        with self.lock:
+            name = self.segment_name(slot)
+        try:
+            segment = open_segment(name, max(1, pixels.nbytes))
+            array = np.ndarray(pixels.shape, np.uint8, buffer=segment.buf)
+            array[:] = pixels
+        except BaseException:
+            self.release(slot, drop=True)
+            raise
+        array.flags.writeable = False
+        with self.lock:
+            entry = self.table[slot]
+            entry['width'], entry['height'] = width, height
+            entry['state'] = SLOT_READY
+            entry['used'] = time.monotonic()
+            self.evict()
+        return SharedFrame(self, slot, segment, array)
+
+    # Slot of a key, with the lock held
+    def find(self, key):
+        slots = np.flatnonzero((self.table['key'] == key) & (self.table['state'] != SLOT_FREE))
+        return int(slots[0]) if len(slots) else None
+
+    # A free slot for a key decoded by this process, evicting the least
+    # recently used unused frame if needed; None when every slot is in use.
+    # With the lock held.
+    def claim(self, key):
+        free = np.flatnonzero(self.table['state'] == SLOT_FREE)
+        if len(free):
+            slot = int(free[0])
+        else:
+            unused = np.flatnonzero((self.table['state'] == SLOT_READY) & (self.table['refs'] == 0))
+            if not len(unused):
+                return None
+            slot = int(unused[np.argmin(self.table['used'][unused])])
+            self.drop(slot)
+        entry = self.table[slot]
+        entry['key'] = key
+        entry['state'] = SLOT_DECODING
+        entry['refs'] = 1
+        entry['pid'] = os.getpid()
+        entry['generation'] += 1
+        entry['width'] = entry['height'] = 0
+        return slot
+
+    # Remove unused frames, least recently used first, while the pool is over
+    # budget. With the lock held.
+    def evict(self):
+        ready = self.table['state'] == SLOT_READY
+        size = int((self.table['width'][ready].astype(np.int64) * self.table['height'][ready] * 4).sum())
+        if size <= self.budget:
+            return
+        unused = np.flatnonzero(ready & (self.table['refs'] == 0))
+        for slot in unused[np.argsort(self.table['used'][unused])]:
+            size -= int(self.table[slot]['width']) * int(self.table[slot]['height']) * 4
+            self.drop(int(slot))
+            instrument.count('shared.evict')
+            if size <= self.budget:
+                break
+
+    # Free a slot and unlink its segment. With the lock held.
+    def drop(self, slot):
+        if self.table[slot]['state'] == SLOT_READY:
+            unlink_segment(self.segment_name(slot))
+        self.table[slot]['state'] = SLOT_FREE
+        self.table[slot]['refs'] = 0
+
+    # A process stopped using a frame; drop frees a slot whose frame could
+    # not be decoded or published
+    def release(self, slot, drop=False):
+        with self.lock:
+            if drop:
+                self.drop(slot)
+                return
+            entry = self.table[slot]
+            entry['refs'] = max(0, int(entry['refs']) - 1)
+            entry['used'] = time.monotonic()
+            self.evict()
+
+    def stats(self):
+        with self.lock:
+            ready = self.table['state'] == SLOT_READY
+            return {
+                'frames': int(ready.sum()),
+                'in_use': int((ready & (self.table['refs'] > 0)).sum()),
+                'bytes': int((self.table['width'][ready].astype(np.int64) * self.table['height'][ready] * 4).sum()),
+                'budget': self.budget,
+            }
+
+    # Detach this process from the pool. The frames it still holds must be
+    # released first.
+    def close(self):
+        if self.table is None:
+            return
+        self.table = None
+        self.table_segment.close()
+
+    # Remove every frame and the table, in the process that created the pool
+    # once its workers are done
+    def unlink(self):
+        if self.table is None:
+            return
+        with self.lock:
+            for slot in np.flatnonzero(self.table['state'] == SLOT_READY):
+                unlink_segment(self.segment_name(int(slot)))
+            self.table[:] = np.zeros(len(self.table), SLOT)
+        self.close()
+        unlink_segment(self.name)
+
+
+# Frames of one .agif file decoded through a SharedFramePool. Frames this
+# process decodes itself go through a FrameDecoder of its own, so sequential
+# misses decode each frame once.
+class SharedFrameFile:
+    def __init__(self, pool, file_path):
+        self.pool = pool
+        self.key = file_key(file_path)
+        self.reader = AgifReader(file_path)
+        self.decoder = FrameDecoder(self.reader)
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def acquire(self, index):
+        if not 0 <= index < len(self.reader):
+            raise IndexError(f"Frame {index} out of range")
+        return self.pool.acquire(self.key + struct.pack('<I', index),
+                                 lambda: np.asarray(self.decoder.decode(index).convert('RGBA')))
+
+    def close(self):
+        self.reader.close()
@@ -0,0 +1,209 @@
+import io
+import threading
+import zlib
+from .container import (CHUNK, CHUNK_AUDIO, CHUNK_END, CHUNK_FRAME, CRC, HEADER_V3, OPTION_CHECKSUMS, SIGNATURE,
+                        frame_entry, parse_header_v3)
+
+# Audio received before playback starts, in ms
+DEFAULT_PREROLL = 500
+
+# Size reported for audio of unknown length (stream written to a pipe)
+UNKNOWN_SIZE = 2 ** 31 - 1
+
+
+# Exact-size reads from a binary file object or from an iterator of byte chunks
+class ByteSource:
+    def __init__(self, source):
+        self.file = source if hasattr(source, 'read') else None
+        self.chunks = None if self.file is not None else iter(source)
+        self.buffer = bytearray()
+
+    # size bytes, fewer only at the end of the source
+    def read(self, size):
+        while len(self.buffer) < size:
+            if self.file is not None:
+                data = self.file.read(size - len(self.buffer))
+            else:
+                data = next(self.chunks, b'')
+            if not data:
+                break
+            self.buffer += data
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+# Reader for .agif files in the stream layout (version 3) received from a file
+# object (pipe, socket, HTTP response) or an iterator of byte chunks. Only the
+# header is read by the constructor; the chunks are received and their
+# checksums checked on a background thread, and frames can be decoded (it has
+# the entry/frame interface of AgifReader) and the audio played while the rest
+# is still arriving. len() is the number of frames received so far.
+class AgifStreamReader:
+    def __init__(self, source):
+        self.source = ByteSource(source)
+        data = self.source.read(HEADER_V3.size)
+        if data[:4] != SIGNATURE or len(data) < 5:
+            raise ValueError("File not recognized as .agif format")
+        if data[4] != 3:
+            raise ValueError("Only .agif files in the stream layout (version 3) can be read as a stream")
+        header = parse_header_v3(data)
+        self.source.read(max(header['header_size'] - HEADER_V3.size, 0))
+        self.version = 3
+        self.options = header['options']
+        self.width = header['width']
+        self.height = header['height']
+        self.frame_info_size = header['frame_info_size']
+        # Totals of the header, 0 when unknown
+        self.total_frames = header['num_frames']
+        self.gif_duration = header['gif_duration']
+        self.audio_duration = header['audio_duration']
+        self.audio_size = header['audio_size']
+
+        self.condition = threading.Condition()
+        self.position = header['header_size']
+        self.entries = []
+        self.frames = []
+        self.audio_data = bytearray()
+        self.audio_time = 0  # ms of audio received
+        self.ended = False
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _receive(self):
+        try:
+            while not self.closed:
+                data = self.source.read(CHUNK.size)
+                if len(data) < CHUNK.size:
+                    raise ValueError(f"Truncated .agif stream at frame {len(self.entries)}")
+                chunk_type, size, timestamp, duration = CHUNK.unpack(data)
+                payload = self.source.read(size)
+                if len(payload) < size:
+                    raise ValueError(f"Truncated .agif stream at frame {len(self.entries)}")
+                offset = self.position + CHUNK.size
+                self.position = offset + size
+                if self.options & OPTION_CHECKSUMS:
+                    data = self.source.read(CRC.size)
+                    if len(data) < CRC.size:
+                        raise ValueError(f"Truncated .agif stream at frame {len(self.entries)}")
+                    if CRC.unpack(data)[0] != zlib.crc32(payload):
+                        raise ValueError(f"Checksum mismatch in .agif stream at frame {len(self.entries)}")
+                    self.position += CRC.size
+                if chunk_type == CHUNK_END:
+                    break
+
+                with self.condition:
+                    if chunk_type == CHUNK_FRAME:
+                        info_size = min(self.frame_info_size, size)
+                        self.frames.append(payload[info_size:])
+                        self.entries.append(frame_entry(payload[:info_size], offset + info_size,
+                                                        size - info_size, timestamp, duration))
+                    elif chunk_type == CHUNK_AUDIO:
+                        self.audio_data += payload
+                        self.audio_time = timestamp + duration
+                    self.condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.ended = True
+                if not self.error:
+                    self.gif_duration = self.gif_duration or sum(entry.duration for entry in self.entries)
+                    self.audio_duration = self.audio_duration or self.audio_time
+                    self.audio_size = len(self.audio_data)
+                self.condition.notify_all()
+
+    # Wait until the first frame and `preroll` ms of audio (or the whole
+    # stream) have been received. Returns False on timeout, raises the error
+    # of a stream that ended before its first frame.
+    def wait_ready(self, preroll=DEFAULT_PREROLL, timeout=None):
+        def ready():
+            return self.ended or (self.entries and self.audio_time >= preroll)
+
+        with self.condition:
+            if not self.condition.wait_for(ready, timeout):
+                return False
+        if not self.entries:
+            raise self.error or ValueError("The .agif stream has no frames")
+        return True
+
+    def entry(self, index):
+        if not 0 <= index < len(self.entries):
+            raise IndexError(f"Frame {index} out of range")
+        return self.entries[index]
+
+    def frame(self, index):
+        self.entry(index)
+        return memoryview(self.frames[index])
+
+    # Audio received so far
+    def audio(self):
+        with self.condition:
+            return memoryview(bytes(self.audio_data))
+
+    # File object over the audio for pygame.mixer.music.load, readable while
+    # the audio is being received
+    def audio_file(self):
+        return AudioStream(self)
+
+    # Stops receiving after the current chunk; a read blocked on the source
+    # is not interrupted
+    def close(self):
+        self.closed = True
+
+
+# Binary file object over the audio of an AgifStreamReader. Sequential reads
+# wait for the data to arrive. Reads past the received data, like the checks
+# for tags at the end of the file done by decoders when opening it, return
+# zeros without waiting: the stream layout stores no tags at the end.
+class AudioStream(io.RawIOBase):
+    def __init__(self, reader):
+        self.reader = reader
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def size(self):
+        return self.reader.audio_size or UNKNOWN_SIZE
+
+    def readinto(self, buffer):
+        reader = self.reader
+        with reader.condition:
+            if self.position == len(reader.audio_data):
+                reader.condition.wait_for(lambda: reader.ended or len(reader.audio_data) > self.position)
+            available = len(reader.audio_data)
+            if self.position < available:
+                data = reader.audio_data[self.position:self.position + len(buffer)]
+            elif reader.ended:
+                data = b''
+            else:
+                data = bytes(min(len(buffer), max(self.size() - self.position, 0)))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size()
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
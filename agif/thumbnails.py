@@ -0,0 +1,111 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from .container import AgifReader
+from .frames import FrameDecoder
+
+DEFAULT_SIZE = (160, 160)
+
+
+# Scale an image to fit in size, keeping the aspect ratio. Large reductions
+# start with Image.reduce (integer box downscaling, much cheaper than a
+# resampling filter over the full frame), the rest is resampled.
+def fit(image, size):
+    image = image.convert('RGBA')
+    factor = min(image.width // size[0], image.height // size[1])
+    if factor >= 2:
+        image = image.reduce(factor)
+    image.thumbnail(size, Image.LANCZOS)
+    return image
+
+
+# Decode frame `index`, or the frame shown at `time_ms`, of an open reader.
+# Only the frames from the previous keyframe are decoded.
+def extract_frame(reader, index=None, time_ms=None):
+    if index is None:
+        index = reader.frame_at(time_ms or 0)
+    return FrameDecoder(reader).decode(index)
+
+
+# Poster image of an .agif file: frame `index` (or the frame at `time_ms`,
+# the first frame by default) scaled to fit in size
+def poster(file_path, size=DEFAULT_SIZE, index=None, time_ms=None):
+    with AgifReader(file_path) as reader:
+        return fit(extract_frame(reader, index, time_ms), size)
+
+
+# Contact sheet of every `every`-th frame of an .agif file, each scaled to fit
+# in size, in rows of `columns` thumbnails. The frames are decoded in order,
+# so each keyframe interval is decoded at most once.
+def contact_sheet(file_path, every=10, size=DEFAULT_SIZE, columns=5):
+    with AgifReader(file_path) as reader:
+        decoder = FrameDecoder(reader)
+        thumbnails = [fit(decoder.decode(index), size) for index in range(0, len(reader), max(every, 1))]
+    if not thumbnails:
+        raise ValueError("The .agif file has no frames")
+    columns = min(columns, len(thumbnails))
+    rows = (len(thumbnails) + columns - 1) // columns
+    sheet = Image.new('RGBA', (columns * size[0], rows * size[1]))
+    for number, thumbnail in enumerate(thumbnails):
+        column, row = number % columns, number // columns
+        # Each thumbnail is centered in its cell
+        sheet.paste(thumbnail, (column * size[0] + (size[0] - thumbnail.width) // 2,
+                                row * size[1] + (size[1] - thumbnail.height) // 2))
+    return sheet
+
+
+# Write the poster (or with `every`, the contact sheet) of an .agif file
+def write_thumbnail(file_path, output_path, size=DEFAULT_SIZE, index=None, time_ms=None, every=None):
+    if every:
+        image = contact_sheet(file_path, every, size)
+    else:
+        image = poster(file_path, size, index, time_ms)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    image.save(output_path)
+    return output_path
+
+
+# write_thumbnail for the pool, returning the error message instead of raising
+def thumbnail_job(job):
+    try:
+        write_thumbnail(*job)
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return None
+
+
+# Thumbnail every .agif file under a directory into output_dir (same relative
+# paths, with a .png extension) over a pool of worker processes. Thumbnails
+# newer than their file are skipped. Returns a summary of the run.
+def thumbnail_directory(directory, output_dir, size=DEFAULT_SIZE, index=None, time_ms=None, every=None,
+                        workers=None, log=print):
+    start = time.perf_counter()
+    summary = {'written': 0, 'skipped': 0, 'failed': 0}
+    jobs = []
+    for root, dirs, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.lower().endswith('.agif'):
+                continue
+            file_path = os.path.join(root, name)
+            relative = os.path.relpath(file_path, directory)
+            output_path = os.path.join(output_dir, os.path.splitext(relative)[0] + '.png')
+            if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(file_path):
+                summary['skipped'] += 1
+            else:
+                jobs.append((file_path, output_path, size, index, time_ms, every))
+
+    # Jobs are sent in batches: each one is short, most of the time goes in
+    # reading the few frames needed
+    with ProcessPoolExecutor(workers) as executor:
+        for job, error in zip(jobs, executor.map(thumbnail_job, jobs, chunksize=32)):
+            if error is None:
+                summary['written'] += 1
+            else:
+                summary['failed'] += 1
+                log(f"FAIL  {job[0]}  {error}")
+
+    summary['seconds'] = time.perf_counter() - start
+    log(f"{summary['written']} written, {summary['skipped']} skipped, {summary['failed']} failed "
+        f"in {summary['seconds']:.2f} s ({summary['written'] / max(summary['seconds'], 1e-9):.1f} files/s)")
+    return summary
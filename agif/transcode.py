@@ -0,0 +1,269 @@
+import sys
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+from . import instrument
+from .codecs import encode_frame, get_codec
+from .container import AgifStreamWriter, AgifWriter, CODEC_GIF, OPTION_LOOP
+from .encoder import get_mp3_data, iter_gif_frames
+from .gif import iter_color_tables
+
+# Frames decoded and processed together as one array
+BATCH_SIZE = 32
+
+# Pixels with less alpha are transparent after a palette reduction
+ALPHA_THRESHOLD = 128
+
+# Every n-th pixel (in both directions) of the first batch is sampled to
+# build the palette of a rendition, together with the colors of the whole clip
+PALETTE_SAMPLE_STEP = 4
+
+# Colors of a reduced palette, the last index being kept for transparency
+MAX_PALETTE_COLORS = 255
+
+# A version of the animation: written to output_path, cropped to crop
+# (x, y, width, height in source pixels), scaled down to fit in width x height
+# keeping the aspect ratio, at most fps frames per second (the durations of
+# the dropped frames are merged into the frames shown) and at most colors
+# colors. None leaves a property as in the source.
+Rendition = namedtuple('Rendition', 'output_path width height crop fps colors',
+                       defaults=(None, None, None, None, None))
+
+
+# Area-averaging weights scaling size pixels to new_size: each output pixel
+# is the mean of the source pixels it covers, weighted by the overlap
+def area_weights(size, new_size):
+    scale = size / new_size
+    edges = np.arange(new_size + 1) * scale
+    pixels = np.arange(size)[None, :]
+    overlap = np.minimum(edges[1:, None], pixels + 1) - np.maximum(edges[:-1, None], pixels)
+    return (np.clip(overlap, 0, None) / scale).astype(np.float32)
+
+
+# Scale a stack of RGBA frames (frames, height, width, 4) to width x height.
+# Colors are averaged premultiplied by alpha, so transparent pixels do not
+# bleed into the edges. Both passes are matrix products over the whole stack.
+def resize_stack(stack, width, height):
+    frames, source_height, source_width, _ = stack.shape
+    if (source_width, source_height) == (width, height):
+        return stack
+    pixels = stack.astype(np.float32)
+    pixels[..., :3] *= pixels[..., 3:] / 255
+
+    rows = area_weights(source_height, height)
+    pixels = np.matmul(rows, pixels.reshape(frames, source_height, source_width * 4))
+    columns = area_weights(source_width, width)
+    pixels = np.matmul(columns, pixels.reshape(frames * height, source_width, 4)).reshape(frames, height, width, 4)
+
+    alpha = pixels[..., 3:]
+    pixels[..., :3] = np.divide(pixels[..., :3] * 255, alpha, out=np.zeros_like(pixels[..., :3]), where=alpha > 0)
+    return np.clip(np.rint(pixels), 0, 255).astype(np.uint8)
+
+
+# Palette of at most colors RGB colors for a stack of frames, by median cut
+# over a sample of its opaque pixels (a single PIL call). The extra colors
+# (e.g. clip_colors) weigh as much as the whole sample.
+def build_palette(stack, colors, extra=None):
+    sample = stack[:, ::PALETTE_SAMPLE_STEP, ::PALETTE_SAMPLE_STEP].reshape(-1, 4)
+    opaque = sample[sample[:, 3] >= ALPHA_THRESHOLD][:, :3]
+    if extra is not None and len(extra):
+        weight = max(1, len(opaque) // len(extra))
+        opaque = np.concatenate([opaque, np.repeat(extra, weight, axis=0)])
+    if not len(opaque):
+        return np.zeros((1, 3), dtype=np.uint8)
+    image = Image.fromarray(np.ascontiguousarray(opaque).reshape(1, -1, 3), 'RGB')
+    quantized = image.quantize(min(max(colors, 1), 256), Image.MEDIANCUT)
+    used = len(quantized.getcolors(256))
+    return np.array(quantized.getpalette()[:used * 3], dtype=np.uint8).reshape(-1, 3)
+
+
+# Nearest palette color of every RGB color with 5 bits per channel, indexed
+# by (r >> 3) << 10 | (g >> 3) << 5 | b >> 3
+def palette_lut(palette):
+    levels = np.arange(32, dtype=np.float32) * 8 + 4
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), -1).reshape(-1, 3)
+    palette = palette.astype(np.float32)
+    # |a - b|^2 without the |a|^2 term, which is the same for every color of the palette
+    distances = (palette ** 2).sum(1)[None, :] - 2 * grid @ palette.T
+    return distances.argmin(1).astype(np.uint8)
+
+
+# Map a stack of RGBA frames to palette indices, transparent pixels to the
+# index transparent
+def quantize_stack(stack, lut, transparent):
+    rgb = stack[..., :3] >> 3
+    keys = (rgb[..., 0].astype(np.uint16) << 10) | (rgb[..., 1].astype(np.uint16) << 5) | rgb[..., 2]
+    return np.where(stack[..., 3] >= ALPHA_THRESHOLD, lut[keys], transparent).astype(np.uint8)
+
+
+# Palette image of a quantized frame: stored as indices (e.g. a palette PNG),
+# a quarter of the size of the RGBA pixels before compression
+def palette_image(indices, palette):
+    image = Image.fromarray(indices, 'P')
+    image.putpalette(palette.tobytes() + bytes(3))
+    image.info['transparency'] = len(palette)
+    return image
+
+
+# Colors of every frame of a GIF, from their color tables: read without
+# decoding the frames, they bring the colors appearing late in the clip into
+# the palettes built from its first frames
+def clip_colors(gif_path):
+    with open(gif_path, 'rb') as f:
+        data = f.read()
+    colors = [np.zeros((0, 3), dtype=np.uint8)]
+    for table, transparent in iter_color_tables(data):
+        rgb = np.frombuffer(table, dtype=np.uint8).reshape(-1, 3)
+        if transparent is not None and transparent < len(rgb):
+            rgb = np.delete(rgb, transparent, 0)
+        colors.append(rgb)
+    return np.unique(np.concatenate(colors), axis=0)
+
+
+# Crop box of a rendition in the source, clamped to the source size
+def crop_box(rendition, source_size):
+    if rendition.crop is None:
+        return 0, 0, source_size[0], source_size[1]
+    x, y, width, height = rendition.crop
+    x, y = min(max(x, 0), source_size[0] - 1), min(max(y, 0), source_size[1] - 1)
+    return x, y, min(x + max(width, 1), source_size[0]), min(y + max(height, 1), source_size[1])
+
+
+# Size of a rendition: the crop box scaled down to fit in width x height
+def rendition_size(rendition, source_size):
+    left, top, right, bottom = crop_box(rendition, source_size)
+    width, height = right - left, bottom - top
+    scale = min((rendition.width or width) / width, (rendition.height or height) / height, 1)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+# Writes one rendition from the batches of decoded source frames
+class RenditionWriter:
+    def __init__(self, rendition, source_size, codec, level, layout, mp3_data, mp3_duration, colors=None):
+        self.rendition = rendition
+        self.box = crop_box(rendition, source_size)
+        self.size = rendition_size(rendition, source_size)
+        self.interval = 1000 / rendition.fps if rendition.fps else 0
+        self.codec_id = get_codec(codec).id
+        self.level = level
+        self.next_time = 0
+        self.pending = None  # [frame, duration] of the last frame, until the next one is known
+        self.palette = None
+        self.lut = None
+        self.colors = colors
+        self.mp3_data = mp3_data
+        self.mp3_duration = mp3_duration
+        if layout == 'stream':
+            self.writer = AgifStreamWriter(rendition.output_path, OPTION_LOOP, *self.size)
+            self.writer.set_audio(mp3_data, mp3_duration)
+        elif layout == 'index':
+            self.writer = AgifWriter(rendition.output_path, OPTION_LOOP, *self.size)
+        else:
+            raise ValueError(f"Unknown layout: {layout}")
+        self.layout = layout
+
+    # stack holds the frames starting at the given timestamps
+    def add_batch(self, stack, timestamps, durations):
+        kept = []
+        for index, timestamp in enumerate(timestamps):
+            if timestamp >= self.next_time:
+                kept.append(index)
+                self.next_time = timestamp + self.interval
+        if not kept:
+            self.pending[1] += sum(durations)
+            return
+
+        left, top, right, bottom = self.box
+        frames = self.process(stack[:, top:bottom, left:right][kept])
+        kept = set(kept)
+        number = 0
+        for index, duration in enumerate(durations):
+            if index in kept:
+                self.write_pending()
+                self.pending = [frames[number], duration]
+                number += 1
+            else:
+                self.pending[1] += duration
+
+    def process(self, frames):
+        with instrument.span('transcode.resize', frames=len(frames)):
+            frames = resize_stack(frames, *self.size)
+        if self.rendition.colors:
+            with instrument.span('transcode.quantize', frames=len(frames)):
+                if self.palette is None:
+                    self.palette = build_palette(frames, min(self.rendition.colors, MAX_PALETTE_COLORS),
+                                                 self.colors)
+                    self.lut = palette_lut(self.palette)
+                frames = quantize_stack(frames, self.lut, len(self.palette))
+        return frames
+
+    def write_pending(self):
+        if self.pending is not None:
+            frame, duration = self.pending
+            if self.palette is not None:
+                image = palette_image(frame, self.palette)
+            else:
+                image = Image.fromarray(frame, 'RGBA')
+            with instrument.span('frame.encode', codec=self.codec_id):
+                data = encode_frame(image, self.codec_id, self.level)
+            with instrument.span('file.write'):
+                self.writer.add_frame(data, duration, 0, 0, 0, self.codec_id)
+            self.pending = None
+
+    def close(self):
+        self.write_pending()
+        if self.layout == 'index':
+            self.writer.set_audio(self.mp3_data, self.mp3_duration)
+        self.writer.close()
+
+
+# Batches of decoded frames: (RGBA stack, timestamps, durations)
+def iter_frame_batches(gif_path, batch_size=BATCH_SIZE):
+    timestamp = 0
+    batch = []
+    for image, duration in iter_gif_frames(gif_path):
+        batch.append((np.asarray(image.convert('RGBA')), duration))
+        if len(batch) == batch_size:
+            yield timestamp, batch
+            timestamp += sum(duration for frame, duration in batch)
+            batch = []
+    if batch:
+        yield timestamp, batch
+
+
+# Transcode a GIF and an MP3 into several renditions (see Rendition), each
+# written as an .agif file, from a single decoding pass over the GIF (the
+# palettes also read its color tables, without decoding them). The frames
+# are processed in batches of batch_size as NumPy arrays: cropping,
+# area-averaging scaling and the palette reduction work on the whole batch
+# at once. The frames are re-encoded with codec (not gif, whose frames are
+# copied from the source), as palette images for the renditions with colors,
+# and the audio is the same for every rendition.
+def transcode_agif(gif_path, mp3_path, renditions, codec='png', compress_level=None, bitrate=None,
+                   layout='index', batch_size=BATCH_SIZE):
+    if get_codec(codec).id == CODEC_GIF:
+        raise ValueError("Transcoded frames cannot use the gif codec")
+    mp3_data, sample_rate, channels, sample_width, mp3_duration = get_mp3_data(mp3_path, bitrate)
+    with Image.open(gif_path) as gif:
+        source_size = gif.size
+    colors = clip_colors(gif_path) if any(rendition.colors for rendition in renditions) else None
+
+    writers = []
+    try:
+        for rendition in renditions:
+            writers.append(RenditionWriter(rendition, source_size, codec, compress_level, layout,
+                                           mp3_data, mp3_duration, colors))
+        for timestamp, batch in iter_frame_batches(gif_path, batch_size):
+            durations = [duration for frame, duration in batch]
+            timestamps = list(np.cumsum([0] + durations[:-1]) + timestamp)
+            stack = np.stack([frame for frame, duration in batch])
+            for writer in writers:
+                writer.add_batch(stack, timestamps, durations)
+        for writer in writers:
+            writer.close()
+    except BaseException:
+        # The files written so far are left incomplete, as by create_agif
+        for writer in writers:
+            writer.writer.__exit__(*sys.exc_info())
+        raise
+    return [writer.size for writer in writers]
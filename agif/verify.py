@@ -0,0 +1,167 @@
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from .container import (CHUNK, CHUNK_AUDIO, CHUNK_FRAME, CODEC_LZ4, CRC, FRAME_DELTA, HEADER_V1, OPTION_CHECKSUMS,
+                        AgifReader)
+from .mp3 import find_first_frame
+
+# Bytes of audio searched for the first MP3 frame
+AUDIO_PROBE_SIZE = 64 * 1024
+
+
+# Check the structure of an .agif file and, with checksums, the CRC32 of its
+# frames, audio and index. Nothing is decoded: it runs at the speed of
+# reading the file. Returns the list of problems found, empty for a valid file.
+def validate(file_path, checksums=True):
+    try:
+        reader = AgifReader(file_path)
+    except (OSError, ValueError) as e:
+        return [str(e)]
+    with reader:
+        if reader.version == 3:
+            problems = validate_chunks(reader, checksums)
+        else:
+            problems = validate_index(reader, checksums)
+        problems += validate_audio(reader)
+    return problems
+
+
+def validate_index(reader, checksums):
+    problems = []
+    size = len(reader.mm)
+    if reader.version == 1:
+        mp3_size = HEADER_V1.unpack_from(reader.mm)[3]
+        if reader.audio_size < mp3_size:
+            problems.append(f"Truncated audio data: {reader.audio_size} of {mp3_size} bytes")
+
+    check = checksums and reader.version == 2 and reader.options & OPTION_CHECKSUMS
+    if check:
+        index = reader.mm[reader.index_offset:reader.index_offset + reader.num_frames * reader.entry_size]
+        if zlib.crc32(index) != reader.index_crc:
+            # The entries cannot be trusted, the frames are not checked
+            return problems + ["Checksum mismatch in the index"]
+
+    timestamp = 0
+    for index in range(reader.num_frames):
+        entry = reader.entry(index)
+        if entry.offset + entry.size > size:
+            problems.append(f"Frame {index} is truncated")
+            continue
+        frame_end = entry.offset + entry.size
+        if reader.version == 2 and not reader.gif_offset <= entry.offset <= frame_end <= reader.index_offset:
+            problems.append(f"Frame {index} is outside of the frame data")
+        if entry.timestamp != timestamp:
+            problems.append(f"Frame {index} has timestamp {entry.timestamp} instead of {timestamp}")
+        timestamp = entry.timestamp + entry.duration
+        if index == 0 and entry.flags & FRAME_DELTA:
+            problems.append("The first frame is a delta frame")
+        if entry.codec > CODEC_LZ4:
+            problems.append(f"Frame {index} has unknown codec {entry.codec}")
+        if check and zlib.crc32(reader.view[entry.offset:entry.offset + entry.size]) != entry.crc:
+            problems.append(f"Checksum mismatch in frame {index}")
+    if reader.version == 2 and timestamp != reader.gif_duration:
+        problems.append(f"GIF duration is {reader.gif_duration} ms, the frames last {timestamp} ms")
+
+    if check and zlib.crc32(reader.audio()) != reader.audio_crc:
+        problems.append("Checksum mismatch in the audio data")
+    return problems
+
+
+# The reader has already walked the chunks, checking that they fit in the file
+def validate_chunks(reader, checksums):
+    problems = []
+    timestamp = 0
+    for index in range(reader.num_frames):
+        entry = reader.entry(index)
+        if entry.timestamp != timestamp:
+            problems.append(f"Frame {index} has timestamp {entry.timestamp} instead of {timestamp}")
+        timestamp = entry.timestamp + entry.duration
+        if entry.codec > CODEC_LZ4:
+            problems.append(f"Frame {index} has unknown codec {entry.codec}")
+    if reader.num_frames and reader.entry(0).flags & FRAME_DELTA:
+        problems.append("The first frame is a delta frame")
+
+    if checksums and reader.options & OPTION_CHECKSUMS:
+        frame = 0
+        for offset in reader.chunk_offsets:
+            chunk_type, size, chunk_timestamp, duration = CHUNK.unpack_from(reader.mm, offset)
+            payload = reader.view[offset + CHUNK.size:offset + CHUNK.size + size]
+            if zlib.crc32(payload) != CRC.unpack_from(reader.mm, offset + CHUNK.size + size)[0]:
+                if chunk_type == CHUNK_FRAME:
+                    problems.append(f"Checksum mismatch in frame {frame}")
+                elif chunk_type == CHUNK_AUDIO:
+                    problems.append(f"Checksum mismatch in the audio chunk at {chunk_timestamp} ms")
+                else:
+                    problems.append(f"Checksum mismatch in the chunk at offset {offset}")
+            payload.release()
+            frame += chunk_type == CHUNK_FRAME
+    return problems
+
+
+# The audio must start with MP3 frames (or an ID3 tag); only frame headers are read
+def validate_audio(reader):
+    if not reader.audio_size:
+        return []
+    audio = reader.audio()
+    try:
+        find_first_frame(bytes(audio[:AUDIO_PROBE_SIZE]))
+    except ValueError:
+        return ["The audio data is not MP3"]
+    finally:
+        audio.release()
+    return []
+
+
+# validate for the pool: (path, problems)
+def validate_job(job):
+    file_path, checksums = job
+    try:
+        return file_path, validate(file_path, checksums)
+    except Exception as e:
+        return file_path, [f"{type(e).__name__}: {e}"]
+
+
+# .agif files of the given paths, searching directories recursively
+def iter_agif_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.agif'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+# Validate many files over a pool of worker processes (serially with
+# workers=1), logging the invalid ones. Returns a summary of the run.
+def validate_files(paths, checksums=True, workers=None, verbose=False, log=print):
+    start = time.perf_counter()
+    summary = {'valid': 0, 'invalid': 0, 'bytes': 0}
+    jobs = ((path, checksums) for path in iter_agif_paths(paths))
+
+    def record(file_path, problems):
+        summary['invalid' if problems else 'valid'] += 1
+        if os.path.isfile(file_path):
+            summary['bytes'] += os.path.getsize(file_path)
+        if problems:
+            log(f"FAIL  {file_path}")
+            for problem in problems:
+                log(f"      {problem}")
+        elif verbose:
+            log(f"ok    {file_path}")
+
+    if workers == 1:
+        for job in jobs:
+            record(*validate_job(job))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            for result in executor.map(validate_job, jobs, chunksize=16):
+                record(*result)
+
+    summary['seconds'] = time.perf_counter() - start
+    log(f"{summary['valid']} valid, {summary['invalid']} invalid in {summary['seconds']:.2f} s "
+        f"({summary['bytes'] / max(summary['seconds'], 1e-9) / 1e6:.1f} MB/s)")
+    return summary
@@ -1,56 +1,18 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk, UnidentifiedImageError
-from pydub import AudioSegment
-import struct
-import io
-import pygame
+from PIL import ImageTk
+from agif import instrument
+from agif.manager import PlaybackManager
 
 # Define colors
 LIGHT_PINK = "#FFB6C1"  # Light Pink
 PAPYRUS_YELLOW = "#FAEBD7"  # Papyrus Yellow
 
-# Utility functions for creating the AGIF file
-def get_gif_frames(gif_path):
-    gif = Image.open(gif_path)
-    frames = []
-    try:
-        while True:
-            # Save the frame with higher compression
-            frame_io = io.BytesIO()
-            gif.save(frame_io, format='PNG', optimize=True, compress_level=9)
-            frames.append(frame_io.getvalue())
-            gif.seek(gif.tell() + 1)
-    except EOFError:
-        pass
-    return frames
-
-def get_mp3_data(mp3_path, bitrate=64):
-    audio = AudioSegment.from_file(mp3_path, format="mp3")
-    mp3_buffer = io.BytesIO()
-    audio.export(mp3_buffer, format="mp3", bitrate=f"{bitrate}k")  # Reduce bitrate
-    return mp3_buffer.getvalue(), audio.frame_rate, audio.channels, audio.sample_width
-
+# Create the AGIF file keeping the original GIF frames and a reduced MP3 bitrate
 def create_agif(gif_path, mp3_path, output_path):
-    frames = get_gif_frames(gif_path)
-    mp3_data, sample_rate, channels, sample_width = get_mp3_data(mp3_path)
-
-    agif_header = struct.pack(
-        '<4sBBII',
-        b'AGIF',
-        1,
-        len(frames),
-        len(mp3_data),
-        0
-    )
-
-    with open(output_path, 'wb') as f:
-        f.write(agif_header)
-        for frame in frames:
-            frame_header = struct.pack('<I', len(frame))
-            f.write(frame_header)
-            f.write(frame)
-        f.write(mp3_data)
+    # The encoder (with pydub) is only imported when a file is created
+    from agif.encoder import create_agif as encode_agif
+    encode_agif(gif_path, mp3_path, output_path, bitrate=64, codec='gif')
     messagebox.showinfo("Success", f"AGIF file created: {output_path}")
 
 # Function to select GIF
@@ -77,73 +39,40 @@ def create_agif_button():
     if output_path:
         create_agif(gif, mp3, output_path)
 
-# Function to read .agif file
-def read_agif(file_path):
-    with open(file_path, 'rb') as f:
-        header = f.read(14)  # Read the 14-byte header
-        signature, version, num_frames, mp3_size, options = struct.unpack('<4sBBII', header)
-        
-        if signature != b'AGIF':
-            raise ValueError("File not recognized as .agif format")
-
-        frames = []
-        for _ in range(num_frames):
-            frame_size_data = f.read(4)
-            frame_size = struct.unpack('<I', frame_size_data)[0]
-            frame_data = f.read(frame_size)
-            frames.append(frame_data)
-        
-        mp3_data = f.read(mp3_size)
-        
-    return frames, mp3_data
-
-# Function to convert GIF frames to PIL images
-def frames_to_images(frames):
-    images = []
-    for index, frame in enumerate(frames):
-        try:
-            img = Image.open(io.BytesIO(frame))
-            images.append(img)
-        except UnidentifiedImageError as e:
-            print(f"Error converting frame {index}: {e}")
-    return images
-
-# GUI Player for AGIF using tkinter
+# GUI Player for AGIF using tkinter: all the players are driven by the
+# playback manager, which shares the mixer, the timer and the frame memory
 class AgifPlayer(tk.Toplevel):
-    def __init__(self, frames, mp3_data, gif_duration, mp3_duration):
+    def __init__(self, agif_path):
         super().__init__()
-        self.frames = frames
-        self.gif_duration = gif_duration
-        self.mp3_data = mp3_data
-        self.frame_index = 0
         self.label = tk.Label(self)
         self.label.pack()
-        
-        # Start audio in a separate thread
-        pygame.mixer.init()
-        pygame.mixer.music.load(io.BytesIO(mp3_data))
-        pygame.mixer.music.play(-1)  # Play in infinite loop
 
-        # Start GIF animation
-        self.update_frame()
+        # Read the .agif file and start playing it: frames are only decoded when they are needed
+        try:
+            self.playback = manager.open(agif_path, self.show)
+        except Exception:
+            self.destroy()
+            raise
 
         # Override the destroy method to stop the audio
         self.protocol("WM_DELETE_WINDOW", self.on_close)
-    
-    def update_frame(self):
-        frame_image = ImageTk.PhotoImage(self.frames[self.frame_index])
-        self.label.config(image=frame_image)
-        self.label.image = frame_image
-        self.frame_index = (self.frame_index + 1) % len(self.frames)
-        
-        # Update GIF frame every 'gif_duration' ms
-        self.after(self.gif_duration, self.update_frame)
+
+    def show(self, playback, frame_index):
+        # PhotoImages already built are reused on the following loops
+        frame_image = playback.photos.get(frame_index)
+        if frame_image is None:
+            image = playback.frames[frame_index]
+            with instrument.span('photo.build'):
+                frame_image = ImageTk.PhotoImage(image)
+            playback.photos.put(frame_index, frame_image, image.width * image.height * 4)
+        with instrument.span('tk.blit'):
+            self.label.config(image=frame_image)
+            self.label.image = frame_image
 
     def on_close(self):
-        # Stop audio playback
-        pygame.mixer.music.stop()
-        pygame.mixer.quit()
-        
+        # Stop the animation and audio of this player only, and close the file
+        manager.close(self.playback)
+
         # Close the window
         self.destroy()
 
@@ -154,29 +83,19 @@ def open_and_play_agif():
         return
     
     try:
-        # Read the .agif file
-        frames, mp3_data = read_agif(agif_path)
-        
-        # Convert GIF frames to images
-        images = frames_to_images(frames)
-        
-        if not images:
-            messagebox.showerror("Error", "Cannot convert GIF frames.")
-            return
-        
-        # Calculate durations in milliseconds
-        gif_duration = 1000 // len(frames)  # Duration of each GIF frame
-        mp3_duration = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3").duration_seconds * 1000
-
         # Create and start the player
-        player = AgifPlayer(images, mp3_data, gif_duration, mp3_duration)
+        player = AgifPlayer(agif_path)
         player.title("AGIF Player")
     except Exception as e:
         messagebox.showerror("Error", str(e))
 
+# Optional instrumentation: AGIF_TRACE=file.jsonl or AGIF_STATS=1
+instrument.configure_from_environment()
+
 # Create the main interface
 root = tk.Tk()
 root.title("AGIF Tool")
+manager = PlaybackManager(root)
 root.configure(bg=LIGHT_PINK)
 
 # Create tabs
@@ -224,3 +143,4 @@ tk.Button(tab_play, text="Open and View AGIF", command=open_and_play_agif, bg=PA
 
 # Add tabs to the root window
 root.mainloop()
+manager.close_all()
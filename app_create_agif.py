@@ -1,51 +1,10 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image
-from pydub import AudioSegment
-import struct
-import io
-
-# Funzioni di utility per la creazione del file AGIF
-def get_gif_frames(gif_path):
-    gif = Image.open(gif_path)
-    frames = []
-    try:
-        while True:
-            frames.append(gif.copy())
-            gif.seek(gif.tell() + 1)
-    except EOFError:
-        pass
-    return frames
-
-def get_mp3_data(mp3_path):
-    audio = AudioSegment.from_file(mp3_path, format="mp3")
-    mp3_buffer = io.BytesIO()
-    audio.export(mp3_buffer, format="mp3")
-    return mp3_buffer.getvalue(), audio.frame_rate, audio.channels, audio.sample_width
+from agif.encoder import create_agif as encode_agif
 
+# Funzione per creare il file AGIF, mantenendo i frame originali della GIF
 def create_agif(gif_path, mp3_path, output_path):
-    frames = get_gif_frames(gif_path)
-    mp3_data, sample_rate, channels, sample_width = get_mp3_data(mp3_path)
-
-    agif_header = struct.pack(
-        '<4sBBII',
-        b'AGIF',
-        1,
-        len(frames),
-        len(mp3_data),
-        0
-    )
-
-    with open(output_path, 'wb') as f:
-        f.write(agif_header)
-        for frame in frames:
-            with io.BytesIO() as frame_buffer:
-                frame.save(frame_buffer, format='PNG')
-                frame_bytes = frame_buffer.getvalue()
-            frame_header = struct.pack('<I', len(frame_bytes))
-            f.write(frame_header)
-            f.write(frame_bytes)
-        f.write(mp3_data)
+    encode_agif(gif_path, mp3_path, output_path, codec='gif')
     messagebox.showinfo("Successo", f"File AGIF creato: {output_path}")
 
 # Funzione per selezionare GIF
@@ -1,79 +1,43 @@
-import struct
-from PIL import Image, ImageTk, UnidentifiedImageError
-import pygame
+from PIL import ImageTk
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import io
-from pydub import AudioSegment
-from pydub.playback import _play_with_simpleaudio
+from agif import instrument
+from agif.manager import PlaybackManager
 
-# Funzione per leggere il file .agif
-def read_agif(file_path):
-    with open(file_path, 'rb') as f:
-        header = f.read(14)  # Leggi l'header di 14 byte
-        signature, version, num_frames, mp3_size, options = struct.unpack('<4sBBII', header)
-        
-        if signature != b'AGIF':
-            raise ValueError("File non riconosciuto come formato .agif")
-
-        frames = []
-        for _ in range(num_frames):
-            frame_size_data = f.read(4)
-            frame_size = struct.unpack('<I', frame_size_data)[0]
-            frame_data = f.read(frame_size)
-            frames.append(frame_data)
-        
-        mp3_data = f.read(mp3_size)
-        
-    return frames, mp3_data
-
-# Funzione per convertire i frame della GIF in immagini PIL
-def frames_to_images(frames):
-    images = []
-    for index, frame in enumerate(frames):
-        try:
-            img = Image.open(io.BytesIO(frame))
-            images.append(img)
-        except UnidentifiedImageError as e:
-            print(f"Errore nella conversione del frame {index}: {e}")
-    return images
-
-# Player Grafico con tkinter per la GIF
+# Player Grafico con tkinter per la GIF: tutti i player sono guidati dal
+# gestore della riproduzione, che condivide il mixer, il timer e la memoria dei frame
 class AgifPlayer(tk.Toplevel):
-    def __init__(self, frames, mp3_data, gif_duration, mp3_duration):
+    def __init__(self, agif_path):
         super().__init__()
-        self.frames = frames
-        self.gif_duration = gif_duration
-        self.mp3_data = mp3_data
-        self.frame_index = 0
         self.label = tk.Label(self)
         self.label.pack()
-        
-        # Avvia l'audio in un thread separato
-        pygame.mixer.init()
-        pygame.mixer.music.load(io.BytesIO(mp3_data))
-        pygame.mixer.music.play(-1)  # Riproduci in loop infinito
 
-        # Avvia l'animazione della GIF
-        self.update_frame()
+        # Lettura del file .agif e avvio della riproduzione: i frame vengono decodificati solo quando servono
+        try:
+            self.playback = manager.open(agif_path, self.show)
+        except Exception:
+            self.destroy()
+            raise
 
         # Override del metodo destroy per fermare l'audio
         self.protocol("WM_DELETE_WINDOW", self.on_close)
-    
-    def update_frame(self):
-        frame_image = ImageTk.PhotoImage(self.frames[self.frame_index])
-        self.label.config(image=frame_image)
-        self.label.image = frame_image
-        self.frame_index = (self.frame_index + 1) % len(self.frames)
-        
-        # Aggiorna il frame della GIF ogni 'gif_duration' ms
-        self.after(self.gif_duration, self.update_frame)
+
+    def show(self, playback, frame_index):
+        # Le PhotoImage già create vengono riusate nei giri successivi
+        frame_image = playback.photos.get(frame_index)
+        if frame_image is None:
+            image = playback.frames[frame_index]
+            with instrument.span('photo.build'):
+                frame_image = ImageTk.PhotoImage(image)
+            playback.photos.put(frame_index, frame_image, image.width * image.height * 4)
+        with instrument.span('tk.blit'):
+            self.label.config(image=frame_image)
+            self.label.image = frame_image
 
     def on_close(self):
-        # Ferma la riproduzione dell'audio
-        pygame.mixer.music.stop()
-        pygame.mixer.quit()
-        
+        # Ferma l'animazione e l'audio di questo player soltanto, e chiudi il file
+        manager.close(self.playback)
+
         # Chiudi la finestra
         self.destroy()
 
@@ -84,31 +48,22 @@ def open_and_play_agif():
         return
     
     try:
-        # Lettura del file .agif
-        frames, mp3_data = read_agif(agif_path)
-        
-        # Converti i frame della GIF in immagini
-        images = frames_to_images(frames)
-        
-        if not images:
-            messagebox.showerror("Errore", "Non è possibile convertire i frame della GIF.")
-            return
-        
-        # Calcola le durate in millisecondi
-        gif_duration = 1000 // len(frames)  # Durata di ogni frame della GIF
-        mp3_duration = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3").duration_seconds * 1000
-
         # Crea e avvia il player
-        player = AgifPlayer(images, mp3_data, gif_duration, mp3_duration)
+        player = AgifPlayer(agif_path)
         player.title("AGIF Player")
     except Exception as e:
         messagebox.showerror("Errore", str(e))
 
+# Strumentazione opzionale: AGIF_TRACE=file.jsonl o AGIF_STATS=1
+instrument.configure_from_environment()
+
 # Creazione dell'interfaccia principale
 root = tk.Tk()
 root.title("AGIF Viewer")
+manager = PlaybackManager(root)
 
 tk.Label(root, text="Player per il formato AGIF").pack(pady=10)
 tk.Button(root, text="Apri e Visualizza AGIF", command=open_and_play_agif).pack(pady=20)
 
 root.mainloop()
+manager.close_all()
@@ -0,0 +1,319 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+from agif import AgifReader, create_agif, read_agif
+from agif.cache import FrameProvider
+from agif.clock import PlaybackClock
+from agif.frames import FrameDecoder
+from agif.stream import AgifStreamReader
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Synthetic clips: (name, frames, width, height, palette colors, motion)
+CASES = [
+    ('sprite-small', 60, 160, 120, 64, 'sprite'),
+    ('sprite-medium', 300, 320, 240, 256, 'sprite'),
+    ('scroll-full', 120, 320, 240, 256, 'scroll'),
+    ('long-clip', 1000, 128, 96, 16, 'sprite'),
+]
+QUICK_CASES = [
+    ('sprite-small', 30, 96, 72, 64, 'sprite'),
+    ('scroll-full', 30, 96, 72, 256, 'scroll'),
+]
+
+# Code timed from interpreter start, each run in a fresh interpreter: the
+# cost paid by every CLI run and worker process. python is the interpreter
+# alone, for reference.
+STARTUP_CODE = {
+    'python': "pass",
+    'import': "import agif",
+    'read': "from agif import AgifReader",
+    'cli': "import runpy, sys\nsys.argv = ['agif', '--help']\ntry:\n    runpy.run_module('agif', run_name='__main__')"
+           "\nexcept SystemExit:\n    pass",
+}
+
+# Dependencies that reading containers and the CLI must not load at startup
+HEAVY_MODULES = ('tkinter', 'pygame', 'pydub', 'PIL', 'numpy', 'asyncio')
+
+# Encoder settings compared on every case
+CODECS = {
+    'png': {'codec': 'png'},
+    'png-delta': {'codec': 'png', 'keyframe_interval': 30},
+    'gif': {'codec': 'gif'},
+    'zlib': {'codec': 'zlib'},
+    'lzma': {'codec': 'lzma', 'compress_level': 9},
+    'gif-stream': {'codec': 'gif', 'layout': 'stream'},
+}
+
+
+# Animated GIF with a gradient background and either a small moving sprite
+# or the whole picture scrolling
+def make_gif(path, frames, width, height, colors, motion, duration=40):
+    y, x = np.mgrid[0:height, 0:width]
+    background = np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1),
+                           np.full_like(x, 128)], axis=2).astype(np.uint8)
+    images = []
+    for index in range(frames):
+        if motion == 'scroll':
+            pixels = np.roll(background, index * 3, axis=1)
+        else:
+            pixels = background.copy()
+            left = index * 2 % max(width - 16, 1)
+            top = index % max(height - 16, 1)
+            pixels[top:top + 16, left:left + 16] = (255, 255, 0)
+        images.append(Image.fromarray(pixels).quantize(colors))
+    images[0].save(path, save_all=True, append_images=images[1:], duration=duration, loop=0)
+
+
+# Silent MPEG-1 Layer III stream (128 kbps, 44.1 kHz, stereo): frames with a
+# valid header and zeroed side information decode to silence
+def make_mp3(path, duration_ms):
+    header = b'\xff\xfb\x90\x00'
+    frame = header + bytes(417 - len(header))
+    with open(path, 'wb') as f:
+        f.write(frame * max(1, duration_ms * 44100 // 1152 // 1000))
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def stage_create(gif_path, mp3_path, agif_path, options):
+    start = time.perf_counter()
+    create_agif(gif_path, mp3_path, agif_path, **options)
+    seconds = time.perf_counter() - start
+    with AgifReader(agif_path) as reader:
+        frames = len(reader)
+    input_bytes = os.path.getsize(gif_path) + os.path.getsize(mp3_path)
+    output_bytes = os.path.getsize(agif_path)
+    return {
+        'seconds': seconds,
+        'frames_per_second': frames / seconds,
+        'mb_per_second': input_bytes / seconds / 1e6,
+        'output_bytes': output_bytes,
+        'size_ratio': output_bytes / input_bytes,
+    }
+
+
+def stage_open(agif_path, repeat=20):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with AgifReader(agif_path) as reader:
+            reader.entry(len(reader) - 1)
+        times.append(time.perf_counter() - start)
+    return {'open_ms': statistics.median(times) * 1000}
+
+
+def stage_read(agif_path):
+    start = time.perf_counter()
+    frames, mp3_data = read_agif(agif_path)
+    seconds = time.perf_counter() - start
+    return {
+        'seconds': seconds,
+        'frames_per_second': len(frames) / seconds,
+        'mb_per_second': os.path.getsize(agif_path) / seconds / 1e6,
+    }
+
+
+# Time until the first frame can be shown: the whole index for files in the
+# index layout, the first frame and the audio preroll for the stream layout
+def stage_first_frame(agif_path):
+    start = time.perf_counter()
+    with open(agif_path, 'rb') as f:
+        if f.read(5)[4] == 3:
+            f.seek(0)
+            reader = AgifStreamReader(f)
+            reader.wait_ready()
+            FrameDecoder(reader).decode(0).load()
+            reader.close()
+        else:
+            with AgifReader(agif_path) as reader:
+                FrameDecoder(reader).decode(0).load()
+    return {'first_frame_ms': (time.perf_counter() - start) * 1000}
+
+
+# Decode every frame, like frames_to_images in the players
+def stage_decode(agif_path):
+    with AgifReader(agif_path) as reader:
+        decoder = FrameDecoder(reader)
+        start = time.perf_counter()
+        for index in range(len(reader)):
+            decoder.decode(index).load()
+        seconds = time.perf_counter() - start
+        frames = len(reader)
+    return {'seconds': seconds, 'frames_per_second': frames / seconds}
+
+
+# Headless run of the AgifPlayer scheduling loop: frames come from a
+# FrameProvider and are converted to RGBA in place of the PhotoImage, the
+# timer is a sleep of the delay given by the PlaybackClock
+def stage_playback(agif_path, seconds):
+    with AgifReader(agif_path) as reader:
+        frames = FrameProvider(reader)
+        durations = [reader.entry(index).duration for index in range(len(reader))]
+        clock = PlaybackClock(durations)
+        errors = []
+        shown_at = shown_index = None
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            index = clock.tick()
+            frames[index].convert('RGBA')
+            now = time.monotonic()
+            if index != shown_index:
+                if shown_index is not None and index == (shown_index + 1) % len(durations):
+                    errors.append(abs((now - shown_at) * 1000 - durations[shown_index]))
+                shown_at, shown_index = now, index
+            time.sleep(clock.next_delay() / 1000)
+        frames.close()
+
+    stats = clock.stats()
+    return {
+        'frames_shown': stats['frames_shown'],
+        'dropped_frames': stats['dropped_frames'],
+        'max_drift_ms': stats['max_drift'],
+        'jitter_mean_ms': statistics.mean(errors) if errors else 0,
+        'jitter_p95_ms': sorted(errors)[int(len(errors) * 0.95)] if errors else 0,
+    }
+
+
+STAGES = {
+    'create': stage_create,
+    'open': stage_open,
+    'read': stage_read,
+    'first_frame': stage_first_frame,
+    'decode': stage_decode,
+    'playback': stage_playback,
+}
+
+
+def run_stage(stage, kwargs):
+    result = STAGES[stage](**kwargs)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+# Every stage runs in a fresh process, so that its peak RSS is its own
+def run_isolated(pool_context, stage, **kwargs):
+    with pool_context.Pool(1) as pool:
+        return pool.apply(run_stage, (stage, kwargs))
+
+
+# Median startup time of each STARTUP_CODE in ms, and the heavy modules it loads
+def run_startup(repeat=10):
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, code in STARTUP_CODE.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, cwd=cwd)
+            times.append(time.perf_counter() - start)
+        check = code + f"\nimport sys\nprint('loaded:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        output = subprocess.run([sys.executable, '-c', check], check=True, capture_output=True, text=True,
+                                cwd=cwd).stdout
+        loaded = output[output.rindex('loaded:') + len('loaded:'):].strip()
+        modules = loaded.split(',') if loaded else []
+        results[name] = {'ms': statistics.median(times) * 1000, 'heavy_modules': len(modules),
+                         'modules': modules}
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(cases, playback_seconds, quick=False, log=print):
+    context = multiprocessing.get_context('spawn')
+    workdir = tempfile.mkdtemp(prefix='agif-bench-')
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': {},
+    }
+    startup = results['results']['startup'] = run_startup(3 if quick else 10)
+    for name, stats in startup.items():
+        log(f"{'startup/' + name:28} {stats['ms']:8.1f} ms  loads {', '.join(stats['modules']) or 'nothing heavy'}")
+    try:
+        for name, frames, width, height, colors, motion in cases:
+            gif_path = os.path.join(workdir, name + '.gif')
+            mp3_path = os.path.join(workdir, name + '.mp3')
+            make_gif(gif_path, frames, width, height, colors, motion)
+            make_mp3(mp3_path, frames * 40)
+
+            for codec, options in CODECS.items():
+                key = f"{name}/{codec}"
+                agif_path = os.path.join(workdir, f"{name}-{codec}.agif")
+                case = results['results'][key] = {}
+                case['create'] = run_isolated(context, 'create', gif_path=gif_path, mp3_path=mp3_path,
+                                              agif_path=agif_path, options=options)
+                case['open'] = run_isolated(context, 'open', agif_path=agif_path)
+                case['read'] = run_isolated(context, 'read', agif_path=agif_path)
+                case['first_frame'] = run_isolated(context, 'first_frame', agif_path=agif_path)
+                case['decode'] = run_isolated(context, 'decode', agif_path=agif_path)
+                case['playback'] = run_isolated(context, 'playback', agif_path=agif_path,
+                                                seconds=playback_seconds)
+                log(f"{key:28} create {case['create']['frames_per_second']:8.1f} f/s  "
+                    f"size x{case['create']['size_ratio']:.2f}  open {case['open']['open_ms']:.2f} ms  "
+                    f"first frame {case['first_frame']['first_frame_ms']:.1f} ms  "
+                    f"decode {case['decode']['frames_per_second']:8.1f} f/s  "
+                    f"jitter {case['playback']['jitter_mean_ms']:.1f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+# Print the change of every metric against a previous results file
+def compare(previous, current, log=print):
+    for key, stages in current['results'].items():
+        for stage, metrics in stages.items():
+            old_metrics = previous['results'].get(key, {}).get(stage, {})
+            for metric, value in metrics.items():
+                old = old_metrics.get(metric)
+                if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                    log(f"{key:28} {stage:9} {metric:20} {old:12.3f} -> {value:12.3f}  "
+                        f"({(value - old) / old * 100:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for AGIF encoding, decoding and playback")
+    parser.add_argument('--quick', action='store_true', help="run small cases only")
+    parser.add_argument('--playback-seconds', type=float, default=2.0)
+    parser.add_argument('--output', help="save the results to this JSON file")
+    parser.add_argument('--compare', help="compare with a previous JSON results file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(QUICK_CASES if args.quick else CASES, args.playback_seconds, args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
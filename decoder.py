@@ -1,32 +1,6 @@
-import struct
 from PIL import Image
 import io
-
-def read_agif(file_path):
-    with open(file_path, 'rb') as f:
-        # Leggi l'header del file (14 byte come specificato nell'encoder)
-        header = f.read(14)
-
-        # Decodifica l'header secondo la struttura definita nell'encoder
-        signature, version, num_frames, mp3_size, options = struct.unpack('<4sBBII', header)
-        
-        # Verifica che il formato sia corretto
-        if signature != b'AGIF':
-            raise ValueError("File non riconosciuto come formato .agif")
-
-        # Leggi i frame della GIF
-        frames = []
-        for _ in range(num_frames):
-            frame_size_data = f.read(4)  # Leggi la dimensione del frame
-            frame_size = struct.unpack('<I', frame_size_data)[0]
-            frame_data = f.read(frame_size)  # Leggi il frame in base alla dimensione
-            frames.append(frame_data)
-        
-        # Leggi i dati MP3
-        mp3_data = f.read(mp3_size)  # Leggi la dimensione dei dati MP3
-        
-        # Restituisci i dati letti
-        return frames, mp3_data
+from agif import AgifReader, read_agif
 
 # Esempio di utilizzo
 file_agif_name = 'files/output.agif'  # Inserire il nome del file .agif
@@ -35,6 +9,11 @@ frames, mp3_data = read_agif(file_agif_name)
 print(f"Numero di frame GIF: {len(frames)}")
 print(f"Dimensione dati MP3: {len(mp3_data)} bytes")
 
+# Accesso diretto a un singolo frame tramite l'indice, senza leggere tutto il file
+with AgifReader(file_agif_name) as reader:
+    print(f"Versione del formato: {reader.version}")
+    print(f"Dimensione dell'ultimo frame: {len(reader.frame(len(reader) - 1))} bytes")
+
 '''
 
 #############################################
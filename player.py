@@ -1,96 +1,127 @@
-import struct
-from PIL import Image, ImageTk, UnidentifiedImageError
-import pygame
+from PIL import ImageTk
 import tkinter as tk
 import io
-from pydub import AudioSegment
-from pydub.playback import _play_with_simpleaudio
-
-# Funzione per leggere il file .agif
-def read_agif(file_path):
-    with open(file_path, 'rb') as f:
-        header = f.read(14)  # Leggi l'header di 14 byte (non 16)
-        signature, version, num_frames, mp3_size, options = struct.unpack('<4sBBII', header)
-        
-        if signature != b'AGIF':
-            raise ValueError("File non riconosciuto come formato .agif")
-
-        frames = []
-        for _ in range(num_frames):
-            frame_size_data = f.read(4)
-            frame_size = struct.unpack('<I', frame_size_data)[0]
-            frame_data = f.read(frame_size)
-            frames.append(frame_data)
-        
-        mp3_data = f.read(mp3_size)
-        
-    return frames, mp3_data
-
-# Funzione per convertire i frame della GIF in immagini PIL
-def frames_to_images(frames):
-    images = []
-    for index, frame in enumerate(frames):
-        # Verifica i primi byte del frame per controllare se è un'immagine valida
-        print(f"Frame {index} header: {frame[:10]}")
-        
-        try:
-            img = Image.open(io.BytesIO(frame))
-            images.append(img)
-        except UnidentifiedImageError as e:
-            print(f"Errore nella conversione del frame {index}: {e}")
-    return images
+import sys
+import urllib.request
+from agif import AgifReader, instrument
+from agif.audio import MusicPlayer, SoundPlayer, audio_duration, default_cache_dir
+from agif.cache import FrameProvider, LruCache
+from agif.clock import PlaybackClock
+from agif.stream import AgifStreamReader
 
 # Funzione per riprodurre l'audio MP3
 def play_mp3(mp3_data):
+    # pydub viene importato solo qui: cerca ffmpeg all'importazione
+    from pydub import AudioSegment
+    from pydub.playback import _play_with_simpleaudio
     audio = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3")
     _play_with_simpleaudio(audio)
 
 # Player Grafico con tkinter per la GIF
 class AgifPlayer(tk.Tk):
-    def __init__(self, frames, mp3_data, gif_duration, mp3_duration):
+    def __init__(self, frames, mp3_data, durations, mp3_duration, gif_duration=None):
         super().__init__()
         self.frames = frames
-        self.gif_duration = gif_duration
+        self.durations = durations
         self.mp3_data = mp3_data
         self.frame_index = 0
+        self.photos = LruCache()
         self.label = tk.Label(self)
         self.label.pack()
         
-        # Avvia l'audio in un thread separato
-        pygame.mixer.init()
-        pygame.mixer.music.load(io.BytesIO(mp3_data))
-        pygame.mixer.music.play(-1)  # Riproduci in loop infinito
+        # L'audio viene decodificato una sola volta (e tenuto nella cache su disco),
+        # in streaming invece è un file che si riempie durante la ricezione
+        if hasattr(mp3_data, 'read'):
+            self.audio = MusicPlayer(mp3_data)
+        else:
+            self.audio = SoundPlayer(mp3_data, default_cache_dir())
+        self.audio.play()  # Riproduci in loop infinito
+
+        # L'orologio di riproduzione segue la posizione dell'audio
+        self.clock = PlaybackClock(durations, self.audio.length or mp3_duration, self.audio.position, gif_duration)
+
+        # Alla chiusura il prossimo aggiornamento viene annullato
+        self.after_id = None
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Avvia l'animazione della GIF
         self.update_frame()
+
+    def on_close(self):
+        if self.after_id is not None:
+            self.after_cancel(self.after_id)
+            self.after_id = None
+        self.audio.stop()
+        self.destroy()
     
     def update_frame(self):
-        frame_image = ImageTk.PhotoImage(self.frames[self.frame_index])
-        self.label.config(image=frame_image)
-        self.label.image = frame_image
-        self.frame_index = (self.frame_index + 1) % len(self.frames)
+        # In streaming i frame arrivano durante la riproduzione
+        reader = self.frames.reader
+        while len(self.clock.durations) < len(reader):
+            self.clock.add_frame(reader.entry(len(self.clock.durations)).duration)
+        if getattr(reader, 'ended', False) and self.clock.gif_duration == float('inf'):
+            self.clock.set_gif_duration(self.clock.end)
+
+        # Il frame da mostrare dipende dalla posizione dell'audio: i frame in ritardo vengono saltati
+        self.frame_index = self.clock.tick()
+
+        # Le PhotoImage già create vengono riusate nei giri successivi
+        frame_image = self.photos.get(self.frame_index)
+        if frame_image is None:
+            image = self.frames[self.frame_index]
+            with instrument.span('photo.build'):
+                frame_image = ImageTk.PhotoImage(image)
+            self.photos.put(self.frame_index, frame_image, image.width * image.height * 4)
+        with instrument.span('tk.blit'):
+            self.label.config(image=frame_image)
+            self.label.image = frame_image
         
-        # Aggiorna il frame della GIF ogni 'gif_duration' ms
-        self.after(self.gif_duration, self.update_frame)
+        # L'attesa viene calcolata dopo il disegno, così il tempo di decodifica non si accumula
+        self.after_id = self.after(self.clock.next_delay(), self.update_frame)
+
+# Riproduzione progressiva di un file .agif in formato stream (versione 3)
+# ricevuto da un file object o da un iteratore di blocchi di byte: il player
+# parte dopo il primo frame e un breve preroll audio
+def play_stream(source):
+    reader = AgifStreamReader(source)
+    reader.wait_ready()
+    frames = FrameProvider(reader)
+    durations = [reader.entry(index).duration for index in range(len(reader))]
+
+    # Durata totale della GIF dall'header, sconosciuta se il file è stato scritto su una pipe
+    gif_duration = reader.gif_duration if reader.total_frames else float('inf')
+    player = AgifPlayer(frames, reader.audio_file(), durations, reader.audio_duration, gif_duration)
+    player.mainloop()
+    frames.close()
+    reader.close()
 
 # Funzione principale
 def main():
-    # Percorso al file .agif
-    agif_path = 'files/bradipo2.agif'
-    
-    # Lettura del file .agif
-    frames, mp3_data = read_agif(agif_path)
+    # Strumentazione opzionale: AGIF_TRACE=file.jsonl o AGIF_STATS=1
+    instrument.configure_from_environment()
+
+    # Percorso al file .agif: "-" legge uno stream dallo standard input, un URL lo scarica
+    agif_path = sys.argv[1] if len(sys.argv) > 1 else 'files/bradipo2.agif'
+    if agif_path == '-':
+        return play_stream(sys.stdin.buffer)
+    if agif_path.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(agif_path) as response:
+            return play_stream(response)
     
-    # Converti i frame della GIF in immagini
-    images = frames_to_images(frames)
+    # Lettura del file .agif: i frame vengono decodificati solo quando servono
+    reader = AgifReader(agif_path)
+    frames = FrameProvider(reader)
+    durations = [reader.entry(index).duration for index in range(len(reader))]
+    mp3_data = bytes(reader.audio())
     
-    # Calcola le durate in millisecondi
-    gif_duration = 1000 // len(frames)  # Durata di ogni frame della GIF
-    mp3_duration = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3").duration_seconds * 1000
+    # Durata dell'audio dall'header del file, senza decodificarlo
+    mp3_duration = audio_duration(reader)
 
     # Crea e avvia il player
-    player = AgifPlayer(images, mp3_data, gif_duration, mp3_duration)
+    player = AgifPlayer(frames, mp3_data, durations, mp3_duration)
     player.mainloop()
+    frames.close()
+    reader.close()
 
 # Esegui il player
 if __name__ == '__main__':
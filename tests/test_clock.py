@@ -0,0 +1,26 @@
+from agif.clock import PlaybackClock
+
+
+def test_repeated_ticks_inside_a_frame_do_not_count_as_drift():
+    now = [0]
+    clock = PlaybackClock([100, 100, 100], position=lambda: now[0])
+    for now[0] in (0, 30, 60, 99):
+        assert clock.tick() == 0
+    now[0] = 100
+    assert clock.tick() == 1
+    now[0] = 150
+    assert clock.tick() == 1
+    assert clock.repeated_frames == 4
+    assert clock.max_drift == 0
+
+
+def test_late_frame_change_is_drift():
+    now = [0]
+    clock = PlaybackClock([100, 100, 100], position=lambda: now[0])
+    clock.tick()
+    now[0] = 130
+    assert clock.tick() == 1
+    assert clock.drift == 30
+    now[0] = 190
+    clock.tick()
+    assert clock.max_drift == 30
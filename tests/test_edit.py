@@ -0,0 +1,75 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from agif import AgifReader
+from agif.container import CODEC_GIF, FRAME_DELTA
+from agif.edit import AgifEditor
+from agif.encoder import create_agif
+from agif.frames import FrameDecoder
+
+FILES = os.path.join(os.path.dirname(__file__), os.pardir, 'files')
+GIF_PATH = os.path.join(FILES, 'example.gif')
+MP3_PATH = os.path.join(FILES, 'clacson.mp3')
+
+
+def decode_all(file_path):
+    with AgifReader(file_path) as reader:
+        decoder = FrameDecoder(reader)
+        return [np.asarray(decoder.decode(index).convert('RGBA')) for index in range(len(reader))]
+
+
+# A square moving over a transparent screen, each frame cleared after it is
+# shown (disposal 2)
+def write_disposal_gif(gif_path):
+    frames = []
+    for number in range(8):
+        image = Image.new('RGBA', (32, 32))
+        image.paste((255, 0, 0, 255), (number * 3, 4, number * 3 + 6, 10))
+        frames.append(image)
+    frames[0].save(gif_path, save_all=True, append_images=frames[1:], duration=40, loop=0, disposal=2)
+
+
+@pytest.mark.parametrize('codec, keyframe_interval', [('gif', None), ('png', 4)])
+def test_drop_frames_before_a_delta_frame(tmp_path, codec, keyframe_interval):
+    file_path = str(tmp_path / 'out.agif')
+    create_agif(GIF_PATH, MP3_PATH, file_path, codec=codec, keyframe_interval=keyframe_interval)
+    frames = decode_all(file_path)
+    with AgifReader(file_path) as reader:
+        assert reader.entry(3).flags & FRAME_DELTA
+
+    with AgifEditor(file_path) as editor:
+        editor.drop_frames(1, 3)
+    assert [frame.tobytes() for frame in decode_all(file_path)] == [frame.tobytes() for frame in frames[:1] + frames[3:]]
+
+
+def test_drop_frames_of_gif_frames_disposed_to_background(tmp_path):
+    gif_path = str(tmp_path / 'clip.gif')
+    file_path = str(tmp_path / 'out.agif')
+    write_disposal_gif(gif_path)
+    create_agif(gif_path, MP3_PATH, file_path, codec='gif')
+    frames = decode_all(file_path)
+    with AgifReader(file_path) as reader:
+        assert reader.entry(4).flags & FRAME_DELTA
+
+    with AgifEditor(file_path) as editor:
+        editor.drop_frames(2, 4)
+    assert [frame.tobytes() for frame in decode_all(file_path)] == [frame.tobytes() for frame in frames[:2] + frames[4:]]
+    with AgifReader(file_path) as reader:
+        # Drawn over a cleared screen, the next frame keeps its GIF block
+        assert [reader.entry(index).codec for index in range(len(reader))] == [CODEC_GIF] * 6
+
+
+def test_discarded_edit_leaves_the_file_unchanged(tmp_path):
+    file_path = str(tmp_path / 'out.agif')
+    create_agif(GIF_PATH, MP3_PATH, file_path)
+    with open(file_path, 'rb') as f:
+        data = f.read()
+
+    with pytest.raises(RuntimeError):
+        with AgifEditor(file_path) as editor:
+            editor.set_audio(b'\xff' * 1000, 100)
+            editor.drop_frames(0)
+            raise RuntimeError
+    with open(file_path, 'rb') as f:
+        assert f.read() == data
@@ -0,0 +1,25 @@
+import os
+import pytest
+from agif import AgifReader
+from agif.container import FRAME_DELTA
+from agif.encoder import create_agif
+
+FILES = os.path.join(os.path.dirname(__file__), os.pardir, 'files')
+GIF_PATH = os.path.join(FILES, 'example.gif')
+MP3_PATH = os.path.join(FILES, 'clacson.mp3')
+
+
+def test_keyframe_interval_with_gif_codec_is_refused(tmp_path):
+    output_path = tmp_path / 'out.agif'
+    with pytest.raises(ValueError, match='gif codec'):
+        create_agif(GIF_PATH, MP3_PATH, output_path, codec='gif', keyframe_interval=10)
+    assert not output_path.exists()
+
+
+def test_keyframe_interval_with_png_codec_stores_deltas(tmp_path):
+    output_path = tmp_path / 'out.agif'
+    create_agif(GIF_PATH, MP3_PATH, output_path, codec='png', keyframe_interval=4)
+    with AgifReader(output_path) as reader:
+        flags = [reader.entry(index).flags for index in range(len(reader))]
+    assert not flags[0] & FRAME_DELTA
+    assert any(flag & FRAME_DELTA for flag in flags)
@@ -0,0 +1,45 @@
+import io
+from PIL import Image
+from agif.container import AgifWriter
+from agif.export import export_directory, export_gif
+
+
+def write_silent_clip(file_path):
+    with AgifWriter(file_path) as writer:
+        for color in ((255, 0, 0), (0, 0, 255)):
+            data = io.BytesIO()
+            Image.new('RGBA', (8, 8), color + (255,)).save(data, 'PNG')
+            writer.add_frame(data.getvalue(), 100)
+        writer.set_audio(b'')
+
+
+def test_second_run_skips_files_without_audio(tmp_path):
+    library, output_dir = tmp_path / 'library', tmp_path / 'exported'
+    library.mkdir()
+    write_silent_clip(library / 'silent.agif')
+
+    first = export_directory(library, output_dir, ('gif', 'mp3'), workers=1, log=lambda line: None)
+    assert (first['exported'], first['skipped'], first['failed']) == (1, 0, 0)
+    assert (output_dir / 'silent.gif').exists()
+    assert not (output_dir / 'silent.mp3').exists()
+
+    second = export_directory(library, output_dir, ('gif', 'mp3'), workers=1, log=lambda line: None)
+    assert (second['exported'], second['skipped'], second['failed']) == (0, 1, 0)
+
+
+def test_exported_frames_keep_their_transparency(tmp_path):
+    file_path, gif_path = tmp_path / 'clip.agif', tmp_path / 'clip.gif'
+    with AgifWriter(file_path, 0, 8, 8) as writer:
+        # Two colors: their palette is much shorter than 255 colors
+        image = Image.new('RGBA', (8, 8))
+        image.paste((255, 0, 0, 255), (0, 0, 4, 8))
+        data = io.BytesIO()
+        image.save(data, 'PNG')
+        writer.add_frame(data.getvalue(), 100)
+        writer.set_audio(b'')
+    export_gif(file_path, gif_path)
+
+    with Image.open(gif_path) as gif:
+        frame = gif.convert('RGBA')
+    assert frame.getpixel((1, 1)) == (255, 0, 0, 255)
+    assert frame.getpixel((6, 6))[3] == 0
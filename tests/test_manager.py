@@ -0,0 +1,68 @@
+import io
+from PIL import Image
+from agif.container import AgifWriter
+from agif.manager import PlaybackManager
+
+
+# The after/after_cancel methods of a Tk widget, run by hand
+class FakeRoot:
+    def __init__(self):
+        self.pending = {}
+        self.next_id = 0
+
+    def after(self, delay, callback):
+        self.next_id += 1
+        self.pending[self.next_id] = (delay, callback)
+        return self.next_id
+
+    def after_cancel(self, after_id):
+        self.pending.pop(after_id, None)
+
+
+def write_frames(file_path, durations):
+    with AgifWriter(file_path) as writer:
+        for number, duration in enumerate(durations):
+            data = io.BytesIO()
+            Image.new('RGBA', (4, 4), (number * 40, 0, 0, 255)).save(data, 'PNG')
+            writer.add_frame(data.getvalue(), duration)
+        writer.set_audio(b'')
+
+
+# Two playbacks with different frame durations, on a fake monotonic clock in
+# which drawing a frame takes 0.7 ms: their next frame changes fall between
+# whole milliseconds
+def test_one_show_per_frame(tmp_path):
+    clips = {'a.agif': [40, 60, 100, 30], 'b.agif': [33, 33, 34]}
+    now = [1000.0]
+    root = FakeRoot()
+    manager = PlaybackManager(root, cache_dir=str(tmp_path))
+    manager.now = lambda: now[0]
+    shows = {}
+
+    def show(playback, index):
+        shows[playback].append(index)
+        now[0] += 0.7
+
+    try:
+        for name, durations in clips.items():
+            write_frames(tmp_path / name, durations)
+            playback = manager.open(tmp_path / name, show)
+            shows[playback] = []
+            start = now[0]
+            # The position of a playback without audio, driven by the fake clock
+            playback.clock.position = lambda start=start: int(now[0] - start)
+            now[0] += 0.3
+
+        while now[0] < 1000 + 2000:
+            (after_id, (delay, callback)), = root.pending.items()
+            del root.pending[after_id]
+            now[0] += delay
+            callback()
+
+        for playback, indices in shows.items():
+            count = len(playback.clock.durations)
+            assert all(index == number % count for number, index in enumerate(indices))
+            assert len(indices) >= 2000 // playback.clock.gif_duration * count
+            assert playback.clock.repeated_frames == 0
+    finally:
+        manager.close_all()
@@ -0,0 +1,31 @@
+import os
+from agif.container import AgifReader, AgifStreamWriter
+from agif.mp3 import split_mp3
+
+MP3_PATH = os.path.join(os.path.dirname(__file__), os.pardir, 'files', 'clacson.mp3')
+# ID3v1 tag: 128 bytes after the last MP3 frame
+ID3V1_TAG = b'TAG' + b'title'.ljust(30, b'\0') + bytes(95)
+
+
+def read_mp3():
+    with open(MP3_PATH, 'rb') as f:
+        return f.read()
+
+
+def test_split_keeps_the_data_after_the_last_frame():
+    data = read_mp3() + ID3V1_TAG
+    chunks = list(split_mp3(data, 500))
+    assert b''.join(chunk for timestamp, duration, chunk in chunks) == data
+    timestamp, duration, chunk = chunks[-1]
+    assert chunk == ID3V1_TAG and duration == 0
+
+
+def test_stream_round_trip_is_byte_exact(tmp_path):
+    data = read_mp3() + ID3V1_TAG
+    output_path = tmp_path / 'stream.agif'
+    with AgifStreamWriter(output_path) as writer:
+        writer.set_audio(data, 1000)
+        writer.add_frame(b'frame', 100)
+    with AgifReader(output_path) as reader:
+        assert reader.version == 3
+        assert bytes(reader.audio()) == data
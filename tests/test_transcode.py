@@ -0,0 +1,51 @@
+import io
+import os
+from PIL import Image
+from agif import instrument
+from agif.container import AgifReader
+from agif.frames import FrameDecoder
+from agif.instrument import HistogramSink
+from agif.transcode import Rendition, transcode_agif
+
+MP3_PATH = os.path.join(os.path.dirname(__file__), os.pardir, 'files', 'clacson.mp3')
+
+
+# 48 frames: a red and green clip for the first 40, then a blue one, so that
+# the blue frames are not in the first batch of frames
+def write_gif(gif_path):
+    frames = []
+    for number in range(48):
+        color = (0, 0, 255) if number >= 40 else ((255, 0, 0) if number % 2 else (0, 255, 0))
+        image = Image.new('RGB', (64, 48), color)
+        image.paste((255, 255, 255), (number, 0, number + 8, 8))
+        frames.append(image)
+    frames[0].save(gif_path, save_all=True, append_images=frames[1:], duration=50, loop=0)
+
+
+def test_reduced_palette_covers_the_whole_clip(tmp_path):
+    gif_path = tmp_path / 'clip.gif'
+    write_gif(gif_path)
+    full_path, reduced_path = str(tmp_path / 'full.agif'), str(tmp_path / 'reduced.agif')
+    transcode_agif(gif_path, MP3_PATH, [Rendition(full_path), Rendition(reduced_path, colors=8)], batch_size=16)
+
+    with AgifReader(reduced_path) as reader:
+        assert len(reader) == 48
+        # Stored as palette PNGs
+        assert Image.open(io.BytesIO(reader.frame(45))).mode == 'P'
+        last = FrameDecoder(reader).decode(45).convert('RGB')
+        assert last.getpixel((40, 40)) == (0, 0, 255)
+        reduced_size = sum(reader.entry(index).size for index in range(len(reader)))
+    with AgifReader(full_path) as reader:
+        full_size = sum(reader.entry(index).size for index in range(len(reader)))
+    assert reduced_size < full_size
+
+
+def test_transcoding_decodes_the_gif_once(tmp_path):
+    gif_path = tmp_path / 'clip.gif'
+    write_gif(gif_path)
+    renditions = [Rendition(str(tmp_path / 'full.agif')), Rendition(str(tmp_path / 'reduced.agif'), colors=8)]
+    sink = HistogramSink()
+    with instrument.recording(sink):
+        transcode_agif(gif_path, MP3_PATH, renditions, batch_size=16)
+    # One decoded frame per frame of the GIF, palettes included
+    assert len(sink.spans['gif.decode']) == 48